@@ -1,10 +1,23 @@
 from fastapi import APIRouter, HTTPException, Depends, Header
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import List, Dict, Any, Optional
 from datetime import datetime, timedelta, timezone
+import asyncio
+import logging
 import traceback
 import os
-from .database import supabase
+from .database import db, count_users, get_user_emails, recent_events
+from .cache import llm_cache
+from . import image_cache, image_preprocess
+from .courses import course_store
+from .ledger import ledger
+from .observability import latency_report, log_event
+from .analytics import event_buffer
+from .rollups import rollups
+from . import admission
+from .coalesce import single_flight
+from .question_bank import question_bank
+from .settings import ANALYTICS_BATCH_MAX, ANALYTICS_MAX_BACKDATE
 
 router = APIRouter()
 
@@ -12,63 +25,94 @@ router = APIRouter()
 ADMIN_PASSWORD = os.getenv("ADMIN_SECRET", "studia123").strip()
 
 
+def _require_admin(x_admin_password: Optional[str]):
+    if not x_admin_password or x_admin_password.strip() != ADMIN_PASSWORD:
+        raise HTTPException(status_code=403, detail="Mot de passe incorrect")
+
+
 class AnalyticsEvent(BaseModel):
     user_id: str
     event_type: str
     event_data: Dict[str, Any] = {}
+    created_at: Optional[datetime] = None  # heure côté client (événements envoyés par lots)
+
+
+class AnalyticsBatch(BaseModel):
+    events: List[AnalyticsEvent] = Field(..., max_length=ANALYTICS_BATCH_MAX)
+
+
+def _event_row(event: AnalyticsEvent, now: datetime) -> dict:
+    created_at = event.created_at or now
+    if created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    return {
+        "user_id": event.user_id,
+        "event_type": event.event_type,
+        "event_data": event.event_data,
+        # Horodatage client borné à [now - ANALYTICS_MAX_BACKDATE, now] : pas de réécriture de l'historique
+        "created_at": min(max(created_at, now - timedelta(seconds=ANALYTICS_MAX_BACKDATE)), now).isoformat(),
+    }
 
 
 @router.post("/track")
 async def track_event(event: AnalyticsEvent):
-    if not supabase: return {"status": "error"}
-    try:
-        supabase.table('analytics_events').insert({
-            "user_id": event.user_id,
-            "event_type": event.event_type,
-            "event_data": event.event_data,
-            "created_at": datetime.now(timezone.utc).isoformat()
-        }).execute()
-        return {"status": "ok"}
-    except Exception:
-        return {"status": "error"}
+    # Mis en file : l'insertion se fait par lots en arrière-plan
+    if not db: return {"status": "error"}
+    accepted = event_buffer.put([_event_row(event, datetime.now(timezone.utc))])
+    return {"status": "ok" if accepted else "dropped"}
+
+
+@router.post("/track/batch")
+async def track_events(batch: AnalyticsBatch):
+    if not db: return {"status": "error"}
+    now = datetime.now(timezone.utc)
+    accepted = event_buffer.put([_event_row(e, now) for e in batch.events])
+    return {"status": "ok", "accepted": accepted, "dropped": len(batch.events) - accepted}
 
 
 @router.get("/dashboard")
 async def get_admin_stats(x_admin_password: Optional[str] = Header(None)):
     # 1. Vérif Auth
-    if not x_admin_password or x_admin_password.strip() != ADMIN_PASSWORD:
-        raise HTTPException(status_code=403, detail="Mot de passe incorrect")
+    _require_admin(x_admin_password)
 
-    if not supabase:
+    if not db:
         raise HTTPException(status_code=500, detail="Database not configured")
 
     stats = {
-        "total_users": 0, "dau": 0, "wau": 0, "avg_session_time": "0m",
-        "top_feature": "-", "retention_j1": "-", "recent_activity": []
+        "total_users": 0, "dau": 0, "wau": 0, "mau": 0, "avg_session_time": "0m",
+        "top_feature": "-", "retention_j1": "-", "features": [], "daily": [], "recent_activity": []
     }
 
     try:
-        now = datetime.now(timezone.utc)
-        seven_days_ago = (now - timedelta(days=7)).isoformat()
-
-        # --- STATS GLOBALES ---
+        # --- STATS GLOBALES (agrégats mis à jour à l'ingestion, une ligne par jour) ---
+        # Agrégats, nombre d'utilisateurs et derniers événements : requêtes en parallèle
+        summary, total_users, raw_logs = await asyncio.gather(
+            rollups.summary(days=7), count_users(), recent_events(50), return_exceptions=True
+        )
+        if isinstance(raw_logs, Exception):
+            raise raw_logs
+
+        if isinstance(summary, dict):
+            stats.update({k: summary[k] for k in ("dau", "wau", "mau", "features", "daily")})
+            if summary["features"]:
+                stats["top_feature"] = summary["features"][0]["feature"]
+            if summary["sessions"]:
+                minutes, seconds = divmod(int(summary["avg_session_seconds"]), 60)
+                stats["avg_session_time"] = f"{minutes}m{seconds:02d}s" if seconds else f"{minutes}m"
+            if summary["retention_d1"] is not None:
+                stats["retention_j1"] = f"{round(summary['retention_d1'] * 100)}%"
+
+        if isinstance(total_users, int):
+            stats["total_users"] = total_users
+        else:
+            log_event("admin_user_count_failed", logging.WARNING, error=str(total_users))
+
+        # Emails des seuls utilisateurs présents dans le journal
+        user_map = {}
         try:
-            users_res = supabase.table('users').select('id, email', count='exact').execute()
-            stats["total_users"] = users_res.count if users_res.count else 0
-
-            # Création d'un dictionnaire ID -> Email pour l'affichage
-            user_map = {u['id']: u.get('email', 'Inconnu') for u in users_res.data}
-        except:
-            user_map = {}
-
-        # --- RECUPERATION LOGS (Derniers 50 événements) ---
-        logs_res = supabase.table('analytics_events') \
-            .select('*') \
-            .order('created_at', desc=True) \
-            .limit(50) \
-            .execute()
-
-        raw_logs = logs_res.data
+            user_map = await get_user_emails(sorted({log['user_id'] for log in raw_logs if log.get('user_id')}))
+        except Exception as e:
+            log_event("admin_user_lookup_failed", logging.WARNING, error=str(e))
 
         # --- TRAITEMENT DU JOURNAL D'ACTIVITÉ ---
         activity_feed = []
@@ -99,26 +143,58 @@ async def get_admin_stats(x_admin_password: Optional[str] = Header(None)):
 
         stats["recent_activity"] = activity_feed
 
-        # --- CALCULS STATS (Code existant simplifié) ---
-        # (On garde le calcul DAU/WAU pour avoir quand même les chiffres globaux)
-        active_day = set()
-        active_week = set()
-
-        # Pour les stats, on a besoin d'un historique plus large, on refait une requête light si besoin
-        # Ou on utilise les 50 derniers logs comme approximation pour l'instant
-        for log in raw_logs:
-            try:
-                d = datetime.fromisoformat(log['created_at'].replace('Z', '+00:00'))
-                active_week.add(log['user_id'])
-                if d >= (now - timedelta(days=1)): active_day.add(log['user_id'])
-            except:
-                continue
-
-        stats["dau"] = len(active_day)
-        stats["wau"] = len(active_week)
-
         return stats
 
     except Exception as e:
-        print(f"❌ Error Dashboard: {e}")
-        return stats
\ No newline at end of file
+        log_event("admin_dashboard_failed", logging.ERROR, error=str(e))
+        return stats
+
+
+@router.get("/rollups")
+async def get_rollups(days: int = 30, x_admin_password: Optional[str] = Header(None)):
+    """DAU / WAU / MAU, per-day active users, feature counts, sessions and D1 retention cohorts."""
+    _require_admin(x_admin_password)
+    if not 1 <= days <= 366:
+        raise HTTPException(status_code=400, detail="days must be between 1 and 366")
+    summary = await rollups.summary(days=days)
+    if summary is None:
+        raise HTTPException(status_code=404, detail="Rollups disabled")
+    return summary
+
+
+@router.get("/cache")
+async def get_cache_stats(x_admin_password: Optional[str] = Header(None)):
+    _require_admin(x_admin_password)
+    return {"llm": llm_cache.stats(), "ocr": image_cache.stats(), "courses": course_store.stats(), "preprocessing": image_preprocess.stats(), "analytics": event_buffer.stats(), "coalescing": single_flight.stats(), "question_bank": question_bank.stats()}
+
+
+@router.get("/usage")
+async def get_llm_usage(
+        group_by: str = "stage",
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+        x_admin_password: Optional[str] = Header(None)
+):
+    """Token / cost totals from the LLM ledger, grouped by stage, feature, model, user_id or day."""
+    _require_admin(x_admin_password)
+    try:
+        rows = await ledger.aggregate(group_by, since, until)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    totals = {k: sum(r[k] for r in rows) for k in ("calls", "cache_hits", "prompt_tokens", "completion_tokens", "cached_tokens")}
+    totals["cost_usd"] = round(sum(r["cost_usd"] for r in rows), 6)
+    return {"group_by": group_by, "rows": rows, "totals": totals}
+
+
+@router.get("/latency")
+async def get_latency(x_admin_password: Optional[str] = Header(None)):
+    """p50 / p95 / p99 latency (seconds) per endpoint, pipeline stage and external call."""
+    _require_admin(x_admin_password)
+    return latency_report()
+
+
+@router.get("/admission")
+async def get_admission(x_admin_password: Optional[str] = Header(None)):
+    """Slots in use, queued requests and average duration per admission class."""
+    _require_admin(x_admin_password)
+    return admission.stats()
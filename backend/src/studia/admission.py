@@ -0,0 +1,352 @@
+"""
+Admission Control - Per-user token buckets, per-class concurrency caps and a
+weighted fair queue (premium first) in front of the LLM-heavy endpoints
+"""
+import asyncio
+import hashlib
+import heapq
+import hmac
+import ipaddress
+import itertools
+import logging
+import math
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .database import db, get_user
+from .observability import Counter, Gauge, REGISTRY, log_event, register_collector
+from .settings import (
+    ADMISSION_CLASSES, ADMISSION_MAX_WAIT, ADMISSION_PREMIUM_WEIGHT, ADMISSION_PREMIUM_TTL,
+    ADMISSION_BYTES_PER_PAGE, ADMISSION_MAX_BODY_BYTES, ADMISSION_USER_SECRET, ADMISSION_PREMIUM_CACHE_SIZE,
+    TRUSTED_PROXIES, UPLOAD_MAX_TOTAL_BYTES,
+)
+
+# (préfixe de chemin POST, classe, coût en jetons ; None = d'après la taille : une page ~ ADMISSION_BYTES_PER_PAGE)
+# Un lot paie 1 jeton à l'admission, puis 1 par élément supplémentaire une fois le corps lu (Ticket.charge)
+ROUTES: List[Tuple[str, str, Optional[int]]] = [
+    ("/api/extract-text", "vision", None),
+    ("/api/quiz/generate-from-image", "vision", None),
+    ("/api/jobs/quiz/generate-from-image", "vision", None),
+    ("/api/batch/", "generation", 1),
+    ("/api/jobs/", "generation", 1),
+    ("/api/quiz/", "generation", 1),
+    ("/api/flashcards/", "generation", 1),
+    ("/api/path/evaluate", "chat", 1),
+    ("/api/path/", "generation", 1),
+    ("/api/motivation/", "chat", 1),
+    ("/api/chat/", "chat", 1),
+]
+
+rejected = Counter("studia_admission_rejected_total", "Requests refused by admission control", ("class", "reason"))
+queued = Gauge("studia_admission_queued", "Requests waiting for a slot", ("class",))
+in_flight = Gauge("studia_admission_in_flight", "Admitted requests running", ("class",))
+REGISTRY.extend([rejected, queued, in_flight])
+
+
+class Rejected(Exception):
+    def __init__(self, status_code: int, detail: str, retry_after: Optional[float] = None):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate  # jetons par seconde
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, cost: float) -> float:
+        """Take `cost` tokens; returns 0, or the seconds to wait before they are available."""
+        self._refill()
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        return (cost - self.tokens) / self.rate
+
+    def charge(self, cost: float):
+        """Take `cost` tokens for work already admitted, going into debt if needed."""
+        self._refill()
+        self.tokens -= cost
+
+
+class AdmissionClass:
+    """
+    At most `max_in_flight` requests run at once; the others wait in a
+    weighted fair queue: each request gets a virtual finish time
+    max(now, user's previous one) + cost / weight, and the smallest runs next.
+    A user sending many requests only delays their own, and premium users
+    (higher weight) move ahead. Requests whose expected wait exceeds the
+    latency budget are refused at once.
+    """
+
+    def __init__(self, name: str, in_flight: int, rate_per_min: float, burst: float, max_wait: float = ADMISSION_MAX_WAIT):
+        self.name = name
+        self.max_in_flight = in_flight
+        self.rate = rate_per_min / 60
+        self.burst = burst
+        self.max_wait = max_wait
+        self.in_flight = 0
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._heap: List[tuple] = []  # (tag, seq, future)
+        self._seq = itertools.count()
+        self._vtime = 0.0
+        self._finish: Dict[str, float] = {}
+        self._service_time = 5.0  # moyenne glissante de la durée d'une requête
+
+    def _check_rate(self, user: str, cost: float) -> TokenBucket:
+        bucket = self._buckets.get(user)
+        if bucket is None:
+            if len(self._buckets) > 50_000:
+                self._buckets = {k: b for k, b in self._buckets.items() if b.tokens < b.burst}
+            bucket = self._buckets[user] = TokenBucket(self.rate, self.burst)
+        wait = bucket.take(cost)
+        if wait:
+            rejected.inc(self.name, "rate_limited")
+            raise Rejected(429, f"Too many {self.name} requests, retry later", wait)
+        return bucket
+
+    def _waiting(self) -> int:
+        return sum(1 for _, _, future in self._heap if not future.done())
+
+    async def acquire(self, user: str, cost: float, weight: float):
+        cost = min(cost, self.burst)
+        bucket = self._check_rate(user, cost)
+        if self.in_flight < self.max_in_flight and not self._waiting():
+            self.in_flight += 1
+            return
+
+        tag = max(self._vtime, self._finish.get(user, 0.0)) + cost / weight
+        ahead = sum(1 for t, _, future in self._heap if t <= tag and not future.done())
+        expected = (ahead + 1) * self._service_time / self.max_in_flight
+        if expected > self.max_wait:
+            bucket.tokens += cost  # refusée sans être servie : les jetons sont rendus
+            rejected.inc(self.name, "overloaded")
+            raise Rejected(503, f"Server busy ({self.name}), retry later", expected)
+
+        self._finish[user] = tag
+        if len(self._finish) > 50_000:
+            self._finish = {u: t for u, t in self._finish.items() if t > self._vtime}
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (tag, next(self._seq), future))
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.max_wait)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled():
+                self.release(0.0)  # la place venait d'être attribuée : on la rend
+            else:
+                future.cancel()
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            rejected.inc(self.name, "timeout")
+            raise Rejected(503, f"Server busy ({self.name}), retry later", self._service_time)
+
+    def charge(self, user: str, cost: float):
+        """Bill an admitted request for extra work found once its body was read."""
+        bucket = self._buckets.get(user)
+        if bucket is not None and cost > 0:
+            bucket.charge(cost)
+
+    def release(self, duration: Optional[float] = None):
+        if duration:
+            self._service_time = 0.8 * self._service_time + 0.2 * duration
+        self.in_flight -= 1
+        while self._heap:
+            tag, _, future = heapq.heappop(self._heap)
+            if future.done():
+                continue
+            self._vtime = tag
+            self.in_flight += 1
+            future.set_result(None)
+            break
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "queued": self._waiting(),
+            "avg_service_seconds": round(self._service_time, 2),
+        }
+
+
+classes: Dict[str, AdmissionClass] = {name: AdmissionClass(name, **config) for name, config in ADMISSION_CLASSES.items()}
+
+
+def _trusted(address: str) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+        return any(ip in ipaddress.ip_network(proxy, strict=False) for proxy in TRUSTED_PROXIES if proxy != "*")
+    except ValueError:
+        return False
+
+
+def client_ip(peer: Optional[str], forwarded_for: Optional[str]) -> str:
+    """
+    Address of the client behind the trusted proxies (TRUSTED_PROXIES): the
+    rightmost X-Forwarded-For hop that is not a trusted proxy. Hops further
+    left were written by the client and are ignored. Without a trusted peer
+    the header is ignored too.
+    """
+    if not peer:
+        return "?"
+    hops = [hop.strip() for hop in (forwarded_for or "").split(",") if hop.strip()]
+    if not hops or not ("*" in TRUSTED_PROXIES or _trusted(peer)):
+        return peer
+    if "*" in TRUSTED_PROXIES:
+        return hops[-1]
+    for hop in reversed(hops):
+        if not _trusted(hop):
+            return hop
+    return hops[0]
+
+
+def verify_user_token(token: Optional[str]) -> Optional[str]:
+    """
+    User id of a "<user_id>:<expires>:<hmac-sha256 hex>" token signed with
+    ADMISSION_USER_SECRET (minted by the frontend's /api/user-token route for
+    the signed-in Clerk user), or None.
+    """
+    if not token or not ADMISSION_USER_SECRET:
+        return None
+    try:
+        user_id, expires, signature = token.rsplit(":", 2)
+        if int(expires) < time.time():
+            return None
+    except ValueError:
+        return None
+    expected = hmac.new(ADMISSION_USER_SECRET.encode(), f"{user_id}:{expires}".encode(), hashlib.sha256).hexdigest()
+    return user_id if user_id and hmac.compare_digest(signature, expected) else None
+
+
+# user_id vérifié -> (expiration, is_premium), LRU borné (résultats négatifs compris)
+_premium: "OrderedDict[str, Tuple[float, bool]]" = OrderedDict()
+
+
+async def is_premium(user_id: Optional[str]) -> bool:
+    """Premium status of a verified user id (never call it with a client-supplied id)."""
+    if not user_id or not db:
+        return False
+    cached = _premium.get(user_id)
+    if cached and cached[0] > time.time():
+        _premium.move_to_end(user_id)
+        return cached[1]
+    try:
+        user = await get_user(user_id)
+        premium = bool(user and user.get("is_premium"))
+        ttl = ADMISSION_PREMIUM_TTL
+    except Exception as e:
+        log_event("premium_lookup_failed", logging.WARNING, user_id=user_id, error=str(e))
+        premium, ttl = False, 30
+    _premium[user_id] = (time.time() + ttl, premium)
+    _premium.move_to_end(user_id)
+    while len(_premium) > ADMISSION_PREMIUM_CACHE_SIZE:
+        _premium.popitem(last=False)
+    return premium
+
+
+def route_class(method: str, path: str) -> Optional[Tuple[AdmissionClass, Optional[int]]]:
+    if method != "POST":
+        return None
+    for prefix, name, cost in ROUTES:
+        if path.startswith(prefix) and name in classes:
+            return classes[name], cost
+    return None
+
+
+class Ticket:
+    """
+    An admitted request. It holds a slot of its class until `release()`, and
+    `meter()` wraps its ASGI receive so the body actually received is capped
+    and priced: a body without Content-Length (chunked) cannot skip the 413,
+    and a size-priced request is charged for each page beyond the ones billed
+    at admission.
+    """
+
+    def __init__(self, admission: AdmissionClass, user: str, limit: int, billed_pages: Optional[int]):
+        self.admission = admission
+        self.user = user
+        self.limit = limit
+        self.billed_pages = billed_pages
+        self.received = 0
+
+    def charge(self, cost: float):
+        self.admission.charge(self.user, cost)
+
+    def meter(self, receive: Receive) -> Receive:
+        async def metered() -> Message:
+            message = await receive()
+            if message["type"] == "http.request":
+                self.received += len(message.get("body", b""))
+                if self.received > self.limit:
+                    rejected.inc(self.admission.name, "too_large")
+                    raise HTTPException(413, f"Request too large (max {self.limit} bytes)")
+                if self.billed_pages is not None:
+                    pages = math.ceil(self.received / ADMISSION_BYTES_PER_PAGE)
+                    if pages > self.billed_pages:
+                        self.charge(pages - self.billed_pages)
+                        self.billed_pages = pages
+            return message
+        return metered
+
+    def release(self, duration: Optional[float] = None):
+        self.admission.release(duration)
+
+
+class BodyMeterMiddleware:
+    """
+    Pure ASGI middleware that meters the body of requests admitted upstream
+    (Ticket in request.state.admission). It must sit inside every
+    BaseHTTPMiddleware: their task groups would wrap its 413 in an ExceptionGroup.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        ticket = scope.get("state", {}).get("admission") if scope["type"] == "http" else None
+        await self.app(scope, ticket.meter(receive) if ticket is not None else receive, send)
+
+
+async def admit(client_ip: str, user_id: Optional[str], admission: AdmissionClass, cost: Optional[int], body_bytes: Optional[int]) -> Ticket:
+    """
+    Check the declared request size, the caller's rate and wait for a slot.
+    Raises Rejected (413 / 429 / 503); on success the caller must meter the
+    body with `ticket.meter()` and call `ticket.release()`. `user_id` must
+    come from verify_user_token: a verified user gets their own bucket and
+    their premium weight, anyone else is limited per client IP.
+    """
+    user = f"user:{user_id}" if user_id else f"ip:{client_ip}"
+    limit = UPLOAD_MAX_TOTAL_BYTES if cost is None else ADMISSION_MAX_BODY_BYTES
+    if body_bytes and body_bytes > limit:
+        rejected.inc(admission.name, "too_large")
+        raise Rejected(413, f"Request too large (max {limit} bytes)")
+    billed_pages = None
+    if cost is None:
+        cost = billed_pages = max(1, math.ceil((body_bytes or 0) / ADMISSION_BYTES_PER_PAGE))
+    weight = ADMISSION_PREMIUM_WEIGHT if await is_premium(user_id) else 1.0
+    await admission.acquire(user, cost, weight)
+    return Ticket(admission, user, limit, billed_pages)
+
+
+def stats() -> dict:
+    return {name: admission.stats() for name, admission in classes.items()}
+
+
+def _refresh_metrics():
+    for name, admission in classes.items():
+        queued.set(name, value=admission._waiting())
+        in_flight.set(name, value=admission.in_flight)
+
+
+register_collector(_refresh_metrics)
@@ -0,0 +1,126 @@
+"""
+Analytics Ingestion - Buffer tracked events, write them to Supabase in bulk
+inserts and fold the inserted ones into the rollups
+"""
+import asyncio
+import logging
+from typing import List, Optional
+
+from .database import insert_events
+from .rollups import rollups
+from .observability import Counter, Gauge, REGISTRY, log_event, register_collector
+from .settings import ANALYTICS_BUFFER_SIZE, ANALYTICS_FLUSH_EVENTS, ANALYTICS_FLUSH_MS, ANALYTICS_DRAIN_TIMEOUT
+
+events_total = Counter("studia_analytics_events_total", "Analytics events by outcome", ("result",))
+buffer_depth = Gauge("studia_analytics_buffer_depth", "Analytics events waiting to be inserted")
+REGISTRY.extend([events_total, buffer_depth])
+
+
+class EventBuffer:
+    """
+    Bounded in-memory queue drained by one background task, which inserts up
+    to `flush_events` rows at once, or whatever arrived within `flush_ms`.
+    When the queue is full, new events are dropped (and counted): tracking
+    never makes a request wait.
+    """
+
+    def __init__(
+            self,
+            max_size: int = ANALYTICS_BUFFER_SIZE,
+            flush_events: int = ANALYTICS_FLUSH_EVENTS,
+            flush_ms: int = ANALYTICS_FLUSH_MS,
+    ):
+        self.flush_events = flush_events
+        self.flush_interval = flush_ms / 1000
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_size)
+        self._consumer: Optional[asyncio.Task] = None
+        self._closing = False
+        self.counts = {"accepted": 0, "dropped": 0, "inserted": 0, "failed": 0, "rollup_failed": 0, "flushes": 0}
+
+    def _count(self, result: str, n: int = 1):
+        self.counts[result] += n
+        events_total.inc(result, amount=n)
+
+    def put(self, rows: List[dict]) -> int:
+        """Queue rows without waiting; returns how many were accepted."""
+        accepted = 0
+        for row in rows:
+            if self._closing:
+                break
+            try:
+                self._queue.put_nowait(row)
+                accepted += 1
+            except asyncio.QueueFull:
+                break
+        if accepted:
+            self._count("accepted", accepted)
+        if accepted < len(rows):
+            self._count("dropped", len(rows) - accepted)
+        return accepted
+
+    async def _flush(self, rows: List[dict]) -> bool:
+        # Pas de nouvel essai ici : après un timeout ou une 5xx les lignes ont pu être écrites.
+        # database.py ne réessaie un insert que si la connexion n'a jamais été ouverte.
+        try:
+            await insert_events(rows)
+        except Exception as e:
+            log_event("analytics_insert_failed", logging.ERROR, events=len(rows), error=str(e))
+            self._count("failed", len(rows))
+            return False
+        self._count("inserted", len(rows))
+        self.counts["flushes"] += 1
+        return True
+
+    async def _consume(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            rows = [await self._queue.get()]
+            deadline = loop.time() + self.flush_interval
+            while len(rows) < self.flush_events:
+                if not self._queue.empty():
+                    rows.append(self._queue.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0 or self._closing:
+                    break
+                try:
+                    rows.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                # Agrégats après l'insertion : un lot perdu ne compte ni dans le DAU ni dans les totaux,
+                # et une erreur d'agrégat ne bloque jamais l'insertion brute
+                if await self._flush(rows):
+                    try:
+                        await rollups.ingest(rows)
+                    except Exception as e:
+                        log_event("analytics_rollup_failed", logging.WARNING, events=len(rows), error=str(e))
+                        self._count("rollup_failed", len(rows))
+            finally:
+                for _ in rows:
+                    self._queue.task_done()
+
+    async def start(self):
+        self._closing = False
+        self._consumer = asyncio.create_task(self._consume())
+
+    async def stop(self, timeout: float = ANALYTICS_DRAIN_TIMEOUT):
+        """Stop accepting events and insert what is still buffered (within `timeout` seconds)."""
+        self._closing = True
+        if self._consumer is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            log_event("analytics_drain_timeout", logging.WARNING, events_lost=self._queue.qsize())
+            self._count("dropped", self._queue.qsize())
+        self._consumer.cancel()
+        await asyncio.gather(self._consumer, return_exceptions=True)
+        self._consumer = None
+
+    def stats(self) -> dict:
+        return {**self.counts, "buffered": self._queue.qsize(), "capacity": self._queue.maxsize}
+
+
+event_buffer = EventBuffer()
+register_collector(lambda: buffer_depth.set(value=event_buffer._queue.qsize()))
@@ -0,0 +1,144 @@
+"""
+Batch Generation - Many (course, artifact, count, difficulty) requests in one call
+"""
+import asyncio
+import logging
+import time
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Literal, Optional, Tuple
+
+from pydantic import BaseModel, Field
+
+from .courses import CourseText, resolve_course_text, save_course
+from .observability import log_event
+from .retrieval import course_hash, get_index
+from .settings import BATCH_CONCURRENCY, BATCH_MAX_ITEMS
+
+# Un générateur reçoit (texte du cours, nombre, difficulté, fresh) et renvoie un résultat JSON
+Generator = Callable[[str, int, str, bool], Awaitable[dict]]
+
+
+class BatchItem(BaseModel):
+    id: Optional[str] = None  # identifiant libre côté client, renvoyé avec le résultat
+    course_text: CourseText = ""
+    course_id: Optional[str] = None
+    type: Literal["quiz", "flashcards"]
+    count: int = Field(5, ge=1, le=50)
+    difficulty: str = "medium"
+
+
+class BatchGenerateRequest(BaseModel):
+    items: List[BatchItem] = Field(..., min_length=1, max_length=BATCH_MAX_ITEMS)
+    fresh: bool = False
+
+
+_generators: Dict[str, Generator] = {}
+
+# Limite globale : partagée par tous les lots en cours, pas seulement par requête
+_semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+
+def register(kind: str, generator: Generator):
+    _generators[kind] = generator
+
+
+async def _prepare_course(text: str):
+    """Store the course and build its retrieval index once for the whole batch."""
+    await save_course(text)
+    await get_index(text)
+
+
+async def run_batch(items: List[BatchItem], fresh: bool = False) -> AsyncIterator[dict]:
+    """
+    Run every item concurrently (at most BATCH_CONCURRENCY generations at once,
+    across all batches) and yield events as items finish:
+
+    - {"event": "accepted", ...}: item / course / generation counts
+    - {"event": "item", "data": {"index", "id", "type", "result" | "error"}}
+    - {"event": "done", ...}: totals
+
+    Items with the same course are prepared once; identical items (same course,
+    type, count and difficulty) are generated once and sent to each of them.
+    """
+    started = time.time()
+
+    # 1. Cours uniques (par course_id ou hash du texte)
+    course_keys: List[Optional[str]] = []
+    sources: Dict[str, Tuple[str, Optional[str]]] = {}
+    for item in items:
+        key = course_hash(item.course_text) if item.course_text else item.course_id
+        course_keys.append(key)
+        if key and key not in sources:
+            sources[key] = (item.course_text, item.course_id)
+
+    texts: Dict[str, str] = {}
+    errors: Dict[str, str] = {}
+
+    async def load(key: str):
+        try:
+            texts[key] = await resolve_course_text(*sources[key])
+            await _prepare_course(texts[key])
+        except Exception as e:
+            errors[key] = str(e)
+
+    await asyncio.gather(*(load(key) for key in sources))
+
+    # 2. Générations uniques
+    generations: Dict[tuple, List[int]] = {}
+    failed_items = []
+    for index, (item, key) in enumerate(zip(items, course_keys)):
+        if not key:
+            failed_items.append((index, "course_text or course_id is required"))
+        elif key in errors:
+            failed_items.append((index, errors[key]))
+        elif item.type not in _generators:
+            failed_items.append((index, f"Unknown type {item.type}"))
+        else:
+            generations.setdefault((key, item.type, item.count, item.difficulty), []).append(index)
+
+    yield {"event": "accepted", "data": {
+        "items": len(items), "courses": len(texts), "generations": len(generations),
+    }}
+
+    def item_event(index: int, result: Optional[dict] = None, error: Optional[str] = None) -> dict:
+        data = {"index": index, "id": items[index].id, "type": items[index].type}
+        data.update({"error": error} if error is not None else {"result": result})
+        return {"event": "item", "data": data}
+
+    for index, error in failed_items:
+        yield item_event(index, error=error)
+
+    # 3. Exécution concurrente, résultats renvoyés dans l'ordre d'achèvement
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def generate(spec: tuple, indices: List[int]):
+        key, kind, count, difficulty = spec
+        try:
+            async with _semaphore:
+                result = await _generators[kind](texts[key], count, difficulty, fresh)
+            await queue.put((indices, result, None))
+        except Exception as e:
+            log_event(
+                "batch_generation_failed", logging.ERROR,
+                kind=kind, course=key[:12], count=count, difficulty=difficulty, items=len(indices), error=str(e),
+            )
+            await queue.put((indices, None, str(e)))
+
+    tasks = [asyncio.create_task(generate(spec, indices)) for spec, indices in generations.items()]
+    succeeded = 0
+    try:
+        for _ in tasks:
+            indices, result, error = await queue.get()
+            for index in indices:
+                succeeded += error is None
+                yield item_event(index, result, error)
+    finally:
+        # Client parti : on n'occupe plus les slots de génération pour rien
+        for task in tasks:
+            task.cancel()
+
+    yield {"event": "done", "data": {
+        "total": len(items),
+        "succeeded": succeeded,
+        "failed": len(items) - succeeded,
+        "elapsed": round(time.time() - started, 2),
+    }}
@@ -0,0 +1,206 @@
+"""
+Response Cache - Content-addressed cache with an LRU memory tier and a SQLite disk tier
+"""
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from .settings import (
+    STUDIA_DATA_DIR, LLM_CACHE_ENABLED, LLM_CACHE_TTL,
+    LLM_CACHE_MEMORY_BYTES, LLM_CACHE_DISK_BYTES,
+)
+
+
+def make_key(*parts) -> str:
+    """Stable SHA-256 of any JSON-serialisable parts (model, prompt, format, params...)."""
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class TieredCache:
+    """
+    Two-tier string cache.
+
+    - memory: OrderedDict in LRU order, bounded by `memory_max_bytes`
+    - disk: SQLite file that survives restarts, bounded by `disk_max_bytes`
+      (least recently accessed rows are evicted first)
+
+    Every entry has a TTL. Disk access runs in a thread so the event loop never
+    waits on SQLite; the disk tier's entry count and size are tracked in memory
+    (loaded once at startup) so neither writes nor stats() have to sum the table.
+    """
+
+    def __init__(
+            self,
+            name: str,
+            ttl: int = LLM_CACHE_TTL,
+            memory_max_bytes: int = LLM_CACHE_MEMORY_BYTES,
+            disk_max_bytes: int = LLM_CACHE_DISK_BYTES,
+            enabled: bool = LLM_CACHE_ENABLED,
+    ):
+        self.name = name
+        self.ttl = ttl
+        self.memory_max_bytes = memory_max_bytes
+        self.disk_max_bytes = disk_max_bytes
+        self.enabled = enabled
+
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (expires_at, value)
+        self._memory_bytes = 0
+        self._disk_entries = 0
+        self._disk_bytes = 0
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._db = None
+        if enabled and disk_max_bytes > 0:
+            os.makedirs(STUDIA_DATA_DIR, exist_ok=True)
+            self._db = sqlite3.connect(
+                os.path.join(STUDIA_DATA_DIR, f"cache_{name}.sqlite3"), check_same_thread=False
+            )
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+                "expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_accessed ON entries(accessed_at)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_expires ON entries(expires_at)")
+            self._db.commit()
+            self._disk_entries, self._disk_bytes = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+            ).fetchone()
+
+    # --- MEMORY TIER ---
+
+    def _memory_get(self, key: str) -> Optional[str]:
+        item = self._memory.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if expires_at < time.time():
+            self._memory_pop(key)
+            return None
+        self._memory.move_to_end(key)
+        return value
+
+    def _memory_set(self, key: str, value: str, expires_at: float):
+        size = len(value.encode("utf-8"))
+        if size > self.memory_max_bytes:
+            return
+        self._memory_pop(key)
+        self._memory[key] = (expires_at, value)
+        self._memory_bytes += size
+        while self._memory_bytes > self.memory_max_bytes and self._memory:
+            self._memory_pop(next(iter(self._memory)))
+
+    def _memory_pop(self, key: str):
+        item = self._memory.pop(key, None)
+        if item is not None:
+            self._memory_bytes -= len(item[1].encode("utf-8"))
+
+    # --- DISK TIER (appelé dans un thread, sous self._lock) ---
+
+    def _disk_delete(self, where: str, params: tuple):
+        removed = self._db.execute(f"DELETE FROM entries WHERE {where} RETURNING size", params).fetchall()
+        self._disk_entries -= len(removed)
+        self._disk_bytes -= sum(size for (size,) in removed)
+
+    def _disk_get(self, key: str) -> Optional[tuple]:
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value, expires_at FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                self._disk_delete("key = ?", (key,))
+                self._db.commit()
+                return None
+            self._db.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (now, key))
+            self._db.commit()
+        return row
+
+    def _disk_set(self, key: str, value: str, expires_at: float):
+        size = len(value.encode("utf-8"))
+        if size > self.disk_max_bytes:
+            return
+        now = time.time()
+        with self._lock:
+            self._disk_delete("key = ?", (key,))
+            self._db.execute(
+                "INSERT INTO entries (key, value, size, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, expires_at, now),
+            )
+            self._disk_entries += 1
+            self._disk_bytes += size
+            self._disk_delete("expires_at < ?", (now,))
+            while self._disk_bytes > self.disk_max_bytes:
+                oldest = self._db.execute(
+                    "SELECT key FROM entries ORDER BY accessed_at LIMIT 64"
+                ).fetchall()
+                if not oldest:
+                    break
+                for (old_key,) in oldest:
+                    self._disk_delete("key = ?", (old_key,))
+                    if self._disk_bytes <= self.disk_max_bytes:
+                        break
+            self._db.commit()
+
+    # --- API ---
+
+    async def get(self, key: str) -> Optional[str]:
+        if not self.enabled:
+            return None
+
+        value = self._memory_get(key)
+        if value is not None:
+            self.memory_hits += 1
+            return value
+
+        if self._db is not None:
+            row = await asyncio.to_thread(self._disk_get, key)
+            if row is not None:
+                self.disk_hits += 1
+                self._memory_set(key, row[0], row[1])
+                return row[0]
+
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, value: str, ttl: Optional[int] = None):
+        if not self.enabled:
+            return
+        expires_at = time.time() + (ttl if ttl is not None else self.ttl)
+        self._memory_set(key, value, expires_at)
+        if self._db is not None:
+            await asyncio.to_thread(self._disk_set, key, value, expires_at)
+
+    def stats(self) -> dict:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "name": self.name,
+            "enabled": self.enabled,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_ratio": round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+            "memory_entries": len(self._memory),
+            "memory_bytes": self._memory_bytes,
+            "disk_entries": self._disk_entries,
+            "disk_bytes": self._disk_bytes,
+        }
+
+
+# Cache partagé pour les réponses LLM
+llm_cache = TieredCache("llm")
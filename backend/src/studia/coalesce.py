@@ -0,0 +1,81 @@
+"""
+Request Coalescing - Identical generations running at the same time share one
+pipeline (single-flight): the first caller runs it, the others wait for its result
+"""
+import asyncio
+import copy
+from typing import Any, Awaitable, Callable, Dict
+
+from .cache import make_key
+from .observability import Counter, Gauge, REGISTRY
+from .settings import COALESCE_ENABLED
+
+calls = Counter("studia_coalesced_calls_total", "Generation calls by single-flight role", ("operation", "role"))
+in_flight = Gauge("studia_coalesced_in_flight", "Distinct generations running", ("operation",))
+REGISTRY.extend([calls, in_flight])
+
+
+class SingleFlight:
+    """
+    In-flight pipelines keyed by the normalized request. The pipeline runs in
+    its own task: a caller that disconnects does not cancel it for the others.
+    When the last caller waiting on it is cancelled (client gone, batch
+    cancelled), the pipeline is cancelled too, so its work stops with them and
+    stays within the callers' concurrency limits.
+    """
+
+    def __init__(self, enabled: bool = COALESCE_ENABLED):
+        self.enabled = enabled
+        self._calls: Dict[str, asyncio.Task] = {}
+        self._waiters: Dict[str, int] = {}
+        self.leaders = 0
+        self.followers = 0
+
+    def _done(self, operation: str, key: str, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+            self._waiters.pop(key, None)
+        in_flight.dec(operation)
+        if not task.cancelled():
+            task.exception()  # lue ici si plus personne n'attend le résultat
+
+    async def do(self, operation: str, key_parts: tuple, fn: Callable[[], Awaitable[Any]]) -> Any:
+        if not self.enabled:
+            return await fn()
+        key = make_key(operation, *key_parts)
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._done(operation, key, t))
+            self.leaders += 1
+            calls.inc(operation, "leader")
+            in_flight.inc(operation)
+        else:
+            self.followers += 1
+            calls.inc(operation, "follower")
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            result = await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if self._calls.get(key) is task:
+                self._waiters[key] -= 1
+                if self._waiters[key] == 0:
+                    task.cancel()  # plus personne n'attend ce résultat
+            raise
+        # Copie : chaque appelant peut modifier sa réponse sans toucher celle des autres
+        return copy.deepcopy(result)
+
+    def stats(self) -> dict:
+        total = self.leaders + self.followers
+        return {
+            "enabled": self.enabled,
+            "in_flight": len(self._calls),
+            "leaders": self.leaders,
+            "collapsed": self.followers,
+            "collapse_ratio": round(self.followers / total, 4) if total else 0.0,
+        }
+
+
+single_flight = SingleFlight()
+
@@ -0,0 +1,149 @@
+"""
+Course Store - Server-side course texts and derived artifacts, addressed by content hash
+"""
+import asyncio
+import json
+import time
+from typing import Annotated, Any, List, Optional
+
+from fastapi import APIRouter, HTTPException
+from pydantic import BaseModel, Field
+
+from .cache import TieredCache
+from .retrieval import chunk_markdown, course_hash, heading_titles, estimate_tokens
+from .settings import COURSE_STORE_TTL, COURSE_STORE_MEMORY_BYTES, COURSE_STORE_DISK_BYTES, COURSE_MAX_CHARS
+
+class CourseTooLargeError(ValueError):
+    pass
+
+
+# Texte de cours dans un modèle de requête : borné comme save_course (422 avant tout appel LLM)
+CourseText = Annotated[str, Field(max_length=COURSE_MAX_CHARS)]
+
+
+# Toujours actif (indépendant de LLM_CACHE_ENABLED) : un course_id doit rester résolvable
+course_store = TieredCache(
+    "courses",
+    ttl=COURSE_STORE_TTL,
+    memory_max_bytes=COURSE_STORE_MEMORY_BYTES,
+    disk_max_bytes=COURSE_STORE_DISK_BYTES,
+    enabled=True,
+)
+
+
+class CourseCreateRequest(BaseModel):
+    text: str
+    title: Optional[str] = None
+
+
+class CourseInfo(BaseModel):
+    course_id: str
+    title: Optional[str] = None
+    chars: int
+    tokens: int
+    chunks: int
+    headings: List[str] = []
+    created_at: float
+
+
+def _key(course_id: str, artifact: str) -> str:
+    return f"{course_id}:{artifact}"
+
+
+async def put_artifact(course_id: str, name: str, value: Any):
+    """Store a JSON-serialisable artifact derived from a course (chunks, question bank...)."""
+    await course_store.set(_key(course_id, name), json.dumps(value, ensure_ascii=False))
+
+
+async def get_artifact(course_id: str, name: str) -> Optional[Any]:
+    raw = await course_store.get(_key(course_id, name))
+    return json.loads(raw) if raw is not None else None
+
+
+async def get_course_text(course_id: str) -> Optional[str]:
+    return await course_store.get(_key(course_id, "text"))
+
+
+async def save_course(text: str, title: Optional[str] = None) -> CourseInfo:
+    """
+    Store a course with its chunks. The course_id is the content hash, so saving
+    the same text again returns the existing entry.
+    """
+    if not text.strip():
+        raise ValueError("Course text is empty")
+    if len(text) > COURSE_MAX_CHARS:
+        raise CourseTooLargeError(f"Course too long ({len(text)} > {COURSE_MAX_CHARS} characters)")
+
+    course_id = course_hash(text)
+    existing = await get_artifact(course_id, "info")
+    if existing is not None and await get_course_text(course_id) is not None:
+        return CourseInfo(**existing)
+
+    chunks = await asyncio.to_thread(chunk_markdown, text)
+    info = CourseInfo(
+        course_id=course_id,
+        title=title,
+        chars=len(text),
+        tokens=estimate_tokens(text),
+        chunks=len(chunks),
+        headings=heading_titles(text),
+        created_at=time.time(),
+    )
+    await course_store.set(_key(course_id, "text"), text)
+    await put_artifact(course_id, "chunks", [c.model_dump() for c in chunks])
+    await put_artifact(course_id, "info", info.model_dump())
+    return info
+
+
+async def resolve_course_text(course_text: str = "", course_id: Optional[str] = None) -> str:
+    """
+    Course text of a request: the inline text if given, otherwise the stored one.
+    Raises LookupError for an unknown / expired course_id, ValueError if neither is given.
+    """
+    if course_text:
+        return course_text
+    if not course_id:
+        raise ValueError("course_text or course_id is required")
+    text = await get_course_text(course_id)
+    if text is None:
+        raise LookupError(f"Unknown or expired course_id {course_id}, resend course_text")
+    return text
+
+
+# --- API ---
+
+router = APIRouter()
+
+
+@router.post("", response_model=CourseInfo)
+async def create_course(request: CourseCreateRequest):
+    try:
+        return await save_course(request.text, request.title)
+    except CourseTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+
+@router.get("/{course_id}", response_model=CourseInfo)
+async def get_course(course_id: str):
+    info = await get_artifact(course_id, "info")
+    if info is None:
+        raise HTTPException(status_code=404, detail="Course not found or expired")
+    return info
+
+
+@router.get("/{course_id}/text")
+async def get_course_text_endpoint(course_id: str):
+    text = await get_course_text(course_id)
+    if text is None:
+        raise HTTPException(status_code=404, detail="Course not found or expired")
+    return {"course_id": course_id, "text": text}
+
+
+@router.get("/{course_id}/chunks")
+async def get_course_chunks(course_id: str):
+    chunks = await get_artifact(course_id, "chunks")
+    if chunks is None:
+        raise HTTPException(status_code=404, detail="Course not found or expired")
+    return {"course_id": course_id, "chunks": chunks}
@@ -1,17 +1,220 @@
-import os
-from supabase import create_client, Client
-from dotenv import load_dotenv
-
-# On force le chargement des variables d'environnement ici
-load_dotenv()
-
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
-
-if not SUPABASE_URL or not SUPABASE_KEY:
-    # On ne lève pas d'erreur bloquante ici pour ne pas casser l'import
-    # mais on met un client dummy ou None
-    print("⚠️ Warning: Supabase keys not found in environment.")
-    supabase = None
-else:
-    supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
\ No newline at end of file
+"""
+Database - Async data access to Supabase (PostgREST) over one pooled HTTP/2 client
+"""
+import asyncio
+import random
+from typing import Any, Dict, List, Optional, Sequence, Tuple, TypedDict
+
+import httpx
+
+from .observability import external_call
+from .settings import (
+    SUPABASE_URL, SUPABASE_KEY, DB_MAX_CONNECTIONS, DB_MAX_KEEPALIVE, DB_KEEPALIVE_EXPIRY,
+    DB_TIMEOUT, DB_MAX_RETRIES,
+)
+
+# Filtre PostgREST : (colonne, opérateur, valeur), ex. ("user_id", "eq", "abc")
+Filter = Tuple[str, str, Any]
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class DatabaseError(Exception):
+    def __init__(self, status_code: int, message: str):
+        super().__init__(f"Supabase error {status_code}: {message}")
+        self.status_code = status_code
+        self.message = message
+
+
+def _filter_value(op: str, value: Any) -> str:
+    if op == "in":
+        return "in.(" + ",".join(f'"{v}"' for v in value) + ")"
+    if op == "is":
+        return f"is.{'null' if value is None else str(value).lower()}"
+    if isinstance(value, bool):
+        value = str(value).lower()
+    return f"{op}.{value}"
+
+
+class SupabaseDB:
+    """
+    Minimal async PostgREST client. Idempotent requests are retried on
+    connection errors, 429 and 5xx with exponential backoff; inserts only
+    when the connection could not be opened (the row was never sent).
+    """
+
+    def __init__(self, url: Optional[str] = SUPABASE_URL, key: Optional[str] = SUPABASE_KEY):
+        self.enabled = bool(url and key)
+        self._client: Optional[httpx.AsyncClient] = None
+        if self.enabled:
+            self._client = httpx.AsyncClient(
+                base_url=f"{url.rstrip('/')}/rest/v1",
+                headers={"apikey": key, "Authorization": f"Bearer {key}"},
+                http2=True,
+                limits=httpx.Limits(
+                    max_connections=DB_MAX_CONNECTIONS,
+                    max_keepalive_connections=DB_MAX_KEEPALIVE,
+                    keepalive_expiry=DB_KEEPALIVE_EXPIRY,
+                ),
+                timeout=httpx.Timeout(DB_TIMEOUT, connect=5.0),
+            )
+        else:
+            print("⚠️ Warning: Supabase keys not found in environment.")
+
+    def __bool__(self) -> bool:
+        return self.enabled
+
+    async def _request(
+            self,
+            method: str,
+            table: str,
+            params: Optional[List[Tuple[str, str]]] = None,
+            json: Any = None,
+            prefer: Optional[str] = None,
+            idempotent: bool = True,
+    ) -> httpx.Response:
+        if self._client is None:
+            raise DatabaseError(503, "Database not configured")
+        headers = {"Prefer": prefer} if prefer else {}
+        operation = {"GET": "select", "POST": "insert", "PATCH": "update", "DELETE": "delete"}[method]
+        if method == "POST" and prefer and "merge-duplicates" in prefer:
+            operation = "upsert"
+
+        attempt = 0
+        while True:
+            last = attempt == DB_MAX_RETRIES
+            try:
+                with external_call("supabase", operation, table=table):
+                    response = await self._client.request(method, f"/{table}", params=params, json=json, headers=headers)
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout):
+                if last:
+                    raise
+            except httpx.TransportError:
+                if not idempotent or last:
+                    raise
+            else:
+                if response.status_code < 400:
+                    return response
+                if not idempotent or response.status_code not in RETRY_STATUSES or last:
+                    try:
+                        message = response.json().get("message", response.text)
+                    except ValueError:
+                        message = response.text
+                    raise DatabaseError(response.status_code, message)
+            await asyncio.sleep(0.2 * 2 ** attempt + random.uniform(0, 0.1))
+            attempt += 1
+
+    # --- OPÉRATIONS GÉNÉRIQUES ---
+
+    async def select(
+            self,
+            table: str,
+            columns: str = "*",
+            filters: Sequence[Filter] = (),
+            order: Optional[str] = None,
+            desc: bool = False,
+            limit: Optional[int] = None,
+            count: bool = False,
+    ) -> Tuple[List[dict], Optional[int]]:
+        """Rows matching `filters`, and the exact total when `count` is set."""
+        params = [("select", columns)] + [(col, _filter_value(op, value)) for col, op, value in filters]
+        if order:
+            params.append(("order", f"{order}.{'desc' if desc else 'asc'}"))
+        if limit is not None:
+            params.append(("limit", str(limit)))
+        response = await self._request("GET", table, params, prefer="count=exact" if count else None)
+        total = None
+        if count:
+            content_range = response.headers.get("content-range", "")
+            total = int(content_range.rsplit("/", 1)[-1]) if content_range.rsplit("/", 1)[-1].isdigit() else None
+        return response.json(), total
+
+    async def insert(self, table: str, rows: List[dict], returning: bool = False) -> List[dict]:
+        response = await self._request(
+            "POST", table, json=rows, prefer="return=representation" if returning else "return=minimal",
+            idempotent=False,
+        )
+        return response.json() if returning else []
+
+    async def upsert(self, table: str, rows: List[dict], on_conflict: str) -> None:
+        await self._request(
+            "POST", table, [("on_conflict", on_conflict)], json=rows,
+            prefer="resolution=merge-duplicates,return=minimal",
+        )
+
+    async def update(self, table: str, values: dict, filters: Sequence[Filter], returning: bool = False) -> List[dict]:
+        if not filters:
+            raise ValueError("update without filters")
+        params = [(col, _filter_value(op, value)) for col, op, value in filters]
+        response = await self._request(
+            "PATCH", table, params, json=values, prefer="return=representation" if returning else "return=minimal"
+        )
+        return response.json() if returning else []
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+
+
+db = SupabaseDB()
+
+
+# --- TABLES ---
+
+class UserRow(TypedDict, total=False):
+    id: str
+    email: str
+    is_premium: bool
+    plan_type: str
+    premium_until: str
+    energy: int
+
+
+class AnalyticsEventRow(TypedDict, total=False):
+    id: int
+    user_id: str
+    event_type: str
+    event_data: Dict[str, Any]
+    created_at: str
+
+
+# users
+
+async def count_users() -> int:
+    _, total = await db.select("users", "id", limit=1, count=True)
+    return total or 0
+
+
+async def get_user(user_id: str) -> Optional[UserRow]:
+    rows, _ = await db.select("users", filters=[("id", "eq", user_id)], limit=1)
+    return rows[0] if rows else None
+
+
+async def get_user_emails(user_ids: Sequence[str]) -> Dict[str, str]:
+    if not user_ids:
+        return {}
+    rows, _ = await db.select("users", "id,email", filters=[("id", "in", list(user_ids))])
+    return {row["id"]: row.get("email") or "Inconnu" for row in rows}
+
+
+async def update_user(user_id: str, values: UserRow) -> None:
+    await db.update("users", dict(values), [("id", "eq", user_id)])
+
+
+# analytics_events
+
+async def insert_events(rows: List[AnalyticsEventRow]) -> None:
+    await db.insert("analytics_events", list(rows))
+
+
+async def recent_events(limit: int = 50) -> List[AnalyticsEventRow]:
+    rows, _ = await db.select("analytics_events", order="created_at", desc=True, limit=limit)
+    return rows
+
+
+async def events_after(last_id: int, limit: int) -> List[AnalyticsEventRow]:
+    """Events with an id above `last_id`, in id order (keyset pagination)."""
+    rows, _ = await db.select(
+        "analytics_events", "id,user_id,created_at", filters=[("id", "gt", last_id)], order="id", limit=limit
+    )
+    return rows
@@ -3,16 +3,16 @@ Flashcard Generator - Generate flashcards from course text with SELF-REFINING
 """
 import json
 import re
-from openai import OpenAI
-import os
-from dotenv import load_dotenv
+import asyncio
+import logging
+from typing import Callable, Dict, List, Optional
+from .llm import chat_completion
+from .observability import log_event, traced_pipeline
+from .retrieval import select_context
+from .settings import ITEM_CONTEXT_TOKENS
 
-load_dotenv()
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
-
-def validate_flashcards_quality(course_text: str, flashcards_data: dict) -> dict:
+async def validate_flashcards_quality(course_text: str, flashcards_data: dict) -> dict:
     """
     🔄 STEP 1: Validate flashcard quality and accuracy
 
@@ -25,8 +25,6 @@ def validate_flashcards_quality(course_text: str, flashcards_data: dict) -> dict
     }
     """
 
-    print("🔍 Validating flashcards quality...")
-
     validation_prompt = f"""You are a flashcard quality validator. Analyze these flashcards and return your analysis in JSON format.
 
 ORIGINAL COURSE TEXT:
@@ -66,8 +64,8 @@ CRITICAL RULES:
 - List ALL issues found, even small ones
 - Return ONLY valid JSON"""
 
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
+    content = await chat_completion(
+        stage="validate",
         response_format={"type": "json_object"},
         messages=[
             {
@@ -77,25 +75,22 @@ CRITICAL RULES:
         ],
     )
 
-    validation_result = json.loads(response.choices[0].message.content)
+    validation_result = json.loads(content)
 
-    print(f"   Quality Score: {validation_result.get('quality_score', 0)}%")
-    print(f"   Issues found: {len(validation_result.get('issues', []))}")
+    log_event(
+        "flashcards_validated",
+        score=validation_result.get('quality_score', 0),
+        issues=len(validation_result.get('issues', [])),
+    )
 
     return validation_result
 
 
-def refine_flashcards(course_text: str, flashcards_data: dict, validation_result: dict) -> dict:
+async def _refine_whole_deck(course_text: str, flashcards_data: dict, validation_result: dict) -> dict:
     """
-    🔧 STEP 2: Fix issues found in flashcard validation
+    Rewrite the whole deck (used when issues are not tied to a card index).
     """
 
-    if validation_result.get('is_valid', False) and validation_result.get('quality_score', 0) >= 90:
-        print("✅ Flashcards quality is excellent, no refinement needed")
-        return flashcards_data
-
-    print("🔧 Refining flashcards based on validation feedback...")
-
     refine_prompt = f"""You are a flashcard refinement expert. FIX the issues in these flashcards and return valid JSON.
 
 ORIGINAL COURSE TEXT:
@@ -135,8 +130,55 @@ RULES:
 - "back" should be concise but complete (2-3 sentences)
 - Return ONLY valid JSON, nothing else"""
 
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
+    content = await chat_completion(
+        stage="refine",
+        response_format={"type": "json_object"},
+        messages=[
+            {
+                "role": "user",
+                "content": refine_prompt
+            }
+        ],
+    )
+
+    return json.loads(content)
+
+
+
+async def refine_flashcard(course_text: str, card: dict, issues: list) -> dict:
+    """
+    Fix ONE flashcard flagged by validation (only the relevant course sections are sent).
+    """
+    context = await select_context(course_text, f"{card.get('front', '')} {card.get('back', '')}", ITEM_CONTEXT_TOKENS)
+
+    refine_prompt = f"""You are a flashcard refinement expert. FIX the issues in this ONE flashcard and return valid JSON.
+
+ORIGINAL COURSE TEXT:
+{context}
+
+CURRENT FLASHCARD (with issues):
+{json.dumps(card, indent=2, ensure_ascii=False)}
+
+VALIDATION ISSUES:
+{json.dumps(issues, indent=2, ensure_ascii=False)}
+
+Return ONLY the CORRECTED flashcard in this EXACT JSON format:
+{{
+  "front": "Question/Concept",
+  "back": "Complete and accurate answer",
+  "category": "Category name",
+  "difficulty": "easy/medium/hard"
+}}
+
+RULES:
+- Fix EVERY issue mentioned
+- Base EVERYTHING on the course text, NO external information
+- "front" should be short (1 sentence max)
+- "back" should be concise but complete (2-3 sentences)
+- Return ONLY valid JSON, nothing else"""
+
+    content = await chat_completion(
+        stage="refine",
         response_format={"type": "json_object"},
         messages=[
             {
@@ -146,17 +188,108 @@ RULES:
         ],
     )
 
-    refined_flashcards = json.loads(response.choices[0].message.content)
-    print("✅ Flashcards refined successfully")
+    refined = json.loads(content)
+    if isinstance(refined.get("flashcard"), dict):
+        refined = refined["flashcard"]
+    if "front" not in refined or "back" not in refined:
+        raise ValueError("Invalid refined flashcard format")
+    refined.setdefault("category", card.get("category", "Général"))
+    refined.setdefault("difficulty", card.get("difficulty", "medium"))
+    return refined
 
-    return refined_flashcards
 
+async def refine_flashcards(course_text: str, flashcards_data: dict, validation_result: dict) -> dict:
+    """
+    🔧 STEP 2: Fix issues found in flashcard validation
 
-def generate_flashcards(
+    Only the cards listed in issues (card_index) are regenerated, concurrently, and
+    spliced back in place. The result carries "refined_indices" (None when the whole
+    deck had to be rewritten because no issue pointed at a card) and "failed"
+    ({index: issues} of the flagged cards whose fix raised).
+    """
+
+    if validation_result.get('is_valid', False) and validation_result.get('quality_score', 0) >= 90:
+        return {**flashcards_data, "refined_indices": [], "failed": {}}
+
+    cards = flashcards_data.get("flashcards", [])
+    flagged = {}
+    for issue in validation_result.get('issues', []):
+        index = issue.get("card_index")
+        if isinstance(index, int) and not isinstance(index, bool) and 0 <= index < len(cards):
+            flagged.setdefault(index, []).append(issue)
+
+    if not flagged:
+        refined_flashcards = await _refine_whole_deck(course_text, flashcards_data, validation_result)
+        log_event("flashcards_refined", scope="whole", cards=len(refined_flashcards.get("flashcards", [])))
+        return {**refined_flashcards, "refined_indices": None, "failed": {}}
+
+    indices = sorted(flagged)
+    results = await asyncio.gather(
+        *(refine_flashcard(course_text, cards[i], flagged[i]) for i in indices),
+        return_exceptions=True
+    )
+
+    refined_cards = list(cards)
+    refined_indices, failed = [], {}
+    for i, result in zip(indices, results):
+        if isinstance(result, Exception):
+            log_event("flashcard_refine_failed", logging.WARNING, card=i + 1, error=str(result))
+            failed[i] = flagged[i]
+            continue
+        refined_cards[i] = result
+        refined_indices.append(i)
+
+    log_event(
+        "flashcards_refined", scope="cards", flagged=len(flagged), replaced=len(refined_indices), failed=len(failed)
+    )
+    return {**flashcards_data, "flashcards": refined_cards, "refined_indices": refined_indices, "failed": failed}
+
+
+async def revalidate_flashcards(
+        course_text: str,
+        flashcards_data: dict,
+        refined_indices: Optional[List[int]],
+        failed: Optional[Dict[int, list]] = None
+) -> dict:
+    """
+    Re-validate only the refined cards; cards whose fix failed keep their issues
+    and score 0. The score is reported for the whole deck.
+    """
+    cards = flashcards_data.get("flashcards", [])
+    failed = failed or {}
+    if refined_indices is None:
+        return await validate_flashcards_quality(course_text, flashcards_data)
+    if not cards or (not refined_indices and not failed):
+        return {"is_valid": True, "quality_score": 100, "issues": []}
+
+    if refined_indices:
+        result = await validate_flashcards_quality(course_text, {"flashcards": [cards[i] for i in refined_indices]})
+        for issue in result.get("issues", []):
+            index = issue.get("card_index")
+            if isinstance(index, int) and 0 <= index < len(refined_indices):
+                issue["card_index"] = refined_indices[index]
+    else:
+        result = {"is_valid": True, "quality_score": 0, "issues": []}
+
+    total, changed = len(cards), len(refined_indices)
+    untouched = total - changed - len(failed)
+    result["quality_score"] = round((untouched * 100 + changed * result.get("quality_score", 0)) / total)
+    if failed:
+        result["is_valid"] = False
+        result["issues"] = result.get("issues", []) + [issue for i in sorted(failed) for issue in failed[i]]
+        result["failed_indices"] = sorted(failed)
+    result["revalidated_indices"] = refined_indices
+    return result
+
+
+@traced_pipeline("flashcards")
+async def generate_flashcards(
         course_text: str,
         num_cards: int = 10,
         difficulty: str = "medium",
-        enable_refinement: bool = True
+        enable_refinement: bool = True,
+        fresh: bool = False,
+        on_stage: Optional[Callable[[str], None]] = None
 ) -> dict:
     """
     Generate flashcards from course text with SELF-REFINING
@@ -166,17 +299,16 @@ def generate_flashcards(
         num_cards: Number of flashcards to generate
         difficulty: easy, medium, or hard
         enable_refinement: Enable self-refining validation (default: True)
+        fresh: Ignore cached generations and ask for a new variant
+        on_stage: Progress callback (generate / validate / refine)
 
     Returns:
         dict: Flashcards data with metadata
     """
 
-    print(f"🎴 Flashcard generation started (Self-Refining: {'ON' if enable_refinement else 'OFF'})")
-    print(f"   Parameters: {num_cards} cards, difficulty: {difficulty}")
-
     try:
         # STEP 1: Generate initial flashcards
-        print("\n1️⃣ Generating initial flashcards...")
+        if on_stage: on_stage("generate")
 
         difficulty_instructions = {
             "easy": "Les flashcards doivent couvrir les concepts de base et les définitions simples.",
@@ -226,8 +358,8 @@ RÈGLES CRITIQUES:
 - Teste des concepts IMPORTANTS, pas des détails insignifiants
 """
 
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
+        flashcards_json = await chat_completion(
+            stage="generate",
             response_format={"type": "json_object"},
             messages=[
                 {
@@ -235,10 +367,9 @@ RÈGLES CRITIQUES:
                     "content": [{"type": "text", "text": prompt}]
                 }
             ],
+            fresh=fresh,
         )
 
-        flashcards_json = response.choices[0].message.content
-
         # Clean JSON
         flashcards_json = re.sub(r"```json\n?", "", flashcards_json)
         flashcards_json = re.sub(r"```\n?", "", flashcards_json)
@@ -251,7 +382,10 @@ RÈGLES CRITIQUES:
             raise ValueError("Invalid flashcards format: missing 'flashcards' key")
 
         if len(flashcards_data["flashcards"]) != num_cards:
-            print(f"⚠️ Warning: Expected {num_cards} flashcards, got {len(flashcards_data['flashcards'])}")
+            log_event(
+                "flashcards_count_mismatch", logging.WARNING,
+                expected=num_cards, received=len(flashcards_data["flashcards"]),
+            )
 
         for i, card in enumerate(flashcards_data["flashcards"]):
             if "front" not in card or "back" not in card:
@@ -261,8 +395,6 @@ RÈGLES CRITIQUES:
             if "difficulty" not in card:
                 card["difficulty"] = difficulty
 
-        print(f"✅ Initial flashcards generated: {len(flashcards_data['flashcards'])}")
-
         # 🔄 STEP 3: SELF-REFINING (if enabled)
         metadata = {
             "was_refined": False,
@@ -271,28 +403,28 @@ RÈGLES CRITIQUES:
         }
 
         if enable_refinement:
-            print("\n2️⃣ Validating flashcards quality...")
-            validation_result = validate_flashcards_quality(course_text, flashcards_data)
+            if on_stage: on_stage("validate")
+            validation_result = await validate_flashcards_quality(course_text, flashcards_data)
 
             metadata["initial_score"] = validation_result.get('quality_score', 0)
 
             # If validation fails or score is low, refine
             if not validation_result.get('is_valid', False) or validation_result.get('quality_score', 0) < 90:
-                print("\n3️⃣ Refining flashcards...")
-                flashcards_data = refine_flashcards(course_text, flashcards_data, validation_result)
+                if on_stage: on_stage("refine")
+                flashcards_data = await refine_flashcards(course_text, flashcards_data, validation_result)
+                refined_indices = flashcards_data.pop("refined_indices", None)
+                failed = flashcards_data.pop("failed", {})
 
-                # Re-validate after refinement
-                print("\n4️⃣ Re-validating refined flashcards...")
-                final_validation = validate_flashcards_quality(course_text, flashcards_data)
+                # Re-validate after refinement (only the replaced cards)
+                final_validation = await revalidate_flashcards(course_text, flashcards_data, refined_indices, failed)
+                metadata["refined_cards"] = refined_indices
+                metadata["unrefined_cards"] = sorted(failed)
 
                 metadata["final_score"] = final_validation.get('quality_score', 0)
                 metadata["was_refined"] = True
-
-                print(f"   ✅ Flashcards refined (score: {metadata['initial_score']}% → {metadata['final_score']}%)")
             else:
                 metadata["final_score"] = validation_result.get('quality_score', 0)
                 metadata["was_refined"] = False
-                print(f"   ✅ Flashcards quality is good ({metadata['final_score']}%)")
 
         # ✨ Add metadata to result
         flashcards_data["metadata"] = {
@@ -300,17 +432,21 @@ RÈGLES CRITIQUES:
             "self_refining_enabled": enable_refinement
         }
 
-        print(f"\n✅ FINAL RESULT:")
-        print(f"   Flashcards: {len(flashcards_data['flashcards'])}")
-        if enable_refinement:
-            print(f"   Quality score: {metadata.get('final_score', 'N/A')}%")
-            print(f"   Refined: {metadata.get('was_refined', False)}")
+        log_event(
+            "flashcards_generated",
+            cards=len(flashcards_data['flashcards']),
+            difficulty=difficulty,
+            refinement=enable_refinement,
+            initial_score=metadata.get('initial_score'),
+            final_score=metadata.get('final_score'),
+            refined=metadata.get('was_refined', False),
+        )
 
         return flashcards_data
 
     except json.JSONDecodeError as e:
-        print(f"❌ JSON Parse Error: {e}")
+        log_event("flashcards_generation_failed", logging.ERROR, error=f"JSON parse error: {e}")
         raise Exception(f"Failed to parse flashcards JSON: {str(e)}")
     except Exception as e:
-        print(f"❌ Error: {str(e)}")
+        log_event("flashcards_generation_failed", logging.ERROR, error=str(e))
         raise
\ No newline at end of file
@@ -0,0 +1,104 @@
+"""
+Image Cache - Reuse extractions for pages already seen (exact hash + perceptual hash)
+"""
+import asyncio
+import base64
+import binascii
+import hashlib
+import io
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from PIL import Image, ImageStat
+
+from .cache import TieredCache
+from .settings import (
+    OCR_CACHE_TTL, IMAGE_PHASH_MAX_DISTANCE, IMAGE_PHASH_INDEX_SIZE, IMAGE_PHASH_MAX_ASPECT_DELTA,
+    IMAGE_PHASH_MIN_CONTRAST,
+)
+
+# dHash 16x16 = 256 bits : assez fin pour distinguer deux pages d'un même cahier
+PHASH_SIZE = 16
+
+# Extractions et vérifications, indexées par empreinte d'image
+ocr_cache = TieredCache("ocr", ttl=OCR_CACHE_TTL)
+
+# Index perceptuel en mémoire : phash -> (sha256 canonique, largeur / hauteur)
+_phash_index: "OrderedDict[int, Tuple[str, float]]" = OrderedDict()
+near_duplicate_hits = 0
+
+
+def compute_fingerprint(image_base64: str) -> Tuple[str, Optional[int], float]:
+    """
+    Return (sha256 of the decoded bytes, perceptual dHash or None, aspect ratio).
+
+    The dHash survives re-encoding / light resizing, so the same photo sent
+    again as a different JPEG still maps to the same extraction. Near-blank,
+    low-contrast pages get no dHash (it would mostly encode noise): they are
+    only reused on an exact match.
+    """
+    try:
+        raw = base64.b64decode(image_base64)
+    except (binascii.Error, ValueError):
+        raw = image_base64.encode("utf-8")
+    sha = hashlib.sha256(raw).hexdigest()
+
+    try:
+        img = Image.open(io.BytesIO(raw))
+        aspect = img.width / img.height
+        img.draft("L", (PHASH_SIZE * 8, PHASH_SIZE * 8))  # décodage JPEG réduit, bien plus rapide
+        img = img.convert("L")
+        contrast = ImageStat.Stat(img.resize((64, 64), Image.Resampling.BILINEAR)).stddev[0]
+        pixels = list(img.resize((PHASH_SIZE + 1, PHASH_SIZE), Image.Resampling.BILINEAR).getdata())
+    except Exception:
+        return sha, None, 0.0
+
+    if contrast < IMAGE_PHASH_MIN_CONTRAST:
+        return sha, None, aspect
+
+    phash = 0
+    for row in range(PHASH_SIZE):
+        offset = row * (PHASH_SIZE + 1)
+        for col in range(PHASH_SIZE):
+            phash = (phash << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return sha, phash, aspect
+
+
+def _match_phash(phash: int, aspect: float) -> Optional[str]:
+    """Closest known page within IMAGE_PHASH_MAX_DISTANCE bits and with the same proportions."""
+    best, best_distance = None, IMAGE_PHASH_MAX_DISTANCE + 1
+    for known, (sha, known_aspect) in _phash_index.items():
+        distance = (known ^ phash).bit_count()
+        if distance < best_distance and abs(known_aspect - aspect) <= IMAGE_PHASH_MAX_ASPECT_DELTA * aspect:
+            best, best_distance = known, distance
+    if best is None:
+        return None
+    _phash_index.move_to_end(best)
+    return _phash_index[best][0]
+
+
+async def image_key(image_base64: str) -> str:
+    """
+    Canonical cache key for an image: the sha256 of a near-identical page
+    already seen, or its own sha256.
+    """
+    global near_duplicate_hits
+
+    sha, phash, aspect = await asyncio.to_thread(compute_fingerprint, image_base64)
+    if phash is None:
+        return sha
+
+    match = _match_phash(phash, aspect)
+    if match is not None:
+        if match != sha:
+            near_duplicate_hits += 1
+        return match
+
+    _phash_index[phash] = (sha, aspect)
+    while len(_phash_index) > IMAGE_PHASH_INDEX_SIZE:
+        _phash_index.popitem(last=False)
+    return sha
+
+
+def stats() -> dict:
+    return {**ocr_cache.stats(), "near_duplicate_hits": near_duplicate_hits, "phash_index_size": len(_phash_index)}
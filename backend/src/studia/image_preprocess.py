@@ -0,0 +1,273 @@
+"""
+Image Preprocessing - Shrink page photos before they reach the vision model
+(EXIF rotation, margin crop, downscale, grayscale, recompression, detail level)
+"""
+import asyncio
+import base64
+import binascii
+import io
+import logging
+import math
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+from PIL import Image, ImageOps
+from pydantic import BaseModel
+
+from .observability import log_event
+from .settings import (
+    IMAGE_PREPROCESS_ENABLED, IMAGE_PREPROCESS_WORKERS, IMAGE_TARGET_SHORT_SIDE,
+    IMAGE_JPEG_QUALITY, IMAGE_MIN_TEXT_PX,
+)
+
+# Le modèle vision redimensionne lui-même : tout tient dans 2048x2048, puis le petit côté
+# est ramené à 768 px en détail "high". Au-delà, les pixels envoyés sont perdus.
+VISION_MAX_SIDE = 2048
+VISION_TILE = 512
+MARGIN_PADDING = 0.02
+
+
+class PreparedImage(BaseModel):
+    base64: str
+    mime_type: str = "image/jpeg"
+    detail: str = "auto"
+    width: int = 0
+    height: int = 0
+    text_density: Optional[float] = None
+    rotated: bool = False
+    cropped: bool = False
+    bytes_before: int = 0
+    bytes_after: int = 0
+    tokens_before: int = 0
+    tokens_after: int = 0
+
+    def stats(self) -> dict:
+        return self.model_dump(exclude={"base64"})
+
+
+def _vision_scale(width: int, height: int) -> float:
+    return min(1.0, VISION_MAX_SIDE / max(width, height), IMAGE_TARGET_SHORT_SIDE / min(width, height))
+
+
+def _tiles(width: float, height: float) -> int:
+    return math.ceil(width / VISION_TILE) * math.ceil(height / VISION_TILE)
+
+
+def vision_tokens(width: int, height: int, detail: str = "high") -> int:
+    """Estimated input tokens of an image for the vision model (85 base + 170 per 512px tile)."""
+    if detail == "low" or not width or not height:
+        return 85
+    scale = _vision_scale(width, height)
+    return 85 + 170 * _tiles(width * scale, height * scale)
+
+
+def _ink_mask(gray: Image.Image) -> Image.Image:
+    """Pixels clearly darker than the page background (text, drawings)."""
+    histogram = gray.histogram()
+    total, seen, background = sum(histogram), 0, 255
+    for level in range(255, -1, -1):  # fond = niveau clair majoritaire (percentile 60 depuis le blanc)
+        seen += histogram[level]
+        if seen >= total * 0.6:
+            background = level
+            break
+    threshold = max(0, background - 60)
+    return gray.point(lambda p: 255 if p < threshold else 0)
+
+
+def _line_height(mask: Image.Image) -> Optional[float]:
+    """Median height (in mask pixels) of the horizontal bands containing ink, i.e. text lines."""
+    width, height = mask.size
+    data = mask.tobytes()
+    runs, run = [], 0
+    for y in range(height):
+        row = data[y * width:(y + 1) * width]
+        if row.count(255) > width * 0.01:
+            run += 1
+        elif run:
+            runs.append(run)
+            run = 0
+    if run:
+        runs.append(run)
+    if not runs:
+        return None
+    runs.sort()
+    return float(runs[len(runs) // 2])
+
+
+def _choose_scale(width: int, height: int, line_height: Optional[float]) -> float:
+    """
+    Largest scale, no bigger than what the model keeps, that uses the fewest
+    512px tiles while text lines stay at least IMAGE_MIN_TEXT_PX tall.
+    """
+    max_scale = _vision_scale(width, height)
+    if not line_height:
+        return max_scale
+    min_scale = min(max_scale, IMAGE_MIN_TEXT_PX / line_height)
+    # Même nombre de tuiles qu'à l'échelle minimale, mais en remplissant les tuiles
+    return min(
+        max_scale,
+        VISION_TILE * math.ceil(width * min_scale / VISION_TILE) / width,
+        VISION_TILE * math.ceil(height * min_scale / VISION_TILE) / height,
+    )
+
+
+def _fit_tiles(width: int, height: int, original_width: int, original_height: int) -> float:
+    """Scale at which a width x height crop fits in the tile grid the model used for the original image."""
+    scale = _vision_scale(original_width, original_height)
+    return min(
+        VISION_TILE * math.ceil(original_width * scale / VISION_TILE) / width,
+        VISION_TILE * math.ceil(original_height * scale / VISION_TILE) / height,
+    )
+
+
+def preprocess_image(image_base64: str) -> dict:
+    """
+    CPU-bound work, run in a worker process. Returns a PreparedImage as a dict.
+    Falls back to the original bytes when they are not a readable image or
+    when the processed version is not smaller.
+    """
+    try:
+        raw = base64.b64decode(image_base64)
+        img = Image.open(io.BytesIO(raw))
+        img.load()
+    except (binascii.Error, ValueError, OSError):
+        return PreparedImage(base64=image_base64).model_dump()
+
+    original_size, source_format = img.size, img.format
+    tokens_before = vision_tokens(*original_size)
+
+    # 1. Rotation EXIF (photos de téléphone)
+    rotated = img.getexif().get(0x0112, 1) != 1
+    img = ImageOps.exif_transpose(img).convert("L")
+    upright_size = img.size
+
+    # 2. Recadrage des marges (détection sur une miniature)
+    preview = img.copy()
+    preview.thumbnail((1024, 1024))
+    ratio = img.width / preview.width
+    mask = _ink_mask(preview)
+    bbox = mask.getbbox()
+    cropped = False
+    if bbox:
+        pad_x, pad_y = int(img.width * MARGIN_PADDING), int(img.height * MARGIN_PADDING)
+        box = (
+            max(0, int(bbox[0] * ratio) - pad_x), max(0, int(bbox[1] * ratio) - pad_y),
+            min(img.width, int(bbox[2] * ratio) + pad_x), min(img.height, int(bbox[3] * ratio) + pad_y),
+        )
+        if (box[2] - box[0]) * (box[3] - box[1]) < 0.9 * img.width * img.height:
+            img = img.crop(box)
+            mask = mask.crop(tuple(int(v / ratio) for v in box))
+            cropped = True
+
+    # 3. Densité de texte : part d'encre et hauteur des lignes (en pixels de l'image)
+    density = (mask.histogram()[255] / (mask.width * mask.height)) if mask.width and mask.height else 0.0
+    line_height = _line_height(mask)
+    line_height = line_height * ratio if line_height else None
+
+    # 4. Détail "low" (une seule vue 512px, 85 tokens) si le texte y reste lisible,
+    # sinon la plus petite résolution lisible en "high"
+    low_scale = min(1.0, VISION_TILE / max(img.size))
+    if line_height is None or line_height * low_scale >= IMAGE_MIN_TEXT_PX:
+        detail, scale = "low", low_scale
+    else:
+        # Un recadrage change les proportions : jamais plus de tuiles que pour la photo d'origine
+        detail = "high"
+        scale = min(_choose_scale(img.width, img.height, line_height), _fit_tiles(img.width, img.height, *upright_size))
+    if scale < 1.0:
+        img = img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))), Image.Resampling.LANCZOS)
+
+    # 5. Recompression
+    buffer = io.BytesIO()
+    img.save(buffer, "JPEG", quality=IMAGE_JPEG_QUALITY, optimize=True)
+    processed = buffer.getvalue()
+
+    if len(processed) >= len(raw) and not (rotated or cropped):
+        out_base64, out_size, size = image_base64, len(raw), original_size
+        mime_type = Image.MIME.get(source_format, "image/jpeg")
+    else:
+        out_base64, out_size, size = base64.b64encode(processed).decode("ascii"), len(processed), img.size
+        mime_type = "image/jpeg"
+
+    return PreparedImage(
+        base64=out_base64,
+        mime_type=mime_type,
+        detail=detail,
+        width=size[0],
+        height=size[1],
+        text_density=round(density, 4),
+        rotated=rotated,
+        cropped=cropped,
+        bytes_before=len(raw),
+        bytes_after=out_size,
+        tokens_before=tokens_before,
+        tokens_after=vision_tokens(*size, detail),
+    ).model_dump()
+
+
+# --- POOL DE PROCESSUS ---
+
+_pool: Optional[ProcessPoolExecutor] = None
+_prepared: "OrderedDict[str, PreparedImage]" = OrderedDict()  # clé image -> résultat (extraction + vérification)
+PREPARED_MEMO_SIZE = 32
+
+totals = {"pages": 0, "bytes_before": 0, "bytes_after": 0, "tokens_before": 0, "tokens_after": 0, "low_detail": 0}
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=IMAGE_PREPROCESS_WORKERS)
+    return _pool
+
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+async def prepare_image(image_base64: str, key: Optional[str] = None) -> PreparedImage:
+    """
+    Preprocessed version of a page, computed in the process pool.
+    `key` (the image cache key) lets the verification step reuse the result of the extraction step.
+    """
+    if not IMAGE_PREPROCESS_ENABLED:
+        return PreparedImage(base64=image_base64)
+    if key is not None and key in _prepared:
+        _prepared.move_to_end(key)
+        return _prepared[key]
+
+    loop = asyncio.get_running_loop()
+    try:
+        result = await loop.run_in_executor(_get_pool(), preprocess_image, image_base64)
+    except BrokenProcessPool:
+        shutdown()
+        result = await asyncio.to_thread(preprocess_image, image_base64)
+    except Exception as e:
+        log_event("image_preprocess_failed", logging.WARNING, error=str(e))
+        return PreparedImage(base64=image_base64)
+
+    prepared = PreparedImage(**result)
+    totals["pages"] += 1
+    totals["low_detail"] += prepared.detail == "low"
+    for field in ("bytes_before", "bytes_after", "tokens_before", "tokens_after"):
+        totals[field] += getattr(prepared, field)
+
+    if key is not None:
+        _prepared[key] = prepared
+        while len(_prepared) > PREPARED_MEMO_SIZE:
+            _prepared.popitem(last=False)
+    return prepared
+
+
+def stats() -> dict:
+    return {
+        **totals,
+        "bytes_saved": totals["bytes_before"] - totals["bytes_after"],
+        "tokens_saved": totals["tokens_before"] - totals["tokens_after"],
+        "workers": IMAGE_PREPROCESS_WORKERS,
+        "enabled": IMAGE_PREPROCESS_ENABLED,
+    }
@@ -0,0 +1,264 @@
+"""
+Jobs - In-process background queue for long-running generation pipelines
+"""
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import JSONResponse
+
+from .ledger import current_tags, set_tags
+from .observability import log_event
+from .settings import STUDIA_DATA_DIR, JOB_WORKERS, JOB_QUEUE_SIZE, JOB_RESULT_TTL, JOBS_DURABLE
+
+# Un runner reçoit les paramètres du job et un callback de progression (nom d'étape)
+Runner = Callable[[dict, Callable[[str], None]], Awaitable[Any]]
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class JobManager:
+    """
+    Bounded worker pool fed by an asyncio queue.
+
+    Jobs are created from a registered `kind` + JSON params, so that in durable
+    mode (SQLite) jobs interrupted by a restart can be queued again.
+    Finished jobs are kept for `retention` seconds, then purged.
+    """
+
+    def __init__(
+            self,
+            workers: int = JOB_WORKERS,
+            queue_size: int = JOB_QUEUE_SIZE,
+            retention: int = JOB_RESULT_TTL,
+            durable: bool = JOBS_DURABLE,
+    ):
+        self.workers = workers
+        self.retention = retention
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._runners: Dict[str, Runner] = {}
+        self._jobs: Dict[str, dict] = {}
+        self._tasks = []
+
+        self._lock = threading.Lock()
+        self._db = None
+        # Un seul thread d'écriture : les mises à jour d'un job sont appliquées dans l'ordre
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="jobs-db")
+        if durable:
+            os.makedirs(STUDIA_DATA_DIR, exist_ok=True)
+            self._db = sqlite3.connect(os.path.join(STUDIA_DATA_DIR, "jobs.sqlite3"), check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, kind TEXT NOT NULL, status TEXT NOT NULL, "
+                "params TEXT NOT NULL, job TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self._db.commit()
+
+    def register(self, kind: str, runner: Runner):
+        self._runners[kind] = runner
+
+    # --- PERSISTANCE ---
+
+    def _save(self, job: dict, params: Optional[dict] = None):
+        if self._db is None:
+            return
+        with self._lock:
+            if params is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO jobs (id, kind, status, params, job, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    (job["id"], job["kind"], job["status"], json.dumps(params), json.dumps(job), job["updated_at"]),
+                )
+            else:
+                self._db.execute(
+                    "UPDATE jobs SET status = ?, job = ?, updated_at = ? WHERE id = ?",
+                    (job["status"], json.dumps(job), job["updated_at"], job["id"]),
+                )
+            self._db.commit()
+
+    def _load(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._db.execute("SELECT job FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _load_unfinished(self) -> list:
+        with self._lock:
+            return self._db.execute(
+                "SELECT job, params FROM jobs WHERE status IN ('queued', 'running') ORDER BY updated_at"
+            ).fetchall()
+
+    def _persist(self, job: dict, params: Optional[dict] = None):
+        """Write the job to SQLite off the event loop (fire-and-forget, in submission order)."""
+        if self._db is None:
+            return
+        snapshot = json.loads(json.dumps(job))
+        future = asyncio.get_running_loop().run_in_executor(self._writer, self._save, snapshot, params)
+        self._tasks.append(future)
+        future.add_done_callback(self._tasks.remove)
+
+    # --- CYCLE DE VIE ---
+
+    async def start(self):
+        if self._db is not None:
+            # Jobs interrompus par un redémarrage : on les remet en file, dans la limite de sa capacité ;
+            # les plus récents au-delà échouent (le client doit les renvoyer) au lieu de bloquer le démarrage
+            rows = await asyncio.get_running_loop().run_in_executor(self._writer, self._load_unfinished)
+            requeued = 0
+            for job_json, params_json in rows:
+                job = json.loads(job_json)
+                job.update({"status": "queued", "stage": None, "stages": []})
+                self._jobs[job["id"]] = job
+                try:
+                    self._queue.put_nowait((job["id"], json.loads(params_json)))
+                    requeued += 1
+                except asyncio.QueueFull:
+                    job.update({"status": "failed", "error": "Job queue was full after a restart, resubmit the job"})
+                    job["updated_at"] = job["finished_at"] = time.time()
+                    self._persist(job)
+            if rows:
+                log_event("jobs_requeued", requeued=requeued, failed=len(rows) - requeued)
+
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._purger = asyncio.create_task(self._purge_loop())
+
+    async def stop(self):
+        for task in [*self._workers, self._purger]:
+            task.cancel()
+        await asyncio.gather(*self._workers, self._purger, *self._tasks, return_exceptions=True)
+        self._writer.shutdown(wait=True)
+
+    # --- API ---
+
+    def submit(self, kind: str, params: dict) -> dict:
+        if kind not in self._runners:
+            raise KeyError(f"Unknown job kind: {kind}")
+
+        now = time.time()
+        job = {
+            "id": str(uuid.uuid4()),
+            "kind": kind,
+            "status": "queued",
+            "stage": None,
+            "stages": [],
+            "error": None,
+            "result": None,
+            "created_at": now,
+            "updated_at": now,
+            "finished_at": None,
+            "tags": current_tags(),  # fonctionnalité / utilisateur de la requête d'origine
+        }
+        try:
+            self._queue.put_nowait((job["id"], params))
+        except asyncio.QueueFull:
+            raise QueueFullError("Job queue is full, retry later")
+
+        self._jobs[job["id"]] = job
+        self._persist(job, params)
+        return job
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        job = self._jobs.get(job_id)
+        if job is not None or self._db is None:
+            return job
+        # Lecture via le thread d'écriture : jamais sur la boucle, et après les écritures en attente
+        return await asyncio.get_running_loop().run_in_executor(self._writer, self._load, job_id)
+
+    def stats(self) -> dict:
+        counts = {}
+        for job in self._jobs.values():
+            counts[job["status"]] = counts.get(job["status"], 0) + 1
+        return {"workers": self.workers, "queued": self._queue.qsize(), "jobs": counts}
+
+    # --- WORKERS ---
+
+    async def _worker(self):
+        while True:
+            job_id, params = await self._queue.get()
+            job = self._jobs.get(job_id)
+            try:
+                if job is not None:
+                    await self._run(job, params)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job: dict, params: dict):
+        def progress(stage: str):
+            now = time.time()
+            if job["stages"] and job["stages"][-1]["finished_at"] is None:
+                job["stages"][-1]["finished_at"] = now
+            job["stages"].append({"name": stage, "started_at": now, "finished_at": None})
+            job["stage"] = stage
+            job["updated_at"] = now
+            self._persist(job)
+
+        job["status"] = "running"
+        job["updated_at"] = time.time()
+        self._persist(job)
+        set_tags(**{"feature": None, "user_id": None, **job.get("tags", {})})
+
+        try:
+            job["result"] = await self._runners[job["kind"]](params, progress)
+            job["status"] = "done"
+        except Exception as e:
+            log_event("job_failed", logging.ERROR, job_id=job["id"], kind=job["kind"], error=str(e))
+            job["status"] = "failed"
+            job["error"] = str(e)
+
+        now = time.time()
+        if job["stages"] and job["stages"][-1]["finished_at"] is None:
+            job["stages"][-1]["finished_at"] = now
+        job["updated_at"] = job["finished_at"] = now
+        self._persist(job)
+
+    async def _purge_loop(self):
+        while True:
+            await asyncio.sleep(60)
+            cutoff = time.time() - self.retention
+            for job_id in [j["id"] for j in self._jobs.values() if j["finished_at"] and j["finished_at"] < cutoff]:
+                del self._jobs[job_id]
+            if self._db is not None:
+                def purge():
+                    with self._lock:
+                        self._db.execute(
+                            "DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated_at < ?", (cutoff,)
+                        )
+                        self._db.commit()
+                await asyncio.get_running_loop().run_in_executor(self._writer, purge)
+
+
+job_manager = JobManager()
+
+router = APIRouter()
+
+
+def _public(job: dict) -> dict:
+    return {k: v for k, v in job.items() if k != "result"}
+
+
+@router.get("/{job_id}")
+async def get_job_status(job_id: str):
+    job = await job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    return _public(job)
+
+
+@router.get("/{job_id}/result")
+async def get_job_result(job_id: str):
+    job = await job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    if job["status"] == "failed":
+        raise HTTPException(status_code=500, detail=job["error"])
+    if job["status"] != "done":
+        return JSONResponse(status_code=202, content=_public(job))
+    return job["result"]
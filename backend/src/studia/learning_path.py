@@ -1,12 +1,11 @@
 import json
-import os
-from typing import List, Literal, Optional, Any
+import logging
+from typing import AsyncIterator, Callable, List, Literal, Optional, Any
 from pydantic import BaseModel, Field
-from openai import OpenAI
-from dotenv import load_dotenv
-
-load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+from .llm import chat_completion, parse_completion, stream_completion
+from .observability import log_event, traced_pipeline
+from .retrieval import BM25Index, select_context, course_headings
+from .settings import TUTOR_CONTEXT_TOKENS, MASTERY_CONTEXT_TOKENS
 
 
 # --- 1. MODÈLES ATOMIQUES ---
@@ -86,10 +85,15 @@ class GeneralPath(BaseModel):
 
 # --- GÉNÉRATEUR PRINCIPAL ---
 
-def generate_mastery_path(course_text: str, subject: str = "Général") -> dict:
-    print(f"🧬 Génération Parcours 20/20 (v2) pour : {subject}")
-
-    safe_text = course_text[:25000]
+@traced_pipeline("mastery_path")
+async def generate_mastery_path(
+        course_text: str,
+        subject: str = "Général",
+        fresh: bool = False,
+        on_stage: Optional[Callable[[str], None]] = None
+) -> dict:
+    # Cours trop long : on garde les sections les plus représentatives au lieu de couper à 25 000 caractères
+    safe_text = await select_context(course_text, f"{subject} {course_headings(course_text)}", MASTERY_CONTEXT_TOKENS)
 
     if subject in ["Mathématiques", "NSI", "Physique-Chimie", "SVT"]:
         schema = MathPath
@@ -105,16 +109,18 @@ def generate_mastery_path(course_text: str, subject: str = "Général") -> dict:
         prompt = "Tu es un pédagogue expert."
 
     try:
-        completion = client.beta.chat.completions.parse(
-            model="gpt-4o-mini",
+        if on_stage: on_stage("generate")
+        parsed = await parse_completion(
+            stage="generate",
             messages=[
                 {"role": "system", "content": prompt},
                 {"role": "user", "content": f"COURS :\n{safe_text}"}
             ],
-            response_format=schema,
+            schema=schema,
+            fresh=fresh,
         )
 
-        raw_data = completion.choices[0].message.parsed.model_dump()
+        raw_data = parsed.model_dump()
 
         # Transformation en liste d'étapes
         steps = []
@@ -143,18 +149,17 @@ def generate_mastery_path(course_text: str, subject: str = "Général") -> dict:
                 elif "problem" in key or "synthesis" in key or "writing" in key or "apply" in key:
                     step_type = "practice"
 
-            print(f"👉 Étape : {key} -> {step_type}")
-
             steps.append({
                 "type": step_type,
                 "title": value.get("title", "Étape"),
                 "data": value
             })
 
+        log_event("mastery_path_generated", subject=subject, steps=[step["type"] for step in steps])
         return {"steps": steps}
 
     except Exception as e:
-        print(f"❌ Erreur IA: {e}")
+        log_event("mastery_path_failed", logging.ERROR, subject=subject, error=str(e))
         return {"steps": []}
 
 
@@ -167,22 +172,50 @@ class EvaluationResult(BaseModel):
     correction: str
 
 
-def evaluate_student_answer(instruction: str, student_answer: str, course_context: str) -> dict:
+async def evaluate_student_answer(instruction: str, student_answer: str, course_context: str) -> dict:
     prompt = "Tu es un correcteur. Note la réponse /100 et donne un feedback constructif + la correction."
-    completion = client.beta.chat.completions.parse(
-        model="gpt-4o-mini",
-        messages=[{"role": "user", "content": f"CTX:{course_context[:10000]}\nQ:{instruction}\nR:{student_answer}"}],
-        response_format=EvaluationResult
+    context = await select_context(course_context, f"{instruction} {student_answer}", TUTOR_CONTEXT_TOKENS)
+    parsed = await parse_completion(
+        stage="evaluate",
+        messages=[{"role": "user", "content": f"CTX:{context}\nQ:{instruction}\nR:{student_answer}"}],
+        schema=EvaluationResult
     )
-    return completion.choices[0].message.parsed.model_dump()
+    return parsed.model_dump()
 
 
-def chat_with_tutor(history: list, course_context: str, current_message: str) -> str:
-    messages = [{"role": "system", "content": f"Tu es un tuteur expert. Contexte : {course_context[:10000]}."}]
+async def _tutor_messages(history: list, course_context: str, current_message: str, index: Optional[BM25Index] = None) -> list:
+    # Sections du cours pertinentes pour la question (et le dernier échange).
+    # L'index du cours est mis en cache : le client peut n'envoyer que course_hash, résolu en index par l'endpoint.
+    last_user = next((m.get("content", "") for m in reversed(history) if m.get("role") == "user"), "")
+    context = await select_context(course_context, f"{current_message} {last_user}", TUTOR_CONTEXT_TOKENS, index=index)
+    messages = [{"role": "system", "content": f"Tu es un tuteur expert. Contexte : {context}."}]
     for msg in history[-4:]: messages.append(msg)
     messages.append({"role": "user", "content": current_message})
-    res = client.chat.completions.create(model="gpt-4o-mini", messages=messages)
-    return res.choices[0].message.content
+    return messages
+
+
+async def chat_with_tutor(history: list, course_context: str, current_message: str, index: Optional[BM25Index] = None) -> str:
+    messages = await _tutor_messages(history, course_context, current_message, index)
+    return await chat_completion(messages=messages, cache=False, stage="chat")
+
+
+async def stream_chat_with_tutor(
+        history: list,
+        course_context: str,
+        current_message: str,
+        index: Optional[BM25Index] = None
+) -> AsyncIterator[dict]:
+    """
+    Token-streaming variant of chat_with_tutor.
+    Yields {"event": "token", ...} for each delta, then {"event": "done"} with the full reply and usage.
+    """
+    messages = await _tutor_messages(history, course_context, current_message, index)
+    usage = {}
+    parts = []
+    async for delta in stream_completion(messages=messages, cache=False, usage=usage, stage="chat"):
+        parts.append(delta)
+        yield {"event": "token", "data": {"delta": delta}}
+    yield {"event": "done", "data": {"reply": "".join(parts), "usage": usage}}
 
 
 # Stubs pour compatibilité API
@@ -0,0 +1,148 @@
+"""
+Usage Ledger - Append-only record of every LLM call (tokens, latency, cost, stage, feature, user)
+"""
+import asyncio
+import contextvars
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+from .settings import STUDIA_DATA_DIR, LEDGER_ENABLED, LLM_PRICES
+
+# Tags de la requête en cours (posés par le middleware HTTP / les jobs), hérités par les tâches filles
+_tags: contextvars.ContextVar[Dict[str, Optional[str]]] = contextvars.ContextVar("llm_tags", default={})
+
+GROUPS = {"stage", "feature", "model", "user_id", "day"}
+
+
+def set_tags(**tags: Optional[str]):
+    """Tag the LLM calls of the current request / task (feature, user_id...)."""
+    _tags.set({**_tags.get(), **tags})
+
+
+def current_tags() -> Dict[str, Optional[str]]:
+    return dict(_tags.get())
+
+
+def cost_usd(model: str, prompt_tokens: int, completion_tokens: int, cached_tokens: int) -> float:
+    """Estimated cost from LLM_PRICES (USD per 1M tokens: input, cached input, output)."""
+    prices = LLM_PRICES.get(model) or next((p for m, p in LLM_PRICES.items() if model.startswith(m)), None)
+    if not prices:
+        return 0.0
+    uncached = max(0, prompt_tokens - cached_tokens)
+    return (uncached * prices["input"] + cached_tokens * prices["cached"] + completion_tokens * prices["output"]) / 1e6
+
+
+class UsageLedger:
+    """
+    SQLite table written by a single background thread: recording a call never
+    waits on disk, and rows are only ever inserted.
+    """
+
+    def __init__(self, enabled: bool = LEDGER_ENABLED):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ledger-db")
+        self._db = None
+        if enabled:
+            os.makedirs(STUDIA_DATA_DIR, exist_ok=True)
+            self._db = sqlite3.connect(os.path.join(STUDIA_DATA_DIR, "ledger.sqlite3"), check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS llm_calls ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, ts REAL NOT NULL, day TEXT NOT NULL, "
+                "model TEXT, stage TEXT, feature TEXT, user_id TEXT, "
+                "prompt_tokens INTEGER NOT NULL, completion_tokens INTEGER NOT NULL, cached_tokens INTEGER NOT NULL, "
+                "latency_ms REAL NOT NULL, cost_usd REAL NOT NULL, cache_hit INTEGER NOT NULL, "
+                "streamed INTEGER NOT NULL, error TEXT)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_llm_calls_day ON llm_calls(day)")
+            self._db.commit()
+
+    def _insert(self, row: tuple):
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO llm_calls (ts, day, model, stage, feature, user_id, prompt_tokens, completion_tokens, "
+                "cached_tokens, latency_ms, cost_usd, cache_hit, streamed, error) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                row,
+            )
+            self._db.commit()
+
+    def record(
+            self,
+            model: str,
+            usage: Optional[Any] = None,
+            latency: float = 0.0,
+            stage: Optional[str] = None,
+            cache_hit: bool = False,
+            streamed: bool = False,
+            error: Optional[str] = None,
+    ):
+        """Append one call. `usage` is the OpenAI usage object or its dict form."""
+        if self._db is None:
+            return
+        if usage is not None and not isinstance(usage, dict):
+            usage = usage.model_dump(exclude_none=True)
+        usage = usage or {}
+        prompt = usage.get("prompt_tokens", 0) or 0
+        completion = usage.get("completion_tokens", 0) or 0
+        cached = (usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0) or 0
+
+        tags = _tags.get()
+        now = time.time()
+        row = (
+            now, datetime.fromtimestamp(now, timezone.utc).strftime("%Y-%m-%d"), model,
+            stage or tags.get("stage"), tags.get("feature"), tags.get("user_id"),
+            prompt, completion, cached, round(latency * 1000, 1),
+            cost_usd(model, prompt, completion, cached), int(cache_hit), int(streamed), error,
+        )
+        try:
+            self._writer.submit(self._insert, row)
+        except RuntimeError:  # arrêt en cours
+            pass
+
+    def _query(self, group_by: str, since: Optional[str], until: Optional[str]) -> list:
+        where, args = [], []
+        if since:
+            where.append("day >= ?")
+            args.append(since)
+        if until:
+            where.append("day <= ?")
+            args.append(until)
+        sql = (
+            f"SELECT {group_by} AS key, COUNT(*), SUM(cache_hit), SUM(prompt_tokens), SUM(completion_tokens), "
+            f"SUM(cached_tokens), SUM(cost_usd), AVG(CASE WHEN cache_hit = 0 THEN latency_ms END), "
+            f"SUM(CASE WHEN error IS NOT NULL THEN 1 ELSE 0 END) "
+            f"FROM llm_calls {'WHERE ' + ' AND '.join(where) if where else ''} GROUP BY {group_by} ORDER BY key"
+        )
+        with self._lock:
+            rows = self._db.execute(sql, args).fetchall()
+        return [
+            {
+                group_by: key, "calls": calls, "cache_hits": hits or 0,
+                "prompt_tokens": prompt or 0, "completion_tokens": completion or 0, "cached_tokens": cached or 0,
+                "cost_usd": round(cost or 0.0, 6), "avg_latency_ms": round(latency, 1) if latency is not None else None,
+                "errors": errors or 0,
+            }
+            for key, calls, hits, prompt, completion, cached, cost, latency, errors in rows
+        ]
+
+    async def aggregate(self, group_by: str = "stage", since: Optional[str] = None, until: Optional[str] = None) -> list:
+        """Totals grouped by stage / feature / model / user_id / day, optionally between two YYYY-MM-DD days."""
+        if group_by not in GROUPS:
+            raise ValueError(f"group_by must be one of {sorted(GROUPS)}")
+        if self._db is None:
+            return []
+        return await asyncio.to_thread(self._query, group_by, since, until)
+
+    def close(self):
+        self._writer.shutdown(wait=True)
+
+
+ledger = UsageLedger()
@@ -0,0 +1,173 @@
+"""
+LLM Client - One shared, pooled AsyncOpenAI client for every generator
+"""
+import time
+from typing import AsyncIterator, List, Optional, Type
+
+import httpx
+from openai import AsyncOpenAI
+from pydantic import BaseModel
+
+from .cache import llm_cache, make_key
+from .ledger import ledger
+from .observability import external_call
+from .settings import (
+    OPENAI_API_KEY, LLM_MODEL, LLM_MAX_CONNECTIONS, LLM_MAX_KEEPALIVE,
+    LLM_KEEPALIVE_EXPIRY, LLM_TIMEOUT, LLM_MAX_RETRIES,
+)
+
+# Un seul pool HTTP par worker : keep-alive + limites configurables
+http_client = httpx.AsyncClient(
+    limits=httpx.Limits(
+        max_connections=LLM_MAX_CONNECTIONS,
+        max_keepalive_connections=LLM_MAX_KEEPALIVE,
+        keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+    ),
+    timeout=httpx.Timeout(LLM_TIMEOUT, connect=10.0),
+)
+
+client = AsyncOpenAI(api_key=OPENAI_API_KEY, http_client=http_client, max_retries=LLM_MAX_RETRIES)
+
+
+async def chat_completion(
+        messages: List[dict],
+        response_format: Optional[dict] = None,
+        model: str = LLM_MODEL,
+        cache: bool = True,
+        fresh: bool = False,
+        stage: Optional[str] = None,
+        **params
+) -> str:
+    """
+    Run a chat completion and return the message content.
+
+    cache: look up / store the answer in the response cache
+    fresh: skip the lookup (new variant) but still store the new answer
+    stage: pipeline stage recorded in the usage ledger (extract, verify, generate...)
+    """
+    if response_format is not None:
+        params["response_format"] = response_format
+
+    key = make_key("chat", model, messages, params) if cache else None
+    if key and not fresh:
+        cached = await llm_cache.get(key)
+        if cached is not None:
+            ledger.record(model, stage=stage, cache_hit=True)
+            return cached
+
+    started = time.perf_counter()
+    try:
+        with external_call("openai", "chat", stage=stage, model=model):
+            response = await client.chat.completions.create(model=model, messages=messages, **params)
+    except Exception as e:
+        ledger.record(model, latency=time.perf_counter() - started, stage=stage, error=type(e).__name__)
+        raise
+    ledger.record(model, response.usage, time.perf_counter() - started, stage)
+    content = response.choices[0].message.content
+
+    if key and content is not None:
+        await llm_cache.set(key, content)
+    return content
+
+
+async def stream_completion(
+        messages: List[dict],
+        response_format: Optional[dict] = None,
+        model: str = LLM_MODEL,
+        cache: bool = True,
+        fresh: bool = False,
+        usage: Optional[dict] = None,
+        stage: Optional[str] = None,
+        **params
+) -> AsyncIterator[str]:
+    """
+    Stream a chat completion, yielding content deltas as they arrive.
+
+    Shares its cache entries with chat_completion: a cached answer is yielded
+    in one piece, and a fully streamed answer is stored for later calls.
+    If `usage` is given, it is filled with the token usage reported at the end
+    of the stream. Closing the generator early aborts the upstream request.
+    """
+    if response_format is not None:
+        params["response_format"] = response_format
+
+    key = make_key("chat", model, messages, params) if cache else None
+    if key and not fresh:
+        cached = await llm_cache.get(key)
+        if cached is not None:
+            ledger.record(model, stage=stage, cache_hit=True, streamed=True)
+            yield cached
+            return
+
+    started = time.perf_counter()
+    # Le span couvre l'ouverture du flux (jusqu'aux premiers octets), la durée totale est dans le ledger
+    try:
+        with external_call("openai", "chat_stream", stage=stage, model=model):
+            stream = await client.chat.completions.create(
+                model=model, messages=messages, stream=True, stream_options={"include_usage": True}, **params
+            )
+    except BaseException as e:
+        ledger.record(model, latency=time.perf_counter() - started, stage=stage, streamed=True, error=type(e).__name__)
+        raise
+    parts = []
+    reported = {}
+    error = None
+    try:
+        async for chunk in stream:
+            if chunk.usage is not None:
+                reported = chunk.usage.model_dump(exclude_none=True)
+                if usage is not None:
+                    usage.update(reported)
+            if chunk.choices and chunk.choices[0].delta.content:
+                parts.append(chunk.choices[0].delta.content)
+                yield chunk.choices[0].delta.content
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        await stream.close()
+        ledger.record(model, reported, time.perf_counter() - started, stage, streamed=True, error=error)
+
+    if key and parts:
+        await llm_cache.set(key, "".join(parts))
+
+
+async def parse_completion(
+        messages: List[dict],
+        schema: Type[BaseModel],
+        model: str = LLM_MODEL,
+        cache: bool = True,
+        fresh: bool = False,
+        stage: Optional[str] = None,
+        **params
+) -> BaseModel:
+    """
+    Run a structured-output completion and return the parsed Pydantic object.
+    """
+    key = make_key("parse", model, messages, schema.model_json_schema(), params) if cache else None
+    if key and not fresh:
+        cached = await llm_cache.get(key)
+        if cached is not None:
+            ledger.record(model, stage=stage, cache_hit=True)
+            return schema.model_validate_json(cached)
+
+    started = time.perf_counter()
+    try:
+        with external_call("openai", "parse", stage=stage, model=model):
+            completion = await client.beta.chat.completions.parse(
+                model=model, messages=messages, response_format=schema, **params
+            )
+    except Exception as e:
+        ledger.record(model, latency=time.perf_counter() - started, stage=stage, error=type(e).__name__)
+        raise
+    ledger.record(model, completion.usage, time.perf_counter() - started, stage)
+    parsed = completion.choices[0].message.parsed
+
+    if key and parsed is not None:
+        await llm_cache.set(key, parsed.model_dump_json())
+    return parsed
+
+
+async def aclose():
+    """Close the shared HTTP pool (called on app shutdown)."""
+    await client.close()
@@ -1,24 +1,71 @@
 """
 Studia API - MAIN APPLICATION
 """
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import FastAPI, HTTPException, Request, Header
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import StreamingResponse, PlainTextResponse, JSONResponse
+from pydantic import BaseModel, Field
 from typing import Literal, List, Optional, Any, Dict
 from datetime import datetime
 import uuid
-import os
 import hashlib
-import hmac
-from .database import supabase
-from .quiz_generator import quiz_generator_from_image, quiz_generator_from_text, extract_text
+import os
+import asyncio
+import json
+import time
+import math
+from contextlib import asynccontextmanager
+from .database import db
+from . import llm, image_preprocess
+from .quiz_generator import quiz_generator_from_image, quiz_generator_from_text, extract_text_from_pages, stream_quiz_from_text
 from .flashcard_generator import generate_flashcards
 from .learning_path import *
 from .admin import router as admin_router
+from .jobs import job_manager, QueueFullError, router as jobs_router
+from .retrieval import get_index, course_hash
+from .courses import CourseText, save_course, resolve_course_text, router as courses_router
+from .uploads import UploadError, parse_upload
+from .settings import OCR_BATCH_ENABLED, UPLOAD_MAX_PAGES
+from . import batch
+from .ledger import ledger, set_tags
+from .analytics import event_buffer
+from .rollups import rollups
+from .webhooks import webhook_queue, router as webhooks_router
+from . import admission
+from .coalesce import single_flight
+from .question_bank import question_bank
+from .cache import llm_cache
+from .image_cache import ocr_cache
+from .courses import course_store
+from . import observability
+from .observability import (
+    http_duration, http_in_flight, cache_lookups, cache_hit_ratio, log_event, new_trace,
+)
+from .settings import METRICS_ENABLED, METRICS_TOKEN
+
 
-app = FastAPI(title="Studia API", version="2.7.1")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await job_manager.start()
+    await event_buffer.start()
+    await rollups.start()
+    await webhook_queue.start()
+    yield
+    await job_manager.stop()
+    await webhook_queue.stop()
+    await question_bank.stop()
+    # Les événements analytics encore en mémoire sont insérés avant l'arrêt
+    await event_buffer.stop()
+    await rollups.stop()
+    await db.aclose()
+    image_preprocess.shutdown()
+    # Fermeture propre du pool HTTP partagé vers OpenAI
+    await llm.aclose()
+    ledger.close()
+    observability.shutdown_logging()
 
-LEMON_WEBHOOK_SECRET = os.getenv("LEMON_WEBHOOK_SECRET")
+
+app = FastAPI(title="Studia API", version="2.7.1", lifespan=lifespan)
 
 # ✅ CONFIGURATION CORS CORRIGÉE
 # allow_origin_regex permet d'accepter toutes les origines (http/https)
@@ -30,97 +77,308 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Compte le corps des requêtes admises (voir admission_control) ; ajouté avant les middlewares décorés, donc sous eux
+app.add_middleware(admission.BodyMeterMiddleware)
+
+@app.middleware("http")
+async def tag_llm_usage(request: Request, call_next):
+    # Les appels LLM de la requête sont attribués à la fonctionnalité (chemin) et à l'utilisateur vérifié
+    if request.url.path.startswith("/api/"):
+        set_tags(feature=request.url.path[len("/api/"):], user_id=admission.verify_user_token(request.headers.get("x-user-token")))
+    return await call_next(request)
+
+@app.middleware("http")
+async def admission_control(request: Request, call_next):
+    # Routes de génération : taille, débit par utilisateur et place dans la file de la classe
+    target = admission.route_class(request.method, request.url.path)
+    if target is None:
+        return await call_next(request)
+    # Identité vérifiée uniquement (X-User-Id est déclaratif) ; sinon limite par IP (derrière les proxies de confiance)
+    user_id = admission.verify_user_token(request.headers.get("x-user-token"))
+    client_ip = admission.client_ip(request.client.host if request.client else None, request.headers.get("x-forwarded-for"))
+    try:
+        body_bytes = int(request.headers.get("content-length") or 0)
+    except ValueError:
+        body_bytes = 0
+    try:
+        slot = await admission.admit(client_ip, user_id, *target, body_bytes)
+    except admission.Rejected as e:
+        headers = {"Retry-After": str(max(1, math.ceil(e.retry_after)))} if e.retry_after else None
+        return JSONResponse({"detail": e.detail}, status_code=e.status_code, headers=headers)
+    # Taille plafonnée et facturée sur le corps réellement reçu (un envoi chunked n'a pas de Content-Length)
+    request.state.admission = slot
+
+    started = time.perf_counter()
+    try:
+        response = await call_next(request)
+    except Exception:
+        slot.release(time.perf_counter() - started)
+        raise
+    # La place est gardée jusqu'à la fin du corps (réponses SSE)
+    body = response.body_iterator
+    async def released_body():
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            slot.release(time.perf_counter() - started)
+    response.body_iterator = released_body()
+    return response
+
+def _route_template(request: Request) -> str:
+    # Modèle de route (/api/jobs/{job_id}) plutôt que le chemin, pour borner le nombre de séries
+    if "route" not in request.scope:
+        return "unmatched"
+    names = {str(v): k for k, v in request.path_params.items()}
+    return "/".join(f"{{{names[part]}}}" if part in names else part for part in request.url.path.split("/"))
+
+@app.middleware("http")
+async def observe_requests(request: Request, call_next):
+    trace_id = new_trace(request.headers.get("x-request-id"))
+    started = time.perf_counter()
+    http_in_flight.inc(request.method)
+
+    def finish(status: int):
+        duration = time.perf_counter() - started
+        route = _route_template(request)
+        http_in_flight.dec(request.method)
+        http_duration.observe(request.method, route, str(status), value=duration)
+        log_event("request", method=request.method, route=route, status=status, duration_ms=round(duration * 1000, 1))
+
+    try:
+        response = await call_next(request)
+    except Exception:
+        finish(500)
+        raise
+    response.headers["X-Trace-Id"] = trace_id
+
+    # Réponses en flux (SSE) : la requête n'est terminée qu'à la fin du corps
+    body = response.body_iterator
+    async def observed_body():
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            finish(response.status_code)
+    response.body_iterator = observed_body()
+    return response
+
+def _refresh_cache_metrics():
+    for name, cache in (("llm", llm_cache), ("ocr", ocr_cache), ("courses", course_store)):
+        cache_lookups.set(name, "memory_hit", value=cache.memory_hits)
+        cache_lookups.set(name, "disk_hit", value=cache.disk_hits)
+        cache_lookups.set(name, "miss", value=cache.misses)
+        lookups = cache.memory_hits + cache.disk_hits + cache.misses
+        cache_hit_ratio.set(name, value=round((cache.memory_hits + cache.disk_hits) / lookups, 4) if lookups else 0.0)
+
+observability.register_collector(_refresh_cache_metrics)
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics(request: Request):
+    if not METRICS_ENABLED: raise HTTPException(status_code=404, detail="Not Found")
+    if METRICS_TOKEN and request.headers.get("authorization") != f"Bearer {METRICS_TOKEN}":
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return PlainTextResponse(observability.render_metrics(), media_type="text/plain; version=0.0.4")
 
 # --- MODELS ---
-class ExtractTextRequest(BaseModel): images: List[str]
-class ExtractTextResponse(BaseModel): totalImages: int; pagesExtracted: int; extractedText: str; pages: List[Any]
-class QuizGenerateFromTextRequest(BaseModel): course_text: str; num_questions: int = 5; difficulty: str = "medium"
-class QuizGenerateRequest(BaseModel): image: str; num_questions: int = 5; difficulty: str = "medium"
+class ExtractTextRequest(BaseModel): images: List[str] = Field(..., max_length=UPLOAD_MAX_PAGES); batch: Optional[bool] = None
+class ExtractTextResponse(BaseModel): totalImages: int; pagesExtracted: int; extractedText: str; pages: List[Any]; failedPages: List[int] = []; courseId: Optional[str] = None
+# course_text ou course_id (cours déjà envoyé via POST /api/courses)
+class QuizGenerateFromTextRequest(BaseModel): course_text: CourseText = ""; course_id: Optional[str] = None; num_questions: int = 5; difficulty: str = "medium"; fresh: bool = False
+class QuizGenerateRequest(BaseModel): image: str; num_questions: int = 5; difficulty: str = "medium"; fresh: bool = False
 class QuizQuestion(BaseModel): id: int; question: str; options: List[str]; correctAnswer: int; explanation: Optional[str] = ""
-class QuizResponse(BaseModel): id: str; questions: List[QuizQuestion]; createdAt: str; extractedText: Optional[str] = ""
-class FlashcardGenerateRequest(BaseModel): course_text: str; num_cards: int = 10; difficulty: str = "medium"
+class QuizResponse(BaseModel): id: str; questions: List[QuizQuestion]; createdAt: str; extractedText: Optional[str] = ""; courseId: Optional[str] = None
+class FlashcardGenerateRequest(BaseModel): course_text: CourseText = ""; course_id: Optional[str] = None; num_cards: int = 10; difficulty: str = "medium"; fresh: bool = False
 class Flashcard(BaseModel): front: str; back: str; category: Optional[str] = "Général"; difficulty: Optional[str] = "medium"
 class FlashcardResponse(BaseModel): id: str; flashcards: List[Flashcard]; createdAt: str
 
 # Parcours Adaptatif
-class CourseRequest(BaseModel): course_text: str
-class RemediationRequest(BaseModel): course_text: str; weak_concepts: List[str]; difficulty: int
-class ValidationRequest(BaseModel): course_text: str; concepts: List[str]; difficulty: int
-class PracticeRequest(BaseModel): course_text: str; difficulty: str
-class EvalRequest(BaseModel): instruction: str; student_answer: str; course_context: str
+class CourseRequest(BaseModel): course_text: CourseText = ""; course_id: Optional[str] = None
+class RemediationRequest(CourseRequest): weak_concepts: List[str]; difficulty: int
+class ValidationRequest(CourseRequest): concepts: List[str]; difficulty: int
+class PracticeRequest(CourseRequest): difficulty: str
+class EvalRequest(BaseModel): instruction: str; student_answer: str; course_context: CourseText = ""; course_id: Optional[str] = None
 class EvaluateResponse(BaseModel): is_correct: bool; feedback: str; score: int; correction: str
 class MotivationRequest(BaseModel): goal: str; deadline: str; current_xp: int = 0
 class MotivationResponse(BaseModel): daily_message: str; quote: str; micro_tasks: List[dict]
-class ChatRequest(BaseModel): message: str; history: List[dict]; course_context: str
-class ChatResponse(BaseModel): reply: str
-class MasteryRequest(BaseModel): course_text: str; subject: str = "Général"
+# course_context peut être omis une fois le cours indexé : on renvoie alors seulement course_hash
+class ChatRequest(BaseModel): message: str; history: List[dict]; course_context: CourseText = ""; course_hash: Optional[str] = None; course_id: Optional[str] = None
+class ChatResponse(BaseModel): reply: str; course_hash: str
+class MasteryRequest(BaseModel): course_text: CourseText = ""; course_id: Optional[str] = None; subject: str = "Général"; fresh: bool = False
+
+# --- HELPERS ---
+
+def _to_quiz_question(i: int, q: dict) -> QuizQuestion:
+    return QuizQuestion(id=i+1, question=q.get("question"), options=q.get("options"), correctAnswer=q.get("correctAnswer", q.get("correct_index", 0)), explanation=q.get("explanation", ""))
+
+def _quiz_response(quiz_data: dict, extracted_text: str) -> QuizResponse:
+    questions = [_to_quiz_question(i, q) for i, q in enumerate(quiz_data.get("questions", []))]
+    return QuizResponse(id=str(uuid.uuid4()), questions=questions, createdAt=datetime.now().isoformat(), extractedText=extracted_text)
+
+def _flashcard_response(data: dict) -> FlashcardResponse:
+    cards = [Flashcard(front=c.get("front"), back=c.get("back"), category=c.get("category", "Général")) for c in data.get("flashcards", [])]
+    return FlashcardResponse(id=str(uuid.uuid4()), flashcards=cards, createdAt=datetime.now().isoformat())
+
+async def _course_text(course_text: str, course_id: Optional[str]) -> str:
+    try: return await resolve_course_text(course_text, course_id)
+    except LookupError as e: raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e: raise HTTPException(status_code=422, detail=str(e))
+
+def _coalesced(operation: str, fresh: bool, key_parts: tuple, fn):
+    """Identical requests in flight share one pipeline (not with fresh=True, which asks for a new variant)."""
+    if fresh: return fn()
+    return single_flight.do(operation, key_parts, fn)
+
+def _sse(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
 
 # --- ENDPOINTS ---
 
 @app.get("/")
 def root(): return {"status": "online", "version": "2.7.1"}
 
+async def _extract_pages(images: list, batch: Optional[bool] = None) -> ExtractTextResponse:
+    try:
+        pages = await extract_text_from_pages(images, batch=OCR_BATCH_ENABLED if batch is None else batch)
+        failed = [p["pageNumber"] for p in pages if "error" in p]
+        if images and len(failed) == len(images):
+            raise Exception(pages[0]["error"])
+        combined_text = "".join(p["text"] + "\n" for p in pages if "error" not in p)
+        course = await save_course(combined_text) if combined_text.strip() else None
+        return ExtractTextResponse(totalImages=len(images), pagesExtracted=len(images) - len(failed), extractedText=combined_text, pages=pages, failedPages=failed, courseId=course.course_id if course else None)
+    except Exception as e: raise HTTPException(status_code=500, detail=str(e))
+
+async def _upload(request: Request, **limits):
+    try: return await parse_upload(request, **limits)
+    except UploadError as e: raise HTTPException(status_code=e.status_code, detail=e.detail)
+
 @app.post("/api/extract-text", response_model=ExtractTextResponse)
 async def extract_text_endpoint(request: ExtractTextRequest):
+    images = [img.split("base64,")[1] if "base64," in img else img for img in request.images]
+    return await _extract_pages(images, request.batch)
+
+@app.post("/api/extract-text/upload", response_model=ExtractTextResponse)
+async def extract_text_upload_endpoint(request: Request):
+    """
+    multipart/form-data, un fichier par page (dans l'ordre). Les pages sont écrites
+    en fichiers temporaires au fil de l'upload au lieu de transiter en base64 dans du JSON.
+    """
+    form = await _upload(request)
     try:
-        combined_text = ""
-        pages = []
-        for i, img in enumerate(request.images):
-            base64_img = img.split("base64,")[1] if "base64," in img else img
-            text = extract_text(base64_img)
-            combined_text += text + "\n"
-            pages.append({"pageNumber": i+1, "text": text, "wordCount": len(text.split())})
-        return ExtractTextResponse(totalImages=len(request.images), pagesExtracted=len(pages), extractedText=combined_text, pages=pages)
-    except Exception as e: raise HTTPException(status_code=500, detail=str(e))
+        if not form.files: raise HTTPException(status_code=422, detail="No page uploaded")
+        batch = form.fields["batch"].lower() in ("1", "true") if "batch" in form.fields else None
+        return await _extract_pages(form.files, batch)
+    finally:
+        form.close()
 
 @app.post("/api/quiz/generate-from-text", response_model=QuizResponse)
-async def generate_quiz_text(request: QuizGenerateFromTextRequest):
+async def generate_quiz_text(request: QuizGenerateFromTextRequest, x_user_token: Optional[str] = Header(None)):
+    """
+    Assemblé depuis la banque de questions du cours (sans les questions déjà vues par l'utilisateur
+    du X-User-Token signé), sauf avec fresh ; sinon généré, et les questions validées sans issue alimentent la banque.
+    """
+    # Identité vérifiée uniquement : un X-User-Id déclaratif permettrait d'écrire dans l'historique d'un autre
+    user_id = admission.verify_user_token(x_user_token)
+    course_text = await _course_text(request.course_text, request.course_id)
     try:
-        quiz_data = quiz_generator_from_text(request.course_text, request.num_questions, request.difficulty, True)
-        questions = [QuizQuestion(id=i+1, question=q.get("question"), options=q.get("options"), correctAnswer=q.get("correctAnswer", q.get("correct_index", 0)), explanation=q.get("explanation", "")) for i, q in enumerate(quiz_data.get("questions", []))]
-        return QuizResponse(id=str(uuid.uuid4()), questions=questions, createdAt=datetime.now().isoformat(), extractedText=request.course_text)
+        # fresh : nouvelle variante demandée, la banque est ignorée
+        quiz_data = None if request.fresh else await question_bank.assemble(course_text, request.num_questions, request.difficulty, user_id)
+        if quiz_data is None:
+            quiz_data = await _coalesced("quiz_from_text", request.fresh, (course_hash(course_text), request.num_questions, request.difficulty),
+                                         lambda: quiz_generator_from_text(course_text, request.num_questions, request.difficulty, True, request.fresh))
+            await question_bank.add(course_text, request.difficulty, quiz_data, user_id=user_id)
+        return _quiz_response(quiz_data, course_text)
     except Exception as e: raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/quiz/generate-from-text/stream")
+async def generate_quiz_text_stream(request: QuizGenerateFromTextRequest):
+    """
+    Server-Sent Events : question (au fil du flux), validation, replaced, done | error
+    """
+    quiz_id = str(uuid.uuid4())
+    course_text = await _course_text(request.course_text, request.course_id)
+
+    async def events():
+        try:
+            async for item in stream_quiz_from_text(course_text, request.num_questions, request.difficulty, True, request.fresh):
+                data = item["data"]
+                if item["event"] in ("question", "replaced"):
+                    data = {"index": data["index"], "question": _to_quiz_question(data["index"], data["question"]).model_dump()}
+                elif item["event"] == "done":
+                    questions = [_to_quiz_question(i, q) for i, q in enumerate(data.get("questions", []))]
+                    quiz = QuizResponse(id=quiz_id, questions=questions, createdAt=datetime.now().isoformat(), extractedText=course_text)
+                    data = {**quiz.model_dump(), "metadata": data.get("metadata", {})}
+                yield _sse(item["event"], data)
+        except Exception as e:
+            yield _sse("error", {"detail": str(e)})
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
 @app.post("/api/quiz/generate-from-image", response_model=QuizResponse)
 async def generate_quiz_image(request: QuizGenerateRequest):
     try:
         base64 = request.image.split("base64,")[1] if "base64," in request.image else request.image
-        quiz_data = quiz_generator_from_image(base64, request.num_questions, request.difficulty, True)
-        questions = [QuizQuestion(id=i+1, question=q.get("question"), options=q.get("options"), correctAnswer=q.get("correctAnswer", q.get("correct_index", 0)), explanation=q.get("explanation", "")) for i, q in enumerate(quiz_data.get("questions", []))]
-        return QuizResponse(id=str(uuid.uuid4()), questions=questions, createdAt=datetime.now().isoformat(), extractedText=quiz_data.get("extractedText", ""))
+        image_hash = hashlib.sha256(base64.encode()).hexdigest()
+        quiz_data = await _coalesced("quiz_from_image", request.fresh, (image_hash, request.num_questions, request.difficulty),
+                                     lambda: quiz_generator_from_image(base64, request.num_questions, request.difficulty, True, request.fresh))
+        response = _quiz_response(quiz_data, quiz_data.get("extractedText", ""))
+        if response.extractedText.strip():
+            response.courseId = (await save_course(response.extractedText)).course_id
+        return response
     except Exception as e: raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/quiz/generate-from-image/upload", response_model=QuizResponse)
+async def generate_quiz_image_upload(request: Request):
+    """multipart/form-data : image (fichier) + num_questions, difficulty, fresh (champs)."""
+    form = await _upload(request, max_files=1)
+    try:
+        if not form.files: raise HTTPException(status_code=422, detail="No image uploaded")
+        try: params = QuizGenerateRequest(image="", **form.fields)
+        except ValueError as e: raise HTTPException(status_code=422, detail=str(e))
+        image = await asyncio.to_thread(form.files[0].read_base64)
+    finally:
+        form.close()
+    return await generate_quiz_image(params.model_copy(update={"image": image}))
+
 @app.post("/api/flashcards/generate", response_model=FlashcardResponse)
 async def generate_flashcards_endpoint(request: FlashcardGenerateRequest):
+    course_text = await _course_text(request.course_text, request.course_id)
     try:
-        data = generate_flashcards(request.course_text, request.num_cards, request.difficulty)
-        cards = [Flashcard(front=c.get("front"), back=c.get("back"), category=c.get("category", "Général")) for c in data.get("flashcards", [])]
-        return FlashcardResponse(id=str(uuid.uuid4()), flashcards=cards, createdAt=datetime.now().isoformat())
+        data = await _coalesced("flashcards", request.fresh, (course_hash(course_text), request.num_cards, request.difficulty),
+                                lambda: generate_flashcards(course_text, request.num_cards, request.difficulty, fresh=request.fresh))
+        return _flashcard_response(data)
     except Exception as e: raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/path/diagnostic")
 async def diagnostic_endpoint(req: CourseRequest):
-    try: return generate_diagnostic_quiz(req.course_text)
+    course_text = await _course_text(req.course_text, req.course_id)
+    try: return generate_diagnostic_quiz(course_text)
     except Exception as e: raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/path/remediation")
 async def remediation_endpoint(req: RemediationRequest):
-    try: return generate_remediation_content(req.course_text, req.weak_concepts, req.difficulty)
+    course_text = await _course_text(req.course_text, req.course_id)
+    try: return generate_remediation_content(course_text, req.weak_concepts, req.difficulty)
     except Exception as e: raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/path/validation")
 async def validation_endpoint(req: ValidationRequest):
-    try: return generate_validation_quiz(req.course_text, req.concepts, req.difficulty)
+    course_text = await _course_text(req.course_text, req.course_id)
+    try: return generate_validation_quiz(course_text, req.concepts, req.difficulty)
     except Exception as e: raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/path/practice")
 async def practice_endpoint(req: PracticeRequest):
-    try: return generate_practice_exercise(req.course_text, req.difficulty)
+    course_text = await _course_text(req.course_text, req.course_id)
+    try: return generate_practice_exercise(course_text, req.difficulty)
     except Exception as e: raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/path/evaluate", response_model=EvaluateResponse)
 async def evaluate_answer_endpoint(req: EvalRequest):
-    try: return evaluate_student_answer(req.instruction, req.student_answer, req.course_context)
+    course_context = await _course_text(req.course_context, req.course_id)
+    try: return await evaluate_student_answer(req.instruction, req.student_answer, course_context)
     except Exception as e: raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/motivation/generate", response_model=MotivationResponse)
@@ -128,32 +386,133 @@ async def motivation_endpoint(request: MotivationRequest):
     try: return generate_daily_plan(request.goal, request.deadline, request.current_xp)
     except Exception as e: raise HTTPException(status_code=500, detail=str(e))
 
+async def _tutor_index(request: ChatRequest):
+    """
+    Index the course once per session (rebuilt from the course store if evicted); 409 if
+    only a hash is sent and the course is gone. The index is resolved here and passed down,
+    so an eviction during the request cannot lose it.
+    """
+    try:
+        return await get_index(request.course_context, request.course_hash or request.course_id)
+    except LookupError as e:
+        if not request.course_id:
+            raise HTTPException(status_code=409, detail=str(e))
+        return await get_index(await _course_text("", request.course_id))
+
 @app.post("/api/chat/tutor", response_model=ChatResponse)
 async def chat_tutor_endpoint(request: ChatRequest):
+    course_hash, index = await _tutor_index(request)
     try:
-        reply = chat_with_tutor(request.history, request.course_context, request.message)
-        return ChatResponse(reply=reply)
+        reply = await chat_with_tutor(request.history, request.course_context, request.message, index)
+        return ChatResponse(reply=reply, course_hash=course_hash)
     except Exception as e: raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/chat/tutor/stream")
+async def chat_tutor_stream_endpoint(request: ChatRequest):
+    """
+    Server-Sent Events : token (delta), done (réponse complète + usage) | error.
+    Si le client ferme la connexion, Starlette annule le générateur et la requête OpenAI est interrompue.
+    """
+    course_hash, index = await _tutor_index(request)
+
+    async def events():
+        try:
+            async for item in stream_chat_with_tutor(request.history, request.course_context, request.message, index):
+                if item["event"] == "done":
+                    item["data"]["course_hash"] = course_hash
+                yield _sse(item["event"], item["data"])
+        except Exception as e:
+            yield _sse("error", {"detail": str(e)})
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
 @app.post("/api/path/generate")
 async def path_generate_endpoint(request: MasteryRequest):
-    return generate_mastery_path(request.course_text, request.subject)
+    course_text = await _course_text(request.course_text, request.course_id)
+    return await _coalesced("mastery_path", request.fresh, (course_hash(course_text), request.subject),
+                            lambda: generate_mastery_path(course_text, request.subject, request.fresh))
 
-app.include_router(admin_router, prefix="/api/analytics", tags=["Admin"])
+# --- BACKGROUND JOBS ---
+# POST renvoie un job_id ; suivi via GET /api/jobs/{id} et /api/jobs/{id}/result
+
+async def _run_quiz_image_job(params: dict, progress) -> dict:
+    image_hash = hashlib.sha256(params["image"].encode()).hexdigest()
+    quiz_data = await _coalesced("quiz_from_image", params["fresh"], (image_hash, params["num_questions"], params["difficulty"]),
+                                 lambda: quiz_generator_from_image(params["image"], params["num_questions"], params["difficulty"], True, params["fresh"], on_stage=progress))
+    return _quiz_response(quiz_data, quiz_data.get("extractedText", "")).model_dump()
 
-@app.post("/api/webhook/lemon")
-async def lemon_webhook(request: Request):
-    if not LEMON_WEBHOOK_SECRET: return {"error": "No secret"}
-    body = await request.body()
-    signature = request.headers.get("X-Signature")
-    expected = hmac.new(LEMON_WEBHOOK_SECRET.encode(), body, hashlib.sha256).hexdigest()
-    if not hmac.compare_digest(signature, expected): raise HTTPException(401, "Invalid signature")
-    data = await request.json()
-    if data.get("meta", {}).get("event_name") in ["order_created", "subscription_created"]:
-        user_id = data.get("meta", {}).get("custom_data", {}).get("user_id")
-        if user_id and supabase:
-            supabase.table('users').update({'is_premium': True, 'energy': 999}).eq('id', user_id).execute()
-    return {"received": True}
+async def _run_flashcards_job(params: dict, progress) -> dict:
+    data = await _coalesced("flashcards", params["fresh"], (course_hash(params["course_text"]), params["num_cards"], params["difficulty"]),
+                            lambda: generate_flashcards(params["course_text"], params["num_cards"], params["difficulty"], fresh=params["fresh"], on_stage=progress))
+    return _flashcard_response(data).model_dump()
+
+async def _run_path_job(params: dict, progress) -> dict:
+    return await _coalesced("mastery_path", params["fresh"], (course_hash(params["course_text"]), params["subject"]),
+                            lambda: generate_mastery_path(params["course_text"], params["subject"], params["fresh"], on_stage=progress))
+
+job_manager.register("quiz_from_image", _run_quiz_image_job)
+job_manager.register("flashcards", _run_flashcards_job)
+job_manager.register("mastery_path", _run_path_job)
+
+def _submit_job(kind: str, params: dict) -> dict:
+    try: job = job_manager.submit(kind, params)
+    except QueueFullError as e: raise HTTPException(status_code=503, detail=str(e))
+    return {"job_id": job["id"], "status": job["status"]}
+
+@app.post("/api/jobs/quiz/generate-from-image", status_code=202)
+async def quiz_image_job_endpoint(request: QuizGenerateRequest):
+    image = request.image.split("base64,")[1] if "base64," in request.image else request.image
+    return _submit_job("quiz_from_image", {"image": image, "num_questions": request.num_questions, "difficulty": request.difficulty, "fresh": request.fresh})
+
+@app.post("/api/jobs/flashcards/generate", status_code=202)
+async def flashcards_job_endpoint(request: FlashcardGenerateRequest):
+    course_text = await _course_text(request.course_text, request.course_id)
+    return _submit_job("flashcards", {**request.model_dump(), "course_text": course_text})
+
+@app.post("/api/jobs/path/generate", status_code=202)
+async def path_job_endpoint(request: MasteryRequest):
+    course_text = await _course_text(request.course_text, request.course_id)
+    return _submit_job("mastery_path", {**request.model_dump(), "course_text": course_text})
+
+# --- BATCH ---
+# Plusieurs cours / types / difficultés en une requête, résultats en SSE au fil de l'eau
+
+async def _batch_quiz(course_text: str, count: int, difficulty: str, fresh: bool) -> dict:
+    quiz_data = await _coalesced("quiz_from_text", fresh, (course_hash(course_text), count, difficulty),
+                                 lambda: quiz_generator_from_text(course_text, count, difficulty, True, fresh))
+    return _quiz_response(quiz_data, "").model_dump()
+
+async def _batch_flashcards(course_text: str, count: int, difficulty: str, fresh: bool) -> dict:
+    data = await _coalesced("flashcards", fresh, (course_hash(course_text), count, difficulty),
+                            lambda: generate_flashcards(course_text, count, difficulty, fresh=fresh))
+    return _flashcard_response(data).model_dump()
+
+batch.register("quiz", _batch_quiz)
+batch.register("flashcards", _batch_flashcards)
+
+@app.post("/api/batch/generate")
+async def batch_generate_endpoint(request: batch.BatchGenerateRequest, http_request: Request):
+    """
+    Server-Sent Events : accepted, item (un par élément, dans l'ordre d'achèvement), done.
+    """
+    # Admis pour 1 jeton : chaque élément supplémentaire est débité du seau de l'appelant
+    slot = getattr(http_request.state, "admission", None)
+    if slot is not None:
+        slot.charge(len(request.items) - 1)
+
+    async def events():
+        try:
+            async for item in batch.run_batch(request.items, request.fresh):
+                yield _sse(item["event"], item["data"])
+        except Exception as e:
+            yield _sse("error", {"detail": str(e)})
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+app.include_router(jobs_router, prefix="/api/jobs", tags=["Jobs"])
+app.include_router(courses_router, prefix="/api/courses", tags=["Courses"])
+app.include_router(admin_router, prefix="/api/analytics", tags=["Admin"])
+app.include_router(webhooks_router, prefix="/api/webhook", tags=["Webhooks"])
 
 if __name__ == "__main__":
     import uvicorn
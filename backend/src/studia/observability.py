@@ -0,0 +1,338 @@
+"""
+Observability - Trace spans, Prometheus metrics and non-blocking structured logging
+"""
+import bisect
+import contextvars
+import functools
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from .settings import LOG_LEVEL, LOG_JSON, METRICS_RESERVOIR_SIZE
+
+# --- LOGGING STRUCTURÉ (QueueHandler : l'écriture sur stdout se fait dans un thread dédié) ---
+
+_trace: contextvars.ContextVar[Tuple[Optional[str], Optional[str]]] = contextvars.ContextVar(
+    "trace", default=(None, None)  # (trace_id, span_id courant)
+)
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "event": record.getMessage(),
+            **getattr(record, "fields", {}),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        fields = " ".join(f"{k}={v}" for k, v in getattr(record, "fields", {}).items())
+        return f"{record.levelname[0]} {record.getMessage()} {fields}".rstrip()
+
+
+_log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+_stream_handler = logging.StreamHandler(sys.stdout)
+_stream_handler.setFormatter(JsonFormatter() if LOG_JSON else TextFormatter())
+_listener = logging.handlers.QueueListener(_log_queue, _stream_handler, respect_handler_level=False)
+
+logger = logging.getLogger("studia")
+logger.setLevel(LOG_LEVEL)
+logger.addHandler(logging.handlers.QueueHandler(_log_queue))
+logger.propagate = False
+_listener.start()
+
+
+def log_event(event: str, level: int = logging.INFO, **fields):
+    """Structured log line; the current trace id is attached automatically."""
+    if not logger.isEnabledFor(level):
+        return
+    trace_id, span_id = _trace.get()
+    if trace_id:
+        fields = {"trace_id": trace_id, "span_id": span_id, **fields}
+    logger.log(level, event, extra={"fields": fields})
+
+
+def shutdown_logging():
+    _listener.stop()
+
+
+# --- MÉTRIQUES ---
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+QUANTILES = (0.5, 0.95, 0.99)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Iterable[str], values: Iterable[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name, self.help, self.label_names = name, help, labels
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def expose(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{_labels(self.label_names, k)} {v}" for k, v in sorted(self._values.items())]
+        return lines
+
+
+class Gauge(Counter):
+    def set(self, *labels: str, value: float):
+        with self._lock:
+            self._values[labels] = value
+
+    def dec(self, *labels: str, amount: float = 1.0):
+        self.inc(*labels, amount=-amount)
+
+    def expose(self) -> List[str]:
+        lines = super().expose()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+
+class Histogram:
+    """
+    Prometheus histogram plus a reservoir of the last observations per label
+    set, from which p50 / p95 / p99 are computed directly.
+    """
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name, self.help, self.label_names, self.buckets = name, help, labels, buckets
+        self._series: Dict[LabelValues, dict] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, *labels: str, value: float):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = {
+                    "counts": [0] * len(self.buckets), "sum": 0.0, "count": 0,
+                    "recent": deque(maxlen=METRICS_RESERVOIR_SIZE),
+                }
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series["counts"][index] += 1
+            series["sum"] += value
+            series["count"] += 1
+            series["recent"].append(value)
+
+    def quantiles(self) -> List[dict]:
+        with self._lock:
+            snapshot = [(labels, sorted(s["recent"]), s["count"]) for labels, s in self._series.items()]
+        result = []
+        for labels, values, count in sorted(snapshot):
+            if not values:
+                continue
+            entry = dict(zip(self.label_names, labels))
+            entry["count"] = count
+            for q in QUANTILES:
+                entry[f"p{int(q * 100)}"] = round(values[min(len(values) - 1, int(q * len(values)))], 4)
+            result.append(entry)
+        return result
+
+    def expose(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((labels, list(s["counts"]), s["sum"], s["count"]) for labels, s in self._series.items())
+        for labels, counts, total, count in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, labels, le)} {cumulative}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_labels(self.label_names, labels, le)} {count}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, labels)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, labels)} {count}")
+
+        # Quantiles calculés sur les dernières observations (fenêtre glissante)
+        name = f"{self.name}_quantile"
+        lines += [f"# HELP {name} {self.help} (p50/p95/p99 over the last {METRICS_RESERVOIR_SIZE} observations)",
+                  f"# TYPE {name} gauge"]
+        for entry in self.quantiles():
+            labels = tuple(entry[n] for n in self.label_names)
+            for q in QUANTILES:
+                quantile = 'quantile="%s"' % q
+                lines.append(f"{name}{_labels(self.label_names, labels, quantile)} {entry['p%d' % int(q * 100)]}")
+        return lines
+
+
+http_duration = Histogram("studia_http_request_duration_seconds", "HTTP request latency", ("method", "route", "status"))
+http_in_flight = Gauge("studia_http_requests_in_flight", "HTTP requests being processed", ("method",))
+stage_duration = Histogram("studia_stage_duration_seconds", "Pipeline stage latency", ("pipeline", "stage", "status"))
+pipeline_duration = Histogram("studia_pipeline_duration_seconds", "Whole pipeline latency", ("pipeline", "status"))
+pipelines_in_flight = Gauge("studia_pipelines_in_flight", "Pipelines running", ("pipeline",))
+external_duration = Histogram("studia_external_call_duration_seconds", "External call latency", ("service", "operation", "status"))
+external_in_flight = Gauge("studia_external_calls_in_flight", "External calls in progress", ("service",))
+cache_lookups = Gauge("studia_cache_lookups", "Cache lookups since startup", ("cache", "result"))
+cache_hit_ratio = Gauge("studia_cache_hit_ratio", "Cache hit ratio since startup", ("cache",))
+
+REGISTRY = [http_duration, http_in_flight, stage_duration, pipeline_duration, pipelines_in_flight,
+            external_duration, external_in_flight, cache_lookups, cache_hit_ratio]
+
+# Fonctions appelées avant chaque export pour mettre à jour les jauges (ratios de cache...)
+_collectors: List[Callable[[], None]] = []
+
+
+def register_collector(collector: Callable[[], None]):
+    _collectors.append(collector)
+
+
+def render_metrics() -> str:
+    for collector in _collectors:
+        try:
+            collector()
+        except Exception as e:
+            log_event("metrics_collector_failed", logging.WARNING, error=str(e))
+    lines = []
+    for metric in REGISTRY:
+        lines += metric.expose()
+    return "\n".join(lines) + "\n"
+
+
+def latency_report() -> dict:
+    """p50 / p95 / p99 per endpoint, pipeline stage and external call (in seconds)."""
+    return {
+        "http": http_duration.quantiles(),
+        "stages": stage_duration.quantiles(),
+        "pipelines": pipeline_duration.quantiles(),
+        "external": external_duration.quantiles(),
+    }
+
+
+# --- SPANS ---
+
+def new_trace(trace_id: Optional[str] = None) -> str:
+    trace_id = trace_id or uuid.uuid4().hex[:16]
+    _trace.set((trace_id, None))
+    return trace_id
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """Timed span, child of the current one; logged when it ends."""
+    trace_id, parent_id = _trace.get()
+    span_id = uuid.uuid4().hex[:8]
+    token = _trace.set((trace_id, span_id))
+    started = time.perf_counter()
+    status = "ok"
+    try:
+        yield
+    except BaseException as e:
+        status = "cancelled" if isinstance(e, GeneratorExit) else "error"
+        attrs["error"] = type(e).__name__
+        raise
+    finally:
+        _trace.reset(token)
+        log_event("span", name=name, span_id=span_id, parent_id=parent_id, status=status,
+                  duration_ms=round((time.perf_counter() - started) * 1000, 1), **attrs)
+
+
+@contextmanager
+def external_call(service: str, operation: str, **attrs):
+    """Span + latency histogram + in-flight gauge around a call to OpenAI, Supabase..."""
+    external_in_flight.inc(service)
+    started = time.perf_counter()
+    status = "ok"
+    try:
+        with span(f"{service}.{operation}", **attrs):
+            yield
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        external_in_flight.dec(service)
+        external_duration.observe(service, operation, status, value=time.perf_counter() - started)
+
+
+class StageTracker:
+    """
+    on_stage callback that times each stage of a pipeline (a stage ends when
+    the next one starts) and forwards the stage name to the caller's callback.
+    Calls made during a stage (OpenAI...) are logged as children of its span.
+    """
+
+    def __init__(self, pipeline: str, forward: Optional[Callable[[str], None]] = None):
+        self.pipeline = pipeline
+        self.forward = forward
+        self.trace_id, self.parent_id = _trace.get()
+        self.started = time.perf_counter()
+        self.stage: Optional[str] = None
+        self.stage_span: Optional[str] = None
+        self.stage_started = self.started
+
+    def _end_stage(self, status: str):
+        if self.stage is not None:
+            duration = time.perf_counter() - self.stage_started
+            stage_duration.observe(self.pipeline, self.stage, status, value=duration)
+            log_event("stage", span_id=self.stage_span, parent_id=self.parent_id, pipeline=self.pipeline,
+                      stage=self.stage, status=status, duration_ms=round(duration * 1000, 1))
+
+    def __call__(self, stage: str):
+        self._end_stage("ok")
+        self.stage, self.stage_span, self.stage_started = stage, uuid.uuid4().hex[:8], time.perf_counter()
+        _trace.set((self.trace_id, self.stage_span))
+        if self.forward:
+            self.forward(stage)
+
+    def close(self, error: Optional[BaseException] = None):
+        status = "ok" if error is None else "error"
+        self._end_stage(status)
+        self.stage = None
+        _trace.set((self.trace_id, self.parent_id))
+        duration = time.perf_counter() - self.started
+        pipeline_duration.observe(self.pipeline, status, value=duration)
+        log_event("pipeline", pipeline=self.pipeline, status=status, duration_ms=round(duration * 1000, 1),
+                  **({"error": str(error)} if error is not None else {}))
+
+
+def traced_pipeline(name: str):
+    """
+    Decorator for pipelines taking an `on_stage` keyword: each stage they
+    announce becomes a timed span, and the whole run is timed too.
+    """
+    def decorate(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, on_stage: Optional[Callable[[str], None]] = None, **kwargs):
+            tracker = StageTracker(name, on_stage)
+            pipelines_in_flight.inc(name)
+            try:
+                result = await fn(*args, on_stage=tracker, **kwargs)
+            except BaseException as e:
+                tracker.close(e)
+                raise
+            finally:
+                pipelines_in_flight.dec(name)
+            tracker.close()
+            return result
+        return wrapper
+    return decorate
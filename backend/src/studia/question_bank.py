@@ -0,0 +1,274 @@
+"""
+Question Bank - Per-course pool of validated MCQs (tagged by difficulty and section)
+from which quizzes are assembled locally, without repeating questions a user has seen
+"""
+import asyncio
+import logging
+import math
+import random
+import time
+from typing import Dict, List, Optional
+
+from .cache import make_key
+from .courses import get_artifact, put_artifact
+from . import admission
+from .ledger import set_tags
+from .observability import Counter, REGISTRY, log_event
+from .quiz_generator import quiz_generator_from_text
+from .retrieval import chunk_markdown, course_hash, normalize
+from .settings import (
+    QUESTION_BANK_ENABLED, QUESTION_BANK_SIZE, QUESTION_BANK_MAX, QUESTION_BANK_BATCH,
+    QUESTION_BANK_LOW_WATER, QUESTION_BANK_CONCURRENCY, QUESTION_BANK_WEIGHT, LOCAL_VALIDATION_THRESHOLD,
+)
+
+DIFFICULTIES = ("easy", "medium", "hard")
+
+requests = Counter("studia_question_bank_requests_total", "Quiz requests served by the question bank", ("result",))
+generated = Counter("studia_question_bank_questions_total", "Questions added to question banks", ("difficulty",))
+REGISTRY.extend([requests, generated])
+
+
+def _question_id(question: dict) -> str:
+    return make_key(normalize(question.get("question", "")).strip())[:16]
+
+
+def validated_questions(quiz_data: dict) -> List[dict]:
+    """
+    Questions of a pipeline result that may enter the bank: the final validation
+    passed with a good score, and no remaining issue points at them. An issue
+    that points at no question rejects the whole quiz, unless it is low
+    severity (e.g. answer positions not varied enough, which sampling undoes).
+    """
+    quality = (quiz_data.get("metadata") or {}).get("quiz_quality") or {}
+    if not quality.get("final_valid") or quality.get("final_score", 0) < LOCAL_VALIDATION_THRESHOLD:
+        return []
+    flagged = set()
+    for issue in quality.get("final_issues", []):
+        index = issue.get("question_index")
+        if isinstance(index, int) and not isinstance(index, bool):
+            flagged.add(index)
+        elif issue.get("severity") != "low":
+            return []
+    return [q for i, q in enumerate(quiz_data.get("questions", [])) if i not in flagged]
+
+
+class QuestionBank:
+    """
+    One bank per (course, difficulty), stored as a course artifact. Quizzes are
+    sampled from it across sections; the questions a user received are
+    remembered per course so retakes only get new ones. When a user has fewer
+    than `low_water` unseen questions left (or the bank is below its target
+    size), more are generated in the background, section by section, with the
+    validated quiz pipeline.
+    """
+
+    def __init__(self, enabled: bool = QUESTION_BANK_ENABLED):
+        self.enabled = enabled
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._top_ups: Dict[str, asyncio.Task] = {}
+        self._semaphore = asyncio.Semaphore(QUESTION_BANK_CONCURRENCY)
+        self.hits = 0
+        self.misses = 0
+
+    def _lock(self, key: str) -> asyncio.Lock:
+        if len(self._locks) > 10_000:
+            self._locks = {k: lock for k, lock in self._locks.items() if lock.locked()}
+        return self._locks.setdefault(key, asyncio.Lock())
+
+    # --- STOCKAGE ---
+
+    async def _load(self, bank_id: str, difficulty: str) -> dict:
+        bank = await get_artifact(bank_id, f"question_bank:{difficulty}")
+        return bank or {"questions": [], "next_section": 0, "updated_at": None}
+
+    async def add(self, course_text: str, difficulty: str, quiz_data: dict, section: str = "", user_id: Optional[str] = None) -> int:
+        """
+        Add the validated questions of a quiz pipeline result to the course bank
+        (duplicates are skipped) and mark all its questions as seen by `user_id`
+        if given; returns the number added.
+        """
+        if not self.enabled or difficulty not in DIFFICULTIES:
+            return 0
+        questions = validated_questions(quiz_data)
+        bank_id = course_hash(course_text)
+        async with self._lock(f"{bank_id}:{difficulty}"):
+            bank = await self._load(bank_id, difficulty)
+            known = {q["id"] for q in bank["questions"]}
+            added = 0
+            for question in questions:
+                if len(bank["questions"]) >= QUESTION_BANK_MAX:
+                    break
+                if not question.get("question") or len(question.get("options") or []) != 4:
+                    continue
+                entry = {
+                    "id": _question_id(question),
+                    "question": question["question"],
+                    "options": question["options"],
+                    "correctAnswer": question.get("correctAnswer", question.get("correct_index", 0)),
+                    "explanation": question.get("explanation", ""),
+                    "difficulty": difficulty,
+                    "section": question.get("section", section),
+                }
+                if entry["id"] in known:
+                    continue
+                known.add(entry["id"])
+                bank["questions"].append(entry)
+                added += 1
+            if added:
+                bank["updated_at"] = time.time()
+                await put_artifact(bank_id, f"question_bank:{difficulty}", bank)
+                generated.inc(difficulty, amount=added)
+        if user_id:
+            await self._mark_seen(bank_id, difficulty, user_id, {_question_id(q) for q in quiz_data.get("questions", [])})
+        return added
+
+    async def _mark_seen(self, bank_id: str, difficulty: str, user_id: str, ids: set):
+        seen_key = f"seen:{user_id}:{difficulty}"
+        async with self._lock(f"{bank_id}:{seen_key}"):
+            seen = set(await get_artifact(bank_id, seen_key) or [])
+            await put_artifact(bank_id, seen_key, sorted(seen | ids))
+
+    # --- COMPLÉMENT EN ARRIÈRE-PLAN ---
+
+    async def _generate(self, course_text: str, difficulty: str, count: int):
+        # La tâche hérite du contexte de la requête qui l'a lancée : ses appels LLM ne sont pas les siens
+        set_tags(feature="question_bank", user_id=None)
+        bank_id = course_hash(course_text)
+        chunks = await asyncio.to_thread(chunk_markdown, course_text)
+        if not chunks:
+            return
+        bank = await self._load(bank_id, difficulty)
+        start, refill = bank["next_section"], bool(bank["questions"])
+
+        generation = admission.classes.get("generation")
+        stopped = False
+
+        async def one(offset: int):
+            nonlocal stopped
+            chunk = chunks[(start + offset) % len(chunks)]
+            async with self._semaphore:
+                if stopped:
+                    return 0
+                # Même file d'admission que les requêtes, avec un poids réduit : le complément
+                # passe après les utilisateurs et s'arrête dès que la file est saturée
+                if generation is not None:
+                    try:
+                        await generation.acquire("question-bank", 1, QUESTION_BANK_WEIGHT)
+                    except admission.Rejected:
+                        stopped = True
+                        return 0
+                started = time.perf_counter()
+                try:
+                    # fresh : une section déjà traitée doit produire de nouvelles questions
+                    quiz = await quiz_generator_from_text(chunk.text, QUESTION_BANK_BATCH, difficulty, True, fresh=refill or offset >= len(chunks))
+                finally:
+                    if generation is not None:
+                        generation.release(time.perf_counter() - started)
+            return await self.add(course_text, difficulty, quiz, section=chunk.heading)
+
+        calls = math.ceil(count / QUESTION_BANK_BATCH)
+        results = await asyncio.gather(*[one(i) for i in range(calls)], return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                log_event("question_bank_generation_failed", logging.WARNING, bank=bank_id[:8], difficulty=difficulty, error=str(result))
+        if stopped:
+            log_event("question_bank_top_up_paused", bank=bank_id[:8], difficulty=difficulty, reason="generation_queue_busy")
+
+        async with self._lock(f"{bank_id}:{difficulty}"):
+            bank = await self._load(bank_id, difficulty)
+            bank["next_section"] = (start + calls) % len(chunks)
+            await put_artifact(bank_id, f"question_bank:{difficulty}", bank)
+        log_event("question_bank_top_up", bank=bank_id[:8], difficulty=difficulty, added=sum(r for r in results if isinstance(r, int)))
+
+    def top_up(self, course_text: str, difficulty: str, size: int):
+        """Schedule a background top-up of the bank (at most one per course and difficulty)."""
+        if size >= QUESTION_BANK_MAX:
+            return
+        key = f"{course_hash(course_text)}:{difficulty}"
+        if key in self._top_ups:
+            return
+        count = min(QUESTION_BANK_MAX - size, max(QUESTION_BANK_SIZE - size, QUESTION_BANK_SIZE // 2))
+        task = asyncio.create_task(self._generate(course_text, difficulty, count))
+        self._top_ups[key] = task
+        task.add_done_callback(lambda t: self._top_ups.pop(key, None))
+
+    # --- ASSEMBLAGE ---
+
+    @staticmethod
+    def _sample(questions: List[dict], count: int) -> List[dict]:
+        """Random questions spread over sections (round-robin over shuffled sections)."""
+        by_section: Dict[str, List[dict]] = {}
+        for question in questions:
+            by_section.setdefault(question.get("section", ""), []).append(question)
+        groups = list(by_section.values())
+        random.shuffle(groups)
+        for group in groups:
+            random.shuffle(group)
+        picked = []
+        while len(picked) < count and groups:
+            for group in list(groups):
+                if len(picked) == count:
+                    break
+                picked.append(group.pop())
+                if not group:
+                    groups.remove(group)
+        random.shuffle(picked)
+        return picked
+
+    async def assemble(self, course_text: str, num_questions: int, difficulty: str, user_id: Optional[str] = None) -> Optional[dict]:
+        """
+        Quiz of `num_questions` bank questions the user has not seen yet, or None
+        when the bank cannot serve it (the caller then runs the generation pipeline).
+        """
+        if not self.enabled or difficulty not in DIFFICULTIES:
+            return None
+        bank_id = course_hash(course_text)
+        bank = await self._load(bank_id, difficulty)
+        questions = bank["questions"]
+
+        seen_key = f"seen:{user_id}:{difficulty}"
+        async with self._lock(f"{bank_id}:{seen_key}"):
+            seen = set(await get_artifact(bank_id, seen_key) or []) if user_id else set()
+            available = [q for q in questions if q["id"] not in seen]
+            if len(available) < num_questions and len(questions) >= QUESTION_BANK_MAX:
+                seen, available = set(), questions  # banque pleine et épuisée : nouveau cycle
+            left = len(available) - num_questions
+            if len(questions) < QUESTION_BANK_SIZE or left < QUESTION_BANK_LOW_WATER:
+                self.top_up(course_text, difficulty, len(questions))
+            if left < 0:
+                self.misses += 1
+                requests.inc("miss")
+                return None
+            picked = self._sample(available, num_questions)
+            if user_id:
+                await put_artifact(bank_id, seen_key, sorted(seen | {q["id"] for q in picked}))
+
+        self.hits += 1
+        requests.inc("hit")
+        return {
+            "questions": picked,
+            "metadata": {
+                "source": "question_bank",
+                "bank_size": len(questions),
+                "unseen_left": left,
+            },
+        }
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+            "top_ups_running": len(self._top_ups),
+        }
+
+    async def stop(self):
+        tasks = list(self._top_ups.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+question_bank = QuestionBank()
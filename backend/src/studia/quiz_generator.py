@@ -1,26 +1,34 @@
 """
 Quiz Generator - Extract text from images and generate MCQ quizzes with SELF-REFINING
 """
-import os
 import re
 import json
-from dotenv import load_dotenv
-from openai import OpenAI
-
-load_dotenv()
-
-# OpenAI Client
-api_key = os.getenv("OPENAI_API_KEY")
-client = OpenAI(api_key=api_key)
+import math
+import asyncio
+import logging
+from typing import AsyncIterator, Callable, Dict, List, Optional, Sequence, Union
+from .llm import chat_completion, stream_completion
+from .observability import log_event, traced_pipeline
+from .cache import make_key
+from .image_cache import ocr_cache, image_key
+from .image_preprocess import PreparedImage, prepare_image
+from .quiz_prevalidator import prevalidate_quiz
+from .retrieval import select_context
+from .uploads import UploadedPage
+from .settings import (
+    OCR_CONCURRENCY, OCR_BATCH_ENABLED, OCR_BATCH_MAX_PAGES, OCR_BATCH_MAX_IMAGE_TOKENS,
+    LOCAL_VALIDATION_THRESHOLD, ITEM_CONTEXT_TOKENS,
+)
+
+
+def _image_part(prepared: PreparedImage) -> dict:
+    return {
+        "type": "image_url",
+        "image_url": {"url": f"data:{prepared.mime_type};base64,{prepared.base64}", "detail": prepared.detail},
+    }
 
 
-def extract_text(image_base64: str) -> str:
-    """
-    Extract text using GPT-4 Vision with STRUCTURAL formatting.
-    """
-    prompt = """Extract ALL the text from this image.
-
-    CRITICAL FORMATTING RULES:
+EXTRACTION_RULES = """CRITICAL FORMATTING RULES:
     1. Organize the content using Markdown Headers (# for Main Title, ## for Sections, ### for Sub-sections).
     2. Use bullet points (-) for lists.
     3. Use bold (**text**) for key concepts.
@@ -28,26 +36,203 @@ def extract_text(image_base64: str) -> str:
     5. Do not summarize, keep the full content but STRUCTURE IT clearly for reading.
     """
 
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
+PAGE_DELIMITER = re.compile(r"^\s*=+\s*PAGE\s+(\d+)\s*=+\s*$", re.MULTILINE | re.IGNORECASE)
+
+
+async def _extract_prepared(prepared: PreparedImage) -> str:
+    prompt = f"""Extract ALL the text from this image.
+
+    {EXTRACTION_RULES}"""
+
+    return await chat_completion(
+        stage="extract",
         messages=[
             {
                 "role": "user",
                 "content": [
                     {"type": "text", "text": prompt},
-                    {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{image_base64}"}},
+                    _image_part(prepared),
                 ],
             }
         ],
+        cache=False,
     )
-    return response.choices[0].message.content
 
-def verify_and_refine_extraction(image_base64: str, extracted_text: str) -> dict:
+
+async def _extract_pack(pack: List[PreparedImage]) -> List[Optional[str]]:
+    """
+    Extract several pages in one vision call. Each image is announced by a
+    "=== PAGE n ===" marker and the answer is split back on the same markers.
+    Pages missing from the answer come back as None.
+    """
+    if len(pack) == 1:
+        return [await _extract_prepared(pack[0])]
+
+    content = [{"type": "text", "text": f"""Extract ALL the text from each of the {len(pack)} images below, one page per image.
+
+    Start the text of each page with a line containing only its marker, exactly: === PAGE n === (n from 1 to {len(pack)}).
+    Never merge two pages and never skip a page (write the marker followed by nothing for a blank page).
+
+    {EXTRACTION_RULES}"""}]
+    for n, prepared in enumerate(pack, 1):
+        content.append({"type": "text", "text": f"=== PAGE {n} ==="})
+        content.append(_image_part(prepared))
+
+    response = await chat_completion(messages=[{"role": "user", "content": content}], cache=False, stage="extract")
+
+    texts: List[Optional[str]] = [None] * len(pack)
+    parts = PAGE_DELIMITER.split(response or "")
+    for number, text in zip(parts[1::2], parts[2::2]):
+        n = int(number)
+        if 1 <= n <= len(pack) and texts[n - 1] is None:
+            texts[n - 1] = text.strip()
+    return texts
+
+
+def plan_packs(tokens: List[int], concurrency: int = OCR_CONCURRENCY) -> List[List[int]]:
+    """
+    Group pages (by index) into vision calls. A pack is limited by the page
+    count that keeps every concurrent slot busy, by OCR_BATCH_MAX_PAGES and by
+    OCR_BATCH_MAX_IMAGE_TOKENS (dense, high-detail pages pack less).
+    """
+    if not tokens:
+        return []
+    max_pages = max(1, min(OCR_BATCH_MAX_PAGES, math.ceil(len(tokens) / max(1, concurrency))))
+    packs, current, used = [], [], 0
+    for index, cost in enumerate(tokens):
+        if current and (len(current) >= max_pages or used + cost > OCR_BATCH_MAX_IMAGE_TOKENS):
+            packs.append(current)
+            current, used = [], 0
+        current.append(index)
+        used += cost
+    packs.append(current)
+    return packs
+
+
+async def extract_text(image_base64: str, info: Optional[dict] = None) -> str:
+    """
+    Extract text using GPT-4 Vision with STRUCTURAL formatting.
+    Pages already seen (same bytes or a re-encoded copy) are served from the OCR cache.
+    The photo is preprocessed first; if `info` is given, it receives the preprocessing stats.
+    """
+    key = await image_key(image_base64)
+    cache_key = make_key("extract", key)
+    cached = await ocr_cache.get(cache_key)
+    if cached is not None:
+        log_event("extraction_cache_hit")
+        return cached
+
+    prepared = await prepare_image(image_base64, key)
+    if info is not None:
+        info["preprocessing"] = prepared.stats()
+
+    text = await _extract_prepared(prepared)
+    if text:
+        await ocr_cache.set(cache_key, text)
+    return text
+
+async def extract_text_from_pages(
+        images: Sequence[Union[str, UploadedPage]],
+        concurrency: int = OCR_CONCURRENCY,
+        batch: bool = OCR_BATCH_ENABLED
+) -> List[dict]:
+    """
+    Extract several pages concurrently (at most `concurrency` vision calls at once).
+
+    Pages are base64 strings or uploaded files; a file is only encoded once its
+    extraction starts, so at most `concurrency` encoded pages are in memory.
+
+    With `batch`, pages not in the cache are first preprocessed, then packed
+    several per vision call (see plan_packs); a page the model skipped is
+    extracted again on its own.
+
+    Returns one entry per page, in page order. A failing page gets an "error"
+    field instead of failing the whole batch.
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    def page_entry(index: int, text: str, **extra) -> dict:
+        return {"pageNumber": index + 1, "text": text, "wordCount": len(text.split()), **extra}
+
+    def error_entry(index: int, e: Exception) -> dict:
+        log_event("page_extraction_failed", logging.ERROR, page=index + 1, error=str(e))
+        return {"pageNumber": index + 1, "text": "", "wordCount": 0, "error": str(e)}
+
+    async def load(image: Union[str, UploadedPage]) -> str:
+        return image if isinstance(image, str) else await asyncio.to_thread(image.read_base64)
+
+    async def extract_page(index: int, image: Union[str, UploadedPage]) -> dict:
+        async with semaphore:
+            try:
+                info = {}
+                text = await extract_text(await load(image), info)
+                return page_entry(index, text, **info)
+            except Exception as e:
+                return error_entry(index, e)
+
+    if not batch or len(images) < 2:
+        return list(await asyncio.gather(*(extract_page(i, img) for i, img in enumerate(images))))
+
+    # 1. Cache + prétraitement : on ne garde en mémoire que les versions réduites
+    results: List[Optional[dict]] = [None] * len(images)
+    pending = []  # (index, cache_key, prepared)
+
+    async def prepare_page(index: int, image: Union[str, UploadedPage]):
+        async with semaphore:
+            try:
+                image_base64 = await load(image)
+                key = await image_key(image_base64)
+                cache_key = make_key("extract", key)
+                cached = await ocr_cache.get(cache_key)
+                if cached is not None:
+                    results[index] = page_entry(index, cached)
+                    return
+                pending.append((index, cache_key, await prepare_image(image_base64, key)))
+            except Exception as e:
+                results[index] = error_entry(index, e)
+
+    await asyncio.gather(*(prepare_page(i, img) for i, img in enumerate(images)))
+    pending.sort(key=lambda item: item[0])
+
+    # 2. Regroupement des pages restantes en appels vision
+    async def run_pack(pack: List[tuple]):
+        async with semaphore:
+            try:
+                texts = await _extract_pack([prepared for _, _, prepared in pack])
+            except Exception as e:
+                texts = [None] * len(pack)
+                log_event("batched_extraction_failed", logging.WARNING, pages=len(pack), error=str(e))
+        for (index, cache_key, prepared), text in zip(pack, texts):
+            try:
+                if text is None:
+                    async with semaphore:
+                        text = await _extract_prepared(prepared)
+                if text:
+                    await ocr_cache.set(cache_key, text)
+                results[index] = page_entry(index, text or "", preprocessing=prepared.stats(), batchSize=len(pack))
+            except Exception as e:
+                results[index] = error_entry(index, e)
+
+    packs = plan_packs([prepared.tokens_after for _, _, prepared in pending], concurrency)
+    if pending:
+        log_event("pages_packed", pages=len(pending), calls=len(packs))
+    await asyncio.gather(*(run_pack([pending[i] for i in pack]) for pack in packs))
+    return results
+
+
+async def verify_and_refine_extraction(image_base64: str, extracted_text: str) -> dict:
     """
     🔄 STEP 2: Verify extraction accuracy and refine if needed
     """
 
-    print("🔍 Verifying text extraction accuracy...")
+    key = await image_key(image_base64)
+    cache_key = make_key("verify", key, extracted_text)
+    cached = await ocr_cache.get(cache_key)
+    if cached is not None:
+        log_event("verification_cache_hit")
+        return json.loads(cached)
+
+    prepared = await prepare_image(image_base64, key)
 
     verification_prompt = f"""You are a text extraction quality validator. Return your analysis in JSON format.
 
@@ -81,8 +266,8 @@ Return ONLY valid JSON:
 If confidence_score < 85%, set needs_refinement = true
 Return ONLY valid JSON, nothing else."""
 
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
+    content = await chat_completion(
+        stage="verify",
         response_format={"type": "json_object"},
         messages=[
             {
@@ -92,25 +277,23 @@ Return ONLY valid JSON, nothing else."""
                         "type": "text",
                         "text": verification_prompt
                     },
-                    {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:image/jpeg;base64,{image_base64}"
-                        },
-                    },
+                    _image_part(prepared),
                 ],
             }
         ],
+        cache=False,
     )
 
-    verification = json.loads(response.choices[0].message.content)
-    print(f"   Confidence: {verification.get('confidence_score', 0)}%")
-    print(f"   Issues found: {len(verification.get('issues', []))}")
+    verification = json.loads(content)
+    log_event(
+        "extraction_verified",
+        confidence=verification.get('confidence_score', 0),
+        issues=len(verification.get('issues', [])),
+        needs_refinement=bool(verification.get('needs_refinement', False)),
+    )
 
     # If needs refinement, do a second extraction with more focus
     if verification.get('needs_refinement', False):
-        print("🔧 Refining text extraction...")
-
         issues_description = "\n".join([
             f"- {issue['description']}" for issue in verification.get('issues', [])
         ])
@@ -131,8 +314,8 @@ Now extract the text again, fixing these issues:
 
 Return ONLY the corrected extracted text, nothing else."""
 
-        refine_response = client.chat.completions.create(
-            model="gpt-4o-mini",
+        refined_text = await chat_completion(
+            stage="verify",
             messages=[
                 {
                     "role": "user",
@@ -141,19 +324,14 @@ Return ONLY the corrected extracted text, nothing else."""
                             "type": "text",
                             "text": refine_prompt
                         },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{image_base64}"
-                            },
-                        },
+                        _image_part(prepared),
                     ],
                 }
             ],
+            cache=False,
         )
 
-        refined_text = refine_response.choices[0].message.content
-        print(f"✅ Text refined: {len(refined_text)} characters")
+        log_event("extraction_refined", characters=len(refined_text))
 
         verification['refined_text'] = refined_text
         verification['was_refined'] = True
@@ -161,10 +339,11 @@ Return ONLY the corrected extracted text, nothing else."""
         verification['refined_text'] = extracted_text
         verification['was_refined'] = False
 
+    await ocr_cache.set(cache_key, json.dumps(verification, ensure_ascii=False))
     return verification
 
 
-def validate_quiz_quality(course_text: str, quiz_data: dict) -> dict:
+async def validate_quiz_quality(course_text: str, quiz_data: dict) -> dict:
     """
     🔄 STEP 3: Validate quiz quality and accuracy
     """
@@ -206,8 +385,8 @@ CRITICAL RULES:
 - accuracy_score = percentage of questions that are perfectly accurate
 - Return ONLY valid JSON"""
 
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
+    content = await chat_completion(
+        stage="validate",
         response_format={"type": "json_object"},
         messages=[
             {
@@ -217,24 +396,46 @@ CRITICAL RULES:
         ],
     )
 
-    validation_result = json.loads(response.choices[0].message.content)
+    validation_result = json.loads(content)
 
-    print(f"🔍 Quiz Validation Score: {validation_result.get('accuracy_score', 0)}%")
-    print(f"   Issues found: {len(validation_result.get('issues', []))}")
+    log_event(
+        "quiz_validated",
+        path="llm",
+        score=validation_result.get('accuracy_score', 0),
+        issues=len(validation_result.get('issues', [])),
+    )
 
     return validation_result
 
 
-def refine_quiz(course_text: str, quiz_data: dict, validation_result: dict) -> dict:
+async def validate_quiz(course_text: str, quiz_data: dict, num_questions: Optional[int] = None) -> dict:
     """
-    🔧 STEP 4: Fix issues found in quiz validation
+    Local pre-validation first (microseconds); the LLM validator only runs when
+    the local score is below LOCAL_VALIDATION_THRESHOLD.
+    The result carries "validation_path": "local" or "llm".
     """
+    local = prevalidate_quiz(course_text, quiz_data, num_questions)
+    if local["is_valid"] and local["accuracy_score"] >= LOCAL_VALIDATION_THRESHOLD:
+        log_event("quiz_validated", path="local", score=local["accuracy_score"], issues=len(local.get("issues", [])))
+        return {**local, "validation_path": "local", "local_score": local["accuracy_score"]}
 
-    if validation_result.get('is_valid', False) and validation_result.get('accuracy_score', 0) >= 90:
-        print("✅ Quiz quality is excellent, no refinement needed")
-        return quiz_data
+    validation_result = await validate_quiz_quality(course_text, quiz_data)
+
+    # Les problèmes structurels détectés localement sont transmis au raffinement
+    local_high = [issue for issue in local["issues"] if issue["severity"] == "high"]
+    if local_high:
+        validation_result["is_valid"] = False
+        validation_result["issues"] = validation_result.get("issues", []) + local_high
+
+    validation_result["validation_path"] = "llm"
+    validation_result["local_score"] = local["accuracy_score"]
+    return validation_result
 
-    print("🔧 Refining quiz based on validation feedback...")
+
+async def _refine_whole_quiz(course_text: str, quiz_data: dict, validation_result: dict) -> dict:
+    """
+    Rewrite the whole quiz (used when issues are not tied to a question index).
+    """
 
     refine_prompt = f"""You are a quiz refinement expert. FIX the issues in this quiz and return valid JSON.
 
@@ -268,8 +469,82 @@ Return ONLY the CORRECTED quiz in this EXACT JSON format:
 
 CRITICAL: Base EVERYTHING on the course text. NO external information. Return ONLY valid JSON."""
 
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
+    content = await chat_completion(
+        stage="refine",
+        response_format={"type": "json_object"},
+        messages=[
+            {
+                "role": "user",
+                "content": refine_prompt
+            }
+        ],
+    )
+
+    return json.loads(content)
+
+
+
+def _issues_by_index(issues: list, key: str, count: int) -> dict:
+    grouped = {}
+    for issue in issues:
+        index = issue.get(key)
+        if isinstance(index, int) and not isinstance(index, bool) and 0 <= index < count:
+            grouped.setdefault(index, []).append(issue)
+    return grouped
+
+
+def _question_problem(question: dict) -> Optional[str]:
+    """Structural defect of a generated MCQ (None when it is well-formed)."""
+    if not isinstance(question, dict) or not isinstance(question.get("question"), str) or not question["question"].strip():
+        return "missing 'question' field"
+    options = question.get("options")
+    if not isinstance(options, list) or len(options) != 4:
+        return "must have exactly 4 options"
+    if "correctAnswer" not in question:
+        return "missing 'correctAnswer' field"
+    answer = question["correctAnswer"]
+    if not isinstance(answer, int) or isinstance(answer, bool) or not 0 <= answer <= 3:
+        return "correctAnswer must be 0-3"
+    return None
+
+
+async def refine_question(course_text: str, question: dict, issues: list) -> dict:
+    """
+    Fix ONE question flagged by validation (only the relevant course sections are sent).
+    """
+    query = " ".join([str(question.get("question", "")), *map(str, question.get("options", [])), str(question.get("explanation", ""))])
+    context = await select_context(course_text, query, ITEM_CONTEXT_TOKENS)
+
+    refine_prompt = f"""You are a quiz refinement expert. FIX the issues in this ONE quiz question and return valid JSON.
+
+ORIGINAL COURSE TEXT:
+{context}
+
+CURRENT QUESTION (with issues):
+{json.dumps(question, indent=2, ensure_ascii=False)}
+
+VALIDATION ISSUES:
+{json.dumps(issues, indent=2, ensure_ascii=False)}
+
+YOUR TASK:
+1. Fix EVERY issue mentioned
+2. The question must be based ONLY on the course text
+3. Verify the correct answer is accurate
+4. The explanation must reference the course
+5. Incorrect options must be plausible but definitely wrong
+
+Return ONLY the CORRECTED question in this EXACT JSON format:
+{{
+  "question": "...",
+  "options": ["...", "...", "...", "..."],
+  "correctAnswer": 0,
+  "explanation": "..."
+}}
+
+CRITICAL: Base EVERYTHING on the course text. NO external information. Return ONLY valid JSON."""
+
+    content = await chat_completion(
+        stage="refine",
         response_format={"type": "json_object"},
         messages=[
             {
@@ -279,26 +554,106 @@ CRITICAL: Base EVERYTHING on the course text. NO external information. Return ON
         ],
     )
 
-    refined_quiz = json.loads(response.choices[0].message.content)
-    print("✅ Quiz refined successfully")
+    refined = json.loads(content)
+    if "question" in refined and isinstance(refined["question"], dict):
+        refined = refined["question"]
+    problem = _question_problem(refined)
+    if problem:
+        raise ValueError(f"Invalid refined question format: {problem}")
+    refined.setdefault("explanation", "")
+    return refined
 
-    return refined_quiz
+
+async def refine_quiz(course_text: str, quiz_data: dict, validation_result: dict) -> dict:
+    """
+    🔧 STEP 4: Fix issues found in quiz validation
+
+    Only the questions listed in issues (question_index) are regenerated, concurrently,
+    and spliced back in place. The result carries "refined_indices" (None when the
+    whole quiz had to be rewritten because no issue pointed at a question) and
+    "failed" ({index: issues} of the flagged questions whose fix raised).
+    """
+
+    if validation_result.get('is_valid', False) and validation_result.get('accuracy_score', 0) >= 90:
+        return {**quiz_data, "refined_indices": [], "failed": {}}
+
+    questions = quiz_data.get("questions", [])
+    flagged = _issues_by_index(validation_result.get('issues', []), "question_index", len(questions))
+
+    if not flagged:
+        refined_quiz = await _refine_whole_quiz(course_text, quiz_data, validation_result)
+        log_event("quiz_refined", scope="whole", questions=len(refined_quiz.get("questions", [])))
+        return {**refined_quiz, "refined_indices": None, "failed": {}}
+
+    indices = sorted(flagged)
+    results = await asyncio.gather(
+        *(refine_question(course_text, questions[i], flagged[i]) for i in indices),
+        return_exceptions=True
+    )
+
+    refined_questions = list(questions)
+    refined_indices, failed = [], {}
+    for i, result in zip(indices, results):
+        if isinstance(result, Exception):
+            log_event("question_refine_failed", logging.WARNING, question=i + 1, error=str(result))
+            failed[i] = flagged[i]
+            continue
+        refined_questions[i] = result
+        refined_indices.append(i)
+
+    log_event(
+        "quiz_refined", scope="questions", flagged=len(flagged), replaced=len(refined_indices), failed=len(failed)
+    )
+    return {**quiz_data, "questions": refined_questions, "refined_indices": refined_indices, "failed": failed}
 
 
-def generate_quiz_mcq(
+async def revalidate_quiz(
         course_text: str,
-        num_questions: int,
-        difficulty: str
+        quiz_data: dict,
+        refined_indices: Optional[List[int]],
+        failed: Optional[Dict[int, list]] = None
 ) -> dict:
-    """Generate MCQ quiz from course text"""
+    """
+    Re-validate only the refined questions. Untouched questions were not flagged
+    and count as accurate; questions whose fix failed (`failed`, from refine_quiz)
+    keep their issues and count as inaccurate. The score is for the whole quiz.
+    """
+    questions = quiz_data.get("questions", [])
+    failed = failed or {}
+    if refined_indices is None:
+        return await validate_quiz(course_text, quiz_data, len(questions))
+    if not questions or (not refined_indices and not failed):
+        return {"is_valid": True, "accuracy_score": 100, "issues": [], "validation_path": "skipped"}
+
+    if refined_indices:
+        subset = {"questions": [questions[i] for i in refined_indices]}
+        result = await validate_quiz(course_text, subset)
+        for issue in result.get("issues", []):
+            index = issue.get("question_index")
+            if isinstance(index, int) and 0 <= index < len(refined_indices):
+                issue["question_index"] = refined_indices[index]
+    else:
+        result = {"is_valid": True, "accuracy_score": 0, "issues": [], "validation_path": "skipped"}
 
+    total, changed = len(questions), len(refined_indices)
+    untouched = total - changed - len(failed)
+    result["accuracy_score"] = round((untouched * 100 + changed * result.get("accuracy_score", 0)) / total)
+    if failed:
+        result["is_valid"] = False
+        result["issues"] = result.get("issues", []) + [issue for i in sorted(failed) for issue in failed[i]]
+        result["failed_indices"] = sorted(failed)
+    result["revalidated_indices"] = refined_indices
+    return result
+
+
+def _build_quiz_prompt(course_text: str, num_questions: int, difficulty: str) -> str:
     difficulty_instructions = {
         "easy": "Les questions doivent être simples et directes, adaptées aux débutants.",
         "medium": "Les questions doivent être de difficulté moyenne, nécessitant une bonne compréhension du cours.",
         "hard": "Les questions doivent être difficiles et exiger une connaissance approfondie du cours."
     }
 
-    prompt = f"""Tu es un assistant qui répond toujours et juste en JSON. Pas de texte parasite, que du JSON.
+    return f"""Tu es un assistant qui répond toujours et juste en JSON. Pas de texte parasite, que du JSON.
 
 Crée un quiz de {num_questions} questions à choix multiples (QCM) basé UNIQUEMENT sur ce cours.
 
@@ -337,40 +692,48 @@ RÈGLES CRITIQUES:
 - Pas de texte avant ou après le JSON, UNIQUEMENT le JSON
 """
 
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
+
+async def generate_quiz_mcq(
+        course_text: str,
+        num_questions: int,
+        difficulty: str,
+        fresh: bool = False
+) -> dict:
+    """Generate MCQ quiz from course text (fresh=True bypasses the response cache)"""
+
+    content = await chat_completion(
+        stage="generate",
         response_format={"type": "json_object"},
         messages=[
             {
                 "role": "user",
-                "content": prompt
+                "content": _build_quiz_prompt(course_text, num_questions, difficulty)
             }
         ],
+        fresh=fresh,
     )
 
-    quiz_data = json.loads(response.choices[0].message.content)
-    print("✅ Initial quiz generated")
+    return json.loads(content)
 
-    return quiz_data
 
-
-def quiz_generator_from_image(
+@traced_pipeline("quiz_from_image")
+async def quiz_generator_from_image(
         image_base64: str,
         num_questions: int = 5,
         difficulty: str = "medium",
-        enable_refinement: bool = True
+        enable_refinement: bool = True,
+        fresh: bool = False,
+        on_stage: Optional[Callable[[str], None]] = None
 ) -> dict:
     """
     Generate quiz from course image with COMPLETE SELF-REFINING
+    on_stage is called with extract / verify / generate / validate / refine as the pipeline advances.
     """
 
-    print(f"📸 Quiz generation started (Self-Refining: {'ON' if enable_refinement else 'OFF'})")
-    print(f"   Parameters: {num_questions} questions, difficulty: {difficulty}")
-
     try:
         # 🔄 STEP 1: Extract text from image
-        print("\n1️⃣ Extracting text from image...")
-        course_text = extract_text(image_base64)
+        if on_stage: on_stage("extract")
+        course_text = await extract_text(image_base64)
 
         if not course_text or len(course_text.strip()) < 10:
             raise ValueError("Failed to extract text from image or text too short")
@@ -383,12 +746,11 @@ def quiz_generator_from_image(
 
         # 🔄 STEP 2: Verify and refine extraction (if enabled)
         if enable_refinement:
-            print("\n2️⃣ Verifying text extraction...")
-            verification = verify_and_refine_extraction(image_base64, course_text)
+            if on_stage: on_stage("verify")
+            verification = await verify_and_refine_extraction(image_base64, course_text)
 
             if verification.get('was_refined', False):
                 course_text = verification['refined_text']
-                print(f"   ✅ Text was refined (confidence: {verification.get('confidence_score', 0)}%)")
 
             extraction_metadata = {
                 "initial_length": extraction_metadata["initial_length"],
@@ -399,8 +761,8 @@ def quiz_generator_from_image(
             }
 
         # 🔄 STEP 3: Generate quiz
-        print(f"\n3️⃣ Generating quiz ({num_questions} questions, {difficulty})...")
-        quiz_data = generate_quiz_mcq(course_text, num_questions, difficulty)
+        if on_stage: on_stage("generate")
+        quiz_data = await generate_quiz_mcq(course_text, num_questions, difficulty, fresh)
 
         # Validate structure
         if "questions" not in quiz_data:
@@ -408,14 +770,9 @@ def quiz_generator_from_image(
 
         # Validate each question
         for i, q in enumerate(quiz_data["questions"]):
-            if "question" not in q:
-                raise ValueError(f"Question {i + 1}: missing 'question' field")
-            if "options" not in q or len(q["options"]) != 4:
-                raise ValueError(f"Question {i + 1}: must have exactly 4 options")
-            if "correctAnswer" not in q:
-                raise ValueError(f"Question {i + 1}: missing 'correctAnswer' field")
-            if not (0 <= q["correctAnswer"] <= 3):
-                raise ValueError(f"Question {i + 1}: correctAnswer must be 0-3")
+            problem = _question_problem(q)
+            if problem:
+                raise ValueError(f"Question {i + 1}: {problem}")
             if "explanation" not in q:
                 q["explanation"] = ""
 
@@ -427,28 +784,30 @@ def quiz_generator_from_image(
         }
 
         if enable_refinement:
-            print("\n4️⃣ Validating quiz quality...")
-            validation_result = validate_quiz_quality(course_text, quiz_data)
+            if on_stage: on_stage("validate")
+            validation_result = await validate_quiz(course_text, quiz_data, num_questions)
 
             quiz_metadata["initial_score"] = validation_result.get('accuracy_score', 0)
+            quiz_metadata["validation_path"] = validation_result["validation_path"]
 
             # If validation fails or score is low, refine
             if not validation_result.get('is_valid', False) or validation_result.get('accuracy_score', 0) < 90:
-                print("\n5️⃣ Refining quiz...")
-                quiz_data = refine_quiz(course_text, quiz_data, validation_result)
+                if on_stage: on_stage("refine")
+                quiz_data = await refine_quiz(course_text, quiz_data, validation_result)
+                refined_indices = quiz_data.pop("refined_indices", None)
+                failed = quiz_data.pop("failed", {})
 
-                # Re-validate after refinement
-                print("\n6️⃣ Re-validating refined quiz...")
-                final_validation = validate_quiz_quality(course_text, quiz_data)
+                # Re-validate after refinement (only the replaced questions)
+                final_validation = await revalidate_quiz(course_text, quiz_data, refined_indices, failed)
+                quiz_metadata["refined_questions"] = refined_indices
+                quiz_metadata["unrefined_questions"] = sorted(failed)
 
                 quiz_metadata["final_score"] = final_validation.get('accuracy_score', 0)
+                quiz_metadata["final_validation_path"] = final_validation["validation_path"]
                 quiz_metadata["was_refined"] = True
-
-                print(f"   ✅ Quiz refined (score: {quiz_metadata['initial_score']}% → {quiz_metadata['final_score']}%)")
             else:
                 quiz_metadata["final_score"] = validation_result.get('accuracy_score', 0)
                 quiz_metadata["was_refined"] = False
-                print(f"   ✅ Quiz quality is good ({quiz_metadata['final_score']}%)")
 
         # ✨ Add metadata to result
         quiz_data["extractedText"] = course_text
@@ -458,40 +817,48 @@ def quiz_generator_from_image(
             "self_refining_enabled": enable_refinement
         }
 
-        print(f"\n✅ FINAL RESULT:")
-        print(f"   Questions: {len(quiz_data['questions'])}")
-        print(f"   Text length: {len(course_text)} characters")
-        if enable_refinement:
-            print(f"   Text confidence: {extraction_metadata.get('confidence_score', 'N/A')}%")
-            print(f"   Quiz quality: {quiz_metadata.get('final_score', 'N/A')}%")
-            print(f"   Refinements: Text={extraction_metadata.get('was_refined', False)}, Quiz={quiz_metadata.get('was_refined', False)}")
+        log_event(
+            "quiz_generated",
+            source="image",
+            questions=len(quiz_data['questions']),
+            difficulty=difficulty,
+            text_length=len(course_text),
+            refinement=enable_refinement,
+            text_confidence=extraction_metadata.get('confidence_score'),
+            text_refined=extraction_metadata.get('was_refined', False),
+            initial_score=quiz_metadata.get('initial_score'),
+            final_score=quiz_metadata.get('final_score'),
+            quiz_refined=quiz_metadata.get('was_refined', False),
+        )
 
         return quiz_data
 
     except json.JSONDecodeError as e:
-        print(f"❌ JSON Parse Error: {e}")
+        log_event("quiz_generation_failed", logging.ERROR, source="image", error=f"JSON parse error: {e}")
         raise Exception(f"Failed to parse quiz JSON: {str(e)}")
     except Exception as e:
-        print(f"❌ Error: {str(e)}")
+        log_event("quiz_generation_failed", logging.ERROR, source="image", error=str(e))
         raise
 
 
-def quiz_generator_from_text(
+@traced_pipeline("quiz_from_text")
+async def quiz_generator_from_text(
         course_text: str,
         num_questions: int = 5,
         difficulty: str = "medium",
-        enable_refinement: bool = True
+        enable_refinement: bool = True,
+        fresh: bool = False,
+        on_stage: Optional[Callable[[str], None]] = None
 ) -> dict:
     """
     Generate quiz from course text with SELF-REFINING
+    on_stage is called with generate / validate / refine as the pipeline advances.
     """
 
-    print(f"📝 Quiz generation from text (Self-Refining: {'ON' if enable_refinement else 'OFF'})")
-
     try:
         # Generate quiz
-        print("1️⃣ Generating quiz...")
-        quiz_data = generate_quiz_mcq(course_text, num_questions, difficulty)
+        if on_stage: on_stage("generate")
+        quiz_data = await generate_quiz_mcq(course_text, num_questions, difficulty, fresh)
 
         # Validate structure
         if "questions" not in quiz_data:
@@ -505,32 +872,242 @@ def quiz_generator_from_text(
 
         # Validate and refine (if enabled)
         if enable_refinement:
-            print("2️⃣ Validating quiz quality...")
-            validation_result = validate_quiz_quality(course_text, quiz_data)
+            if on_stage: on_stage("validate")
+            validation_result = await validate_quiz(course_text, quiz_data, num_questions)
 
             quiz_metadata["initial_score"] = validation_result.get('accuracy_score', 0)
+            quiz_metadata["validation_path"] = validation_result["validation_path"]
 
             if not validation_result.get('is_valid', False) or validation_result.get('accuracy_score', 0) < 90:
-                print("3️⃣ Refining quiz...")
-                quiz_data = refine_quiz(course_text, quiz_data, validation_result)
-
-                final_validation = validate_quiz_quality(course_text, quiz_data)
+                if on_stage: on_stage("refine")
+                quiz_data = await refine_quiz(course_text, quiz_data, validation_result)
+                refined_indices = quiz_data.pop("refined_indices", None)
+                failed = quiz_data.pop("failed", {})
+
+                final_validation = await revalidate_quiz(course_text, quiz_data, refined_indices, failed)
+                quiz_metadata["refined_questions"] = refined_indices
+                quiz_metadata["unrefined_questions"] = sorted(failed)
                 quiz_metadata["final_score"] = final_validation.get('accuracy_score', 0)
+                quiz_metadata["final_validation_path"] = final_validation["validation_path"]
                 quiz_metadata["was_refined"] = True
             else:
+                final_validation = validation_result
                 quiz_metadata["final_score"] = validation_result.get('accuracy_score', 0)
+            # Issues restantes après raffinement (la banque de questions n'accepte que des questions sans issue)
+            quiz_metadata["final_valid"] = bool(final_validation.get('is_valid', False))
+            quiz_metadata["final_issues"] = final_validation.get('issues', [])
 
         quiz_data["metadata"] = {
             "quiz_quality": quiz_metadata,
             "self_refining_enabled": enable_refinement
         }
 
-        print(f"✅ Quiz generated: {len(quiz_data['questions'])} questions")
-        if enable_refinement:
-            print(f"   Quality score: {quiz_metadata.get('final_score', 'N/A')}%")
+        log_event(
+            "quiz_generated",
+            source="text",
+            questions=len(quiz_data['questions']),
+            difficulty=difficulty,
+            refinement=enable_refinement,
+            initial_score=quiz_metadata.get('initial_score'),
+            final_score=quiz_metadata.get('final_score'),
+            quiz_refined=quiz_metadata.get('was_refined', False),
+        )
 
         return quiz_data
 
     except Exception as e:
-        print(f"❌ Error: {str(e)}")
-        raise
\ No newline at end of file
+        log_event("quiz_generation_failed", logging.ERROR, source="text", error=str(e))
+        raise
+
+
+class QuestionStreamParser:
+    """
+    Incrementally pull complete question objects out of a streamed
+    {"questions": [{...}, {...}]} JSON document.
+    """
+
+    def __init__(self, key: str = "questions"):
+        self._array_start = re.compile(r'"%s"\s*:\s*\[' % re.escape(key))
+        self._buffer = ""
+        self._pos = None  # position de scan, None tant que le tableau n'est pas ouvert
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._obj_start = None
+        self._closed = False
+
+    def feed(self, chunk: str) -> List[dict]:
+        self._buffer += chunk
+        found = []
+
+        if self._closed:
+            return found
+        if self._pos is None:
+            match = self._array_start.search(self._buffer)
+            if not match:
+                return found
+            self._pos = match.end()
+
+        buf = self._buffer
+        i = self._pos
+        while i < len(buf):
+            ch = buf[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch == "{":
+                if self._depth == 0:
+                    self._obj_start = i
+                self._depth += 1
+            elif ch == "}":
+                self._depth -= 1
+                if self._depth == 0 and self._obj_start is not None:
+                    try:
+                        found.append(json.loads(buf[self._obj_start:i + 1]))
+                    except json.JSONDecodeError:
+                        pass
+                    self._obj_start = None
+            elif ch == "]" and self._depth == 0:
+                self._closed = True
+                break
+            i += 1
+
+        self._pos = i
+        return found
+
+
+async def stream_quiz_from_text(
+        course_text: str,
+        num_questions: int = 5,
+        difficulty: str = "medium",
+        enable_refinement: bool = True,
+        fresh: bool = False
+) -> AsyncIterator[dict]:
+    """
+    Streaming variant of quiz_generator_from_text.
+
+    Yields {"event": ..., "data": ...} dicts:
+    - question: one question, as soon as it is parsed from the token stream
+      (malformed ones are skipped and counted in metadata "skipped_questions")
+    - validation: quality score and issues ("final": True after refinement)
+    - replaced: a question rewritten by the refinement step (malformed rewrites keep the original)
+    - done: the final quiz with its metadata
+    """
+
+    parser = QuestionStreamParser()
+    questions = []
+    skipped = 0
+
+    async for delta in stream_completion(
+            stage="generate",
+            messages=[{"role": "user", "content": _build_quiz_prompt(course_text, num_questions, difficulty)}],
+            response_format={"type": "json_object"},
+            fresh=fresh,
+    ):
+        for question in parser.feed(delta):
+            # Mêmes contrôles que le chemin non streamé : une question mal formée n'est jamais envoyée
+            problem = _question_problem(question)
+            if problem:
+                skipped += 1
+                log_event("streamed_question_skipped", logging.WARNING, problem=problem)
+                continue
+            question.setdefault("explanation", "")
+            yield {"event": "question", "data": {"index": len(questions), "question": question}}
+            questions.append(question)
+
+    if not questions:
+        raise ValueError("Invalid quiz format: no questions parsed")
+
+    quiz_data = {"questions": questions}
+    quiz_metadata = {
+        "was_refined": False,
+        "initial_score": 100,
+        "final_score": 100
+    }
+    if skipped:
+        quiz_metadata["skipped_questions"] = skipped
+
+    if enable_refinement:
+        validation_result = await validate_quiz(course_text, quiz_data, num_questions)
+        quiz_metadata["initial_score"] = validation_result.get('accuracy_score', 0)
+        quiz_metadata["final_score"] = quiz_metadata["initial_score"]
+        quiz_metadata["validation_path"] = validation_result["validation_path"]
+        yield {"event": "validation", "data": {
+            "accuracy_score": validation_result.get('accuracy_score', 0),
+            "is_valid": validation_result.get('is_valid', False),
+            "issues": validation_result.get('issues', []),
+            "validation_path": validation_result["validation_path"],
+            "final": False,
+        }}
+
+        if not validation_result.get('is_valid', False) or validation_result.get('accuracy_score', 0) < 90:
+            refined = await refine_quiz(course_text, quiz_data, validation_result)
+            refined_indices = refined.pop("refined_indices", None)
+            failed = refined.pop("failed", {})
+            rewritten = refined.get("questions", [])
+
+            # Mêmes contrôles qu'à la génération : une réécriture mal formée n'est jamais envoyée,
+            # la question d'origine est gardée (et reste signalée si elle avait été ciblée)
+            if refined_indices is None:
+                changed, refined_questions = list(enumerate(rewritten)), []
+            else:
+                changed, refined_questions = [(i, rewritten[i]) for i in refined_indices], list(questions)
+                flagged = _issues_by_index(validation_result.get('issues', []), "question_index", len(questions))
+            for i, question in changed:
+                problem = _question_problem(question)
+                if problem:
+                    log_event("refined_question_rejected", logging.WARNING, question=i + 1, problem=problem)
+                    if refined_indices is None:
+                        if i < len(questions):
+                            refined_questions.append(questions[i])
+                    else:
+                        refined_indices.remove(i)
+                        failed[i] = flagged.get(i, [])
+                    continue
+                question.setdefault("explanation", "")
+                index = len(refined_questions) if refined_indices is None else i
+                if index >= len(questions) or question != questions[index]:
+                    yield {"event": "replaced", "data": {"index": index, "question": question}}
+                if refined_indices is None:
+                    refined_questions.append(question)
+                else:
+                    refined_questions[i] = question
+
+            quiz_data = {"questions": refined_questions}
+            final_validation = await revalidate_quiz(course_text, quiz_data, refined_indices, failed)
+            quiz_metadata["refined_questions"] = refined_indices
+            quiz_metadata["unrefined_questions"] = sorted(failed)
+            quiz_metadata["final_score"] = final_validation.get('accuracy_score', 0)
+            quiz_metadata["final_validation_path"] = final_validation["validation_path"]
+            quiz_metadata["was_refined"] = True
+            yield {"event": "validation", "data": {
+                "accuracy_score": final_validation.get('accuracy_score', 0),
+                "is_valid": final_validation.get('is_valid', False),
+                "issues": final_validation.get('issues', []),
+                "validation_path": final_validation["validation_path"],
+                "final": True,
+            }}
+
+    quiz_data["metadata"] = {
+        "quiz_quality": quiz_metadata,
+        "self_refining_enabled": enable_refinement
+    }
+
+    log_event(
+        "quiz_generated",
+        source="stream",
+        questions=len(quiz_data['questions']),
+        difficulty=difficulty,
+        refinement=enable_refinement,
+        skipped=skipped,
+        initial_score=quiz_metadata.get('initial_score'),
+        final_score=quiz_metadata.get('final_score'),
+        quiz_refined=quiz_metadata.get('was_refined', False),
+    )
+    yield {"event": "done", "data": quiz_data}
@@ -0,0 +1,143 @@
+"""
+Quiz Pre-Validator - Fast local checks run before paying for an LLM validation round
+"""
+from collections import Counter
+from functools import lru_cache
+from typing import Optional, Set, Tuple
+
+from .retrieval import normalize, tokenize
+
+PREFIX_LEN = 6            # "stemming" minimal : pluriels, accords, conjugaisons
+ANSWER_MIN_COVERAGE = 0.5
+EXPLANATION_MIN_COVERAGE = 0.4
+
+
+@lru_cache(maxsize=32)
+def _course_index(course_text: str) -> Tuple[Set[str], Set[str], Set[Tuple[str, str]]]:
+    terms = tokenize(course_text)
+    return set(terms), {t[:PREFIX_LEN] for t in terms if len(t) >= PREFIX_LEN}, set(zip(terms, terms[1:]))
+
+
+def _coverage(text: str, course_text: str) -> Optional[float]:
+    """Share of the content terms of `text` found in the course (None if no content term)."""
+    terms = tokenize(text)
+    if not terms:
+        return None
+    unigrams, prefixes, _ = _course_index(course_text)
+    found = sum(1 for t in terms if t in unigrams or (len(t) >= PREFIX_LEN and t[:PREFIX_LEN] in prefixes))
+    return found / len(terms)
+
+
+def _bigram_overlap(text: str, course_text: str) -> float:
+    terms = tokenize(text)
+    pairs = list(zip(terms, terms[1:]))
+    if not pairs:
+        return 0.0
+    _, _, bigrams = _course_index(course_text)
+    return sum(1 for p in pairs if p in bigrams) / len(pairs)
+
+
+def _issue(index: Optional[int], severity: str, issue: str, suggestion: str) -> dict:
+    return {"question_index": index, "severity": severity, "issue": issue, "suggestion": suggestion}
+
+
+def prevalidate_quiz(course_text: str, quiz_data: dict, num_questions: Optional[int] = None) -> dict:
+    """
+    Deterministic quiz checks, in the same shape as validate_quiz_quality:
+    {"is_valid", "accuracy_score", "issues": [{"question_index", "severity", ...}]}
+
+    Checks structure, duplicate options / questions, answer-index spread and the
+    lexical grounding of each correct option and explanation in the course text.
+    """
+    questions = quiz_data.get("questions", []) if isinstance(quiz_data, dict) else []
+    issues = []
+    question_scores = []
+    seen_questions = {}
+
+    for i, q in enumerate(questions):
+        score = 100
+
+        # --- Structure ---
+        if not isinstance(q, dict) or not str(q.get("question", "")).strip():
+            issues.append(_issue(i, "high", "Missing question text", "Write the question"))
+            question_scores.append(0)
+            continue
+        options = q.get("options")
+        if not isinstance(options, list) or len(options) != 4 or not all(str(o).strip() for o in options):
+            issues.append(_issue(i, "high", "Question must have exactly 4 non-empty options", "Provide 4 options"))
+            question_scores.append(0)
+            continue
+        answer = q.get("correctAnswer")
+        if not isinstance(answer, int) or isinstance(answer, bool) or not 0 <= answer <= 3:
+            issues.append(_issue(i, "high", "correctAnswer must be an index between 0 and 3", "Fix correctAnswer"))
+            question_scores.append(0)
+            continue
+
+        # --- Doublons ---
+        normalized_options = [normalize(o).strip() for o in options]
+        if len(set(normalized_options)) < 4:
+            issues.append(_issue(i, "high", "Duplicate options", "Make the 4 options distinct"))
+            score = 0
+
+        key = " ".join(tokenize(q["question"]))
+        if key in seen_questions:
+            issues.append(_issue(i, "high", f"Duplicate of question {seen_questions[key]}", "Ask about another concept"))
+            score = 0
+        seen_questions.setdefault(key, i)
+
+        # --- Ancrage lexical dans le cours ---
+        answer_coverage = _coverage(options[answer], course_text)
+        if answer_coverage is None:
+            if normalize(options[answer]).strip() not in normalize(course_text):
+                issues.append(_issue(i, "medium", "Correct option not found in the course", "Quote the course"))
+                score = min(score, 50)
+        elif answer_coverage < ANSWER_MIN_COVERAGE:
+            issues.append(_issue(
+                i, "high", f"Correct option is weakly grounded in the course ({answer_coverage:.0%} of its terms)",
+                "Base the correct answer on the course text"
+            ))
+            score = 0
+
+        explanation = str(q.get("explanation", "") or "")
+        if explanation.strip():
+            explanation_coverage = _coverage(explanation, course_text) or 0.0
+            if explanation_coverage < EXPLANATION_MIN_COVERAGE and _bigram_overlap(explanation, course_text) < 0.2:
+                issues.append(_issue(
+                    i, "medium", f"Explanation is weakly grounded in the course ({explanation_coverage:.0%})",
+                    "Make the explanation cite the course"
+                ))
+                score = min(score, 50)
+        else:
+            issues.append(_issue(i, "low", "Missing explanation", "Add a short explanation citing the course"))
+            score = min(score, 80)
+
+        question_scores.append(score)
+
+    accuracy_score = round(sum(question_scores) / len(question_scores)) if question_scores else 0
+
+    # --- Contrôles globaux ---
+    if not questions:
+        issues.append(_issue(None, "high", "Quiz has no questions", "Generate the questions"))
+    elif num_questions and len(questions) != num_questions:
+        issues.append(_issue(None, "medium", f"Expected {num_questions} questions, got {len(questions)}", "Fix the count"))
+        accuracy_score = max(0, accuracy_score - 10)
+
+    # Seuls les index valides comptent (les autres ont déjà leur issue structurelle ; une liste n'est pas hachable)
+    answers = [
+        answer for answer in (q.get("correctAnswer") for q in questions if isinstance(q, dict))
+        if isinstance(answer, int) and not isinstance(answer, bool)
+    ]
+    if len(answers) >= 4:
+        index, count = Counter(answers).most_common(1)[0]
+        if count / len(answers) > 0.6:
+            issues.append(_issue(
+                None, "low", f"correctAnswer is {index} for {count}/{len(answers)} questions",
+                "Vary the position of the correct answer"
+            ))
+            accuracy_score = max(0, accuracy_score - 5)
+
+    return {
+        "is_valid": not any(issue["severity"] == "high" for issue in issues),
+        "accuracy_score": accuracy_score,
+        "issues": issues,
+    }
@@ -0,0 +1,268 @@
+"""
+Retrieval - Header-aware Markdown chunking and BM25 ranking over course text
+"""
+import asyncio
+import hashlib
+import math
+import re
+import time
+import unicodedata
+from collections import Counter, OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from pydantic import BaseModel
+
+from .settings import CHUNK_MAX_TOKENS, COURSE_INDEX_CACHE_SIZE, COURSE_INDEX_TTL
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+_HEADER = re.compile(r"^(#{1,6})\s+(.*\S)\s*$")
+_SENTENCE_END = re.compile(r"(?<=[.!?;:])\s+")
+
+# Mots vides FR + EN
+STOPWORDS = {
+    "le", "la", "les", "un", "une", "des", "du", "de", "d", "l", "et", "ou", "en", "au", "aux", "a",
+    "est", "sont", "ce", "cet", "cette", "ces", "qui", "que", "qu", "quoi", "dont", "par",
+    "pour", "sur", "dans", "avec", "sans", "plus", "moins", "ne", "pas", "se", "sa", "son", "ses",
+    "leur", "leurs", "il", "elle", "ils", "elles", "on", "nous", "vous", "y", "selon", "cours",
+    "comme", "mais", "donc", "car", "si", "tout", "tous", "toute", "toutes", "etre", "avoir",
+    "the", "an", "of", "and", "or", "to", "in", "on", "for", "with", "is", "are", "was",
+    "were", "be", "by", "as", "at", "it", "its", "this", "that", "these", "those", "from",
+    "not", "no", "which", "what", "course", "according",
+}
+
+
+def normalize(text: str) -> str:
+    """Lowercase and strip accents."""
+    text = unicodedata.normalize("NFKD", str(text).lower())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def tokenize(text: str) -> List[str]:
+    """Content terms of a text (accent-folded, without stopwords)."""
+    return [t for t in _WORD.findall(normalize(text)) if t not in STOPWORDS and (len(t) > 1 or t.isdigit())]
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough LLM token count (~4 characters per token)."""
+    return max(1, len(text) // 4)
+
+
+# --- CHUNKING ---
+
+class Chunk(BaseModel):
+    index: int
+    heading: str  # chemin des titres, ex. "Chapitre 1 > La photosynthèse"
+    text: str     # contenu Markdown (titre de section inclus)
+    tokens: int
+
+
+def _split_long(text: str, max_tokens: int) -> List[str]:
+    """Pack paragraphs (then sentences, then hard cuts) into pieces under max_tokens."""
+    max_chars = max_tokens * 4
+    units = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        if len(paragraph) <= max_chars:
+            units.append(paragraph)
+            continue
+        for sentence in _SENTENCE_END.split(paragraph):
+            units.extend(sentence[i:i + max_chars] for i in range(0, len(sentence), max_chars))
+
+    pieces, current = [], ""
+    for unit in units:
+        if not unit.strip():
+            continue
+        candidate = f"{current}\n\n{unit}" if current else unit
+        if len(candidate) > max_chars and current:
+            pieces.append(current)
+            current = unit
+        else:
+            current = candidate
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def chunk_markdown(text: str, max_tokens: int = CHUNK_MAX_TOKENS) -> List[Chunk]:
+    """
+    Split Markdown course text on #/##/### headers into chunks of at most
+    ~max_tokens. Long sections are split on paragraphs, then sentences.
+    """
+    sections = []  # (heading path, lines)
+    path: List[Tuple[int, str]] = []
+    lines: List[str] = []
+    in_code = False
+
+    def flush():
+        body = "\n".join(lines).strip()
+        if body and not all(_HEADER.match(l) for l in body.splitlines() if l.strip()):
+            sections.append((" > ".join(title for _, title in path), body))
+
+    for line in text.splitlines():
+        if line.strip().startswith("```"):
+            in_code = not in_code
+        header = None if in_code else _HEADER.match(line)
+        if header:
+            flush()
+            level = len(header.group(1))
+            path = [(lvl, title) for lvl, title in path if lvl < level] + [(level, header.group(2).strip("* "))]
+            lines = [line]
+        else:
+            lines.append(line)
+    flush()
+
+    chunks = []
+    for heading, body in sections:
+        pieces = [body] if estimate_tokens(body) <= max_tokens else _split_long(body, max_tokens)
+        for piece in pieces:
+            chunks.append(Chunk(index=len(chunks), heading=heading, text=piece, tokens=estimate_tokens(piece)))
+    return chunks
+
+
+# --- BM25 ---
+
+class BM25Index:
+    """Okapi BM25 over chunks (heading terms are indexed with the chunk body)."""
+
+    def __init__(self, chunks: List[Chunk], k1: float = 1.5, b: float = 0.75, text: str = ""):
+        self.chunks = chunks
+        self.text = text
+        self.k1 = k1
+        self.b = b
+        self._tf = [Counter(tokenize(f"{c.heading}\n{c.text}")) for c in chunks]
+        self._lengths = [sum(tf.values()) for tf in self._tf]
+        self._avg_length = (sum(self._lengths) / len(self._lengths)) if chunks else 0.0
+
+        df = Counter()
+        for tf in self._tf:
+            df.update(tf.keys())
+        n = len(chunks)
+        self._idf = {term: math.log(1 + (n - freq + 0.5) / (freq + 0.5)) for term, freq in df.items()}
+
+    def search(self, query: str, k: Optional[int] = None) -> List[Tuple[Chunk, float]]:
+        terms = [t for t in set(tokenize(query)) if t in self._idf]
+        scored = []
+        for chunk, tf, length in zip(self.chunks, self._tf, self._lengths):
+            score = 0.0
+            for term in terms:
+                freq = tf.get(term)
+                if freq:
+                    norm = self.k1 * (1 - self.b + self.b * length / (self._avg_length or 1))
+                    score += self._idf[term] * freq * (self.k1 + 1) / (freq + norm)
+            if score > 0:
+                scored.append((chunk, score))
+        scored.sort(key=lambda item: item[1], reverse=True)
+        return scored[:k] if k else scored
+
+
+def build_index(course_text: str) -> BM25Index:
+    return BM25Index(chunk_markdown(course_text), text=course_text)
+
+
+# --- CACHE D'INDEX PAR COURS ---
+# Un index est construit une fois par cours (clé = hash du contenu) puis réutilisé
+# pour tous les messages d'une session de tutorat. Le cache n'est lu et modifié que
+# depuis la boucle d'événements ; seule la construction part dans un thread.
+
+_index_cache: "OrderedDict[str, Tuple[float, BM25Index]]" = OrderedDict()
+_building: Dict[str, "asyncio.Task[BM25Index]"] = {}
+
+
+def course_hash(course_text: str) -> str:
+    return hashlib.sha256(course_text.encode("utf-8")).hexdigest()[:32]
+
+
+async def get_index(course_text: str = "", key: Optional[str] = None) -> Tuple[str, BM25Index]:
+    """
+    Cached BM25 index for a course, looked up by its text or by its hash.
+
+    A missing or expired index is rebuilt in a worker thread, once per course
+    even when several requests miss at the same time. With only a hash, the
+    text is taken from the course store (course ids are the same hash);
+    LookupError if it is not there either.
+    """
+    if course_text:
+        key = course_hash(course_text)
+    if not key:
+        raise LookupError("No course text or course hash given")
+
+    entry = _index_cache.get(key)
+    now = time.time()
+    if entry is not None and entry[0] + COURSE_INDEX_TTL > now:
+        _index_cache.move_to_end(key)
+        _index_cache[key] = (now, entry[1])
+        return key, entry[1]
+    _index_cache.pop(key, None)
+
+    # Une seule construction par cours ; elle continue si l'appelant qui l'a lancée est annulé
+    task = _building.get(key)
+    if task is None:
+        task = _building[key] = asyncio.ensure_future(_build_index(key, course_text))
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+    return key, await asyncio.shield(task)
+
+
+async def _build_index(key: str, course_text: str) -> BM25Index:
+    try:
+        if not course_text:
+            from .courses import get_course_text  # courses importe ce module
+            course_text = await get_course_text(key) or ""
+            if not course_text:
+                raise LookupError("Course index expired, resend course_context")
+        index = await asyncio.to_thread(build_index, course_text)
+        _index_cache[key] = (time.time(), index)
+        while len(_index_cache) > COURSE_INDEX_CACHE_SIZE:
+            _index_cache.popitem(last=False)
+        return index
+    finally:
+        del _building[key]
+
+
+def select_chunks(index: BM25Index, query: str, max_tokens: int) -> List[Chunk]:
+    """Best-ranked chunks for `query` that fit in `max_tokens`, in document order."""
+    selected, used = [], 0
+    ranked = index.search(query) or [(c, 0.0) for c in index.chunks]
+    for chunk, _ in ranked:
+        if used + chunk.tokens > max_tokens:
+            continue
+        selected.append(chunk)
+        used += chunk.tokens
+    return sorted(selected, key=lambda c: c.index)
+
+
+def format_chunks(chunks: List[Chunk]) -> str:
+    parts = []
+    for chunk in chunks:
+        header = f"[{chunk.heading}]\n" if chunk.heading and not _HEADER.match(chunk.text.splitlines()[0]) else ""
+        parts.append(header + chunk.text)
+    return "\n\n".join(parts)
+
+
+async def select_context(
+        course_text: str,
+        query: str,
+        max_tokens: int,
+        key: Optional[str] = None,
+        index: Optional[BM25Index] = None,
+) -> str:
+    """
+    The course itself if it fits in max_tokens, otherwise only the sections most
+    relevant to `query` (instead of a blind character cut).
+    The course can be given by its text, its hash (`key`) or an index already
+    resolved by the caller (`index`, immune to cache eviction).
+    """
+    if course_text and estimate_tokens(course_text) <= max_tokens:
+        return course_text
+    if index is None:
+        _, index = await get_index(course_text, key)
+    if estimate_tokens(index.text) <= max_tokens:
+        return index.text
+    return format_chunks(select_chunks(index, query, max_tokens))
+
+
+def heading_titles(course_text: str) -> List[str]:
+    return [m.group(2).strip("* ") for m in map(_HEADER.match, course_text.splitlines()) if m]
+
+
+def course_headings(course_text: str) -> str:
+    """All header titles of the course, usable as a 'whole course' query."""
+    return " ".join(heading_titles(course_text))
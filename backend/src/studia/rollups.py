@@ -0,0 +1,292 @@
+"""
+Analytics Rollups - Per-day aggregates updated as events are ingested
+(HyperLogLog of active users, feature counts, sessions, day-1 retention cohorts)
+"""
+import asyncio
+import hashlib
+import logging
+import math
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional
+
+from .database import events_after
+from .observability import log_event
+from .settings import STUDIA_DATA_DIR, ROLLUPS_ENABLED, HLL_PRECISION, ROLLUPS_BACKFILL_PAGE
+
+
+class HyperLogLog:
+    """Approximate distinct counter: 2^p one-byte registers, ~1.04/sqrt(2^p) relative error."""
+
+    def __init__(self, p: int = HLL_PRECISION, registers: Optional[bytes] = None):
+        self.p = p
+        self.m = 1 << p
+        self.registers = bytearray(registers) if registers is not None else bytearray(self.m)
+
+    def add(self, value: str):
+        x = int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+        index = x >> (64 - self.p)
+        rest = x & ((1 << (64 - self.p)) - 1)
+        rank = (64 - self.p) - rest.bit_length() + 1  # position du premier bit à 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other: "HyperLogLog") -> "HyperLogLog":
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def count(self) -> int:
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        estimate = alpha * self.m * self.m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * self.m and zeros:
+            estimate = self.m * math.log(self.m / zeros)  # petite cardinalité : comptage linéaire
+        return round(estimate)
+
+
+def _day(created_at: Optional[str]) -> str:
+    try:
+        moment = datetime.fromisoformat(str(created_at).replace("Z", "+00:00"))
+    except ValueError:
+        moment = datetime.now(timezone.utc)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.astimezone(timezone.utc).strftime("%Y-%m-%d")
+
+
+class Rollups:
+    """
+    SQLite aggregates written by a single background thread, so ingestion
+    never waits on disk. Reading a dashboard touches one row per day,
+    whatever the number of events.
+    """
+
+    def __init__(self, enabled: bool = ROLLUPS_ENABLED):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rollups-db")
+        self._db = None
+        self._backfill_task: Optional[asyncio.Task] = None
+        if enabled:
+            os.makedirs(STUDIA_DATA_DIR, exist_ok=True)
+            self._db = sqlite3.connect(os.path.join(STUDIA_DATA_DIR, "rollups.sqlite3"), check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.executescript(
+                "CREATE TABLE IF NOT EXISTS active_users (day TEXT PRIMARY KEY, hll BLOB NOT NULL);"
+                "CREATE TABLE IF NOT EXISTS feature_counts (day TEXT NOT NULL, feature TEXT NOT NULL, "
+                "count INTEGER NOT NULL, PRIMARY KEY (day, feature));"
+                "CREATE TABLE IF NOT EXISTS sessions (day TEXT PRIMARY KEY, count INTEGER NOT NULL, "
+                "total_seconds REAL NOT NULL);"
+                # Premier jour d'activité par utilisateur : cohortes de rétention J1 exactes
+                "CREATE TABLE IF NOT EXISTS first_seen (user_id TEXT PRIMARY KEY, day TEXT NOT NULL, "
+                "returned_d1 INTEGER NOT NULL DEFAULT 0);"
+                "CREATE INDEX IF NOT EXISTS idx_first_seen_day ON first_seen(day);"
+                "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);"
+            )
+            self._db.commit()
+
+    # --- ÉCRITURE ---
+
+    def _apply(self, events: List[dict]):
+        users: Dict[str, set] = {}
+        features: Dict[tuple, int] = {}
+        sessions: Dict[str, list] = {}
+        for event in events:
+            user_id = event.get("user_id")
+            if not user_id:
+                continue
+            day = _day(event.get("created_at"))
+            users.setdefault(day, set()).add(user_id)
+            data = event.get("event_data") or {}
+            if event.get("event_type") == "feature_use" and data.get("feature"):
+                key = (day, str(data["feature"]))
+                features[key] = features.get(key, 0) + 1
+            elif event.get("event_type") == "session_end":
+                try:
+                    seconds = float(data.get("duration_seconds", 0))
+                except (TypeError, ValueError):
+                    continue
+                totals = sessions.setdefault(day, [0, 0.0])
+                totals[0] += 1
+                totals[1] += max(0.0, seconds)
+
+        with self._lock:
+            db = self._db
+            self._apply_users(users)
+            db.executemany(
+                "INSERT INTO feature_counts (day, feature, count) VALUES (?, ?, ?) "
+                "ON CONFLICT(day, feature) DO UPDATE SET count = count + excluded.count",
+                [(day, feature, n) for (day, feature), n in features.items()],
+            )
+            db.executemany(
+                "INSERT INTO sessions (day, count, total_seconds) VALUES (?, ?, ?) "
+                "ON CONFLICT(day) DO UPDATE SET count = count + excluded.count, "
+                "total_seconds = total_seconds + excluded.total_seconds",
+                [(day, n, seconds) for day, (n, seconds) in sessions.items()],
+            )
+            db.commit()
+
+    def _apply_users(self, users: Dict[str, set]):
+        """
+        Active-user sketches and first-seen cohorts. Both are idempotent and
+        order-independent, so a backfill may replay events the live path
+        already folded in.
+        """
+        db = self._db
+        for day, ids in sorted(users.items()):
+            row = db.execute("SELECT hll FROM active_users WHERE day = ?", (day,)).fetchone()
+            sketch = HyperLogLog(registers=row[0] if row else None)
+            for user_id in ids:
+                sketch.add(user_id)
+            db.execute("INSERT OR REPLACE INTO active_users (day, hll) VALUES (?, ?)", (day, bytes(sketch.registers)))
+
+            # Cohortes : nouvel utilisateur, ou retour le lendemain de sa première venue.
+            # Un événement antérieur recule le premier jour ; le retour J1 ne reste vrai
+            # que si l'ancien premier jour est exactement le lendemain du nouveau.
+            previous = (date.fromisoformat(day) - timedelta(days=1)).isoformat()
+            for user_id in ids:
+                db.execute(
+                    "INSERT INTO first_seen (user_id, day) VALUES (?, ?) "
+                    "ON CONFLICT(user_id) DO UPDATE SET "
+                    "returned_d1 = CASE WHEN excluded.day < day THEN day = date(excluded.day, '+1 day') "
+                    "ELSE returned_d1 END, "
+                    "day = MIN(day, excluded.day)",
+                    (user_id, day),
+                )
+                db.execute(
+                    "UPDATE first_seen SET returned_d1 = 1 WHERE user_id = ? AND day = ? AND returned_d1 = 0",
+                    (user_id, previous),
+                )
+
+    def _backfill_page(self, events: List[dict], last_id: int, done: bool):
+        users: Dict[str, set] = {}
+        for event in events:
+            if event.get("user_id"):
+                users.setdefault(_day(event.get("created_at")), set()).add(event["user_id"])
+        with self._lock:
+            self._apply_users(users)
+            self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('backfill_after_id', ?)", (str(last_id),))
+            if done:
+                self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('backfill_done', '1')")
+            self._db.commit()
+
+    def _meta(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    async def backfill(self, page_size: int = ROLLUPS_BACKFILL_PAGE):
+        """
+        Replay analytics_events already in Supabase into the active-user
+        sketches and first-seen cohorts, so that users active before the
+        rollups existed are not counted as new. Resumes where it stopped;
+        feature and session totals only cover events ingested live.
+        """
+        loop = asyncio.get_running_loop()
+        if await loop.run_in_executor(self._writer, self._meta, "backfill_done"):
+            return
+        last_id = int(await loop.run_in_executor(self._writer, self._meta, "backfill_after_id") or 0)
+        replayed = 0
+        while True:
+            events = await events_after(last_id, page_size)
+            if events:
+                last_id = max(int(event["id"]) for event in events)
+            done = len(events) < page_size
+            await loop.run_in_executor(self._writer, self._backfill_page, events, last_id, done)
+            replayed += len(events)
+            if done:
+                break
+        log_event("rollups_backfilled", events=replayed, last_id=last_id)
+
+    async def _run_backfill(self):
+        try:
+            await self.backfill()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Reprise au prochain démarrage, à partir du dernier lot enregistré
+            log_event("rollups_backfill_failed", logging.WARNING, error=str(e))
+
+    async def start(self):
+        if self._db is not None:
+            self._backfill_task = asyncio.create_task(self._run_backfill())
+
+    async def ingest(self, events: Iterable[dict]):
+        """Fold a batch of analytics events (rows of analytics_events) into the rollups."""
+        events = list(events)
+        if self._db is None or not events:
+            return
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self._writer, self._apply, events)
+        except RuntimeError:  # arrêt en cours
+            pass
+
+    # --- LECTURE ---
+
+    def _active(self, first: str, last: str) -> int:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT hll FROM active_users WHERE day BETWEEN ? AND ?", (first, last)
+            ).fetchall()
+        if not rows:
+            return 0
+        sketch = HyperLogLog(registers=rows[0][0])
+        for (registers,) in rows[1:]:
+            sketch.merge(HyperLogLog(registers=registers))
+        return sketch.count()
+
+    def _summary(self, today: date, days: int) -> dict:
+        def ago(n: int) -> str:
+            return (today - timedelta(days=n)).isoformat()
+
+        with self._lock:
+            features = self._db.execute(
+                "SELECT feature, SUM(count) FROM feature_counts WHERE day >= ? GROUP BY feature ORDER BY 2 DESC",
+                (ago(days - 1),),
+            ).fetchall()
+            sessions = self._db.execute(
+                "SELECT SUM(count), SUM(total_seconds) FROM sessions WHERE day >= ?", (ago(days - 1),)
+            ).fetchone()
+            # Cohortes complètes seulement (le lendemain est terminé)
+            cohorts = self._db.execute(
+                "SELECT day, COUNT(*), SUM(returned_d1) FROM first_seen WHERE day BETWEEN ? AND ? "
+                "GROUP BY day ORDER BY day",
+                (ago(days + 1), ago(2)),
+            ).fetchall()
+
+        daily = [{"day": ago(n), "active_users": self._active(ago(n), ago(n))} for n in range(days - 1, -1, -1)]
+        new_users = sum(size for _, size, _ in cohorts)
+        returned = sum(back or 0 for _, _, back in cohorts)
+        session_count, session_seconds = sessions if sessions and sessions[0] else (0, 0.0)
+        return {
+            "dau": daily[-1]["active_users"],
+            "wau": self._active(ago(6), ago(0)),
+            "mau": self._active(ago(29), ago(0)),
+            "daily": daily,
+            "features": [{"feature": f, "count": n} for f, n in features],
+            "sessions": session_count,
+            "avg_session_seconds": round(session_seconds / session_count, 1) if session_count else 0.0,
+            "retention_d1": round(returned / new_users, 4) if new_users else None,
+            "cohorts": [{"day": d, "new_users": size, "returned_d1": back or 0} for d, size, back in cohorts],
+        }
+
+    async def summary(self, days: int = 7, today: Optional[date] = None) -> Optional[dict]:
+        """DAU / WAU / MAU, feature usage, sessions and day-1 retention over the last `days` days."""
+        if self._db is None:
+            return None
+        return await asyncio.to_thread(self._summary, today or datetime.now(timezone.utc).date(), days)
+
+    async def stop(self):
+        if self._backfill_task is not None:
+            self._backfill_task.cancel()
+            await asyncio.gather(self._backfill_task, return_exceptions=True)
+            self._backfill_task = None
+        self._writer.shutdown(wait=True)
+
+
+rollups = Rollups()
@@ -1,8 +1,164 @@
 import os
+import json
+from dotenv import load_dotenv
+
+load_dotenv()
 
 # OpenAI Configuration
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-4o-mini")
+
+# LLM HTTP pool (one shared AsyncOpenAI client per worker)
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", 200))
+LLM_MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", 50))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", 30))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", 120))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 2))
+
+# Journal de consommation des appels LLM (tokens, latence, coût)
+LEDGER_ENABLED = os.getenv("LEDGER_ENABLED", "1") == "1"
+# USD par million de tokens : entrée, entrée en cache, sortie
+LLM_PRICES = json.loads(os.getenv("LLM_PRICES", json.dumps({
+    "gpt-4o-mini": {"input": 0.15, "cached": 0.075, "output": 0.60},
+    "gpt-4o": {"input": 2.50, "cached": 1.25, "output": 10.00},
+})))
+
+# Observabilité : métriques Prometheus (/metrics) et logs structurés
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")  # si défini, /metrics exige "Authorization: Bearer <token>"
+METRICS_RESERVOIR_SIZE = int(os.getenv("METRICS_RESERVOIR_SIZE", 2048))  # observations gardées pour p50/p95/p99
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_JSON = os.getenv("LOG_JSON", "1") == "1"
+
+# Ingestion analytics : insertion par lots en arrière-plan
+ANALYTICS_BUFFER_SIZE = int(os.getenv("ANALYTICS_BUFFER_SIZE", 10000))  # au-delà, les événements sont abandonnés
+ANALYTICS_FLUSH_EVENTS = int(os.getenv("ANALYTICS_FLUSH_EVENTS", 200))
+ANALYTICS_FLUSH_MS = int(os.getenv("ANALYTICS_FLUSH_MS", 1000))
+ANALYTICS_DRAIN_TIMEOUT = float(os.getenv("ANALYTICS_DRAIN_TIMEOUT", 10))
+ANALYTICS_BATCH_MAX = int(os.getenv("ANALYTICS_BATCH_MAX", 100))
+ANALYTICS_MAX_BACKDATE = int(os.getenv("ANALYTICS_MAX_BACKDATE", 600))  # created_at client : au plus N secondes dans le passé
+# Agrégats journaliers (utilisateurs actifs par HyperLogLog : 2^HLL_PRECISION octets par jour)
+ROLLUPS_ENABLED = os.getenv("ROLLUPS_ENABLED", "1") == "1"
+HLL_PRECISION = int(os.getenv("HLL_PRECISION", 14))
+ROLLUPS_BACKFILL_PAGE = int(os.getenv("ROLLUPS_BACKFILL_PAGE", 1000))  # événements lus par requête au rattrapage
+
+# Supabase (PostgREST) : pool HTTP/2 partagé
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+DB_MAX_CONNECTIONS = int(os.getenv("DB_MAX_CONNECTIONS", 50))
+DB_MAX_KEEPALIVE = int(os.getenv("DB_MAX_KEEPALIVE", 20))
+DB_KEEPALIVE_EXPIRY = float(os.getenv("DB_KEEPALIVE_EXPIRY", 30))
+DB_TIMEOUT = float(os.getenv("DB_TIMEOUT", 10))
+DB_MAX_RETRIES = int(os.getenv("DB_MAX_RETRIES", 2))
+
+# Webhooks Lemon Squeezy (dédupliqués, appliqués en arrière-plan)
+LEMON_WEBHOOK_SECRET = os.getenv("LEMON_WEBHOOK_SECRET")
+WEBHOOK_CONCURRENCY = int(os.getenv("WEBHOOK_CONCURRENCY", 4))
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", 5))
+WEBHOOK_RETENTION = int(os.getenv("WEBHOOK_RETENTION", 30 * 24 * 3600))  # événements appliqués gardés 30 jours
+
+# Contrôle d'admission des routes de génération : par classe, requêtes simultanées
+# et seau de jetons par utilisateur (jetons/minute, capacité ; classe vision : 1 jeton = 1 page)
+ADMISSION_CLASSES = json.loads(os.getenv("ADMISSION_CLASSES", json.dumps({
+    "vision": {"in_flight": 8, "rate_per_min": 60, "burst": 80},
+    "generation": {"in_flight": 16, "rate_per_min": 20, "burst": 20},
+    "chat": {"in_flight": 32, "rate_per_min": 30, "burst": 30},
+})))
+ADMISSION_MAX_WAIT = float(os.getenv("ADMISSION_MAX_WAIT", 20))  # budget d'attente en file (secondes)
+ADMISSION_PREMIUM_WEIGHT = float(os.getenv("ADMISSION_PREMIUM_WEIGHT", 4))
+ADMISSION_PREMIUM_TTL = int(os.getenv("ADMISSION_PREMIUM_TTL", 300))
+ADMISSION_PREMIUM_CACHE_SIZE = int(os.getenv("ADMISSION_PREMIUM_CACHE_SIZE", 10_000))
+# Secret partagé avec le frontend (côté serveur) pour signer l'en-tête X-User-Token "<user_id>:<expiration>:<hmac>",
+# délivré par sa route /api/user-token à l'utilisateur Clerk connecté ; sans jeton valide, la limite de débit
+# s'applique par IP et sans priorité premium
+ADMISSION_USER_SECRET = os.getenv("ADMISSION_USER_SECRET", "")
+# Proxies dont l'en-tête X-Forwarded-For fait foi pour l'IP du client : adresses ou réseaux séparés par des virgules,
+# "*" pour le seul pair direct (routeur Heroku : le dyno n'est joignable qu'à travers lui)
+TRUSTED_PROXIES = [p.strip() for p in os.getenv("TRUSTED_PROXIES", "").split(",") if p.strip()]
+ADMISSION_BYTES_PER_PAGE = int(os.getenv("ADMISSION_BYTES_PER_PAGE", 500_000))
+ADMISSION_MAX_BODY_BYTES = int(os.getenv("ADMISSION_MAX_BODY_BYTES", 10 * 1024 * 1024))  # routes texte
+
+# Stockage local (caches, index...)
+STUDIA_DATA_DIR = os.getenv("STUDIA_DATA_DIR", "data")
+
+# LLM response cache (mémoire LRU + SQLite)
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") == "1"
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", 7 * 24 * 3600))
+LLM_CACHE_MEMORY_BYTES = int(os.getenv("LLM_CACHE_MEMORY_BYTES", 64 * 1024 * 1024))
+LLM_CACHE_DISK_BYTES = int(os.getenv("LLM_CACHE_DISK_BYTES", 512 * 1024 * 1024))
+
+# Découpage / sélection du contexte de cours (en tokens estimés)
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", 400))
+TUTOR_CONTEXT_TOKENS = int(os.getenv("TUTOR_CONTEXT_TOKENS", 3000))
+ITEM_CONTEXT_TOKENS = int(os.getenv("ITEM_CONTEXT_TOKENS", 1500))
+MASTERY_CONTEXT_TOKENS = int(os.getenv("MASTERY_CONTEXT_TOKENS", 6000))
+
+# Index BM25 par cours, gardés en mémoire le temps d'une session
+COURSE_INDEX_CACHE_SIZE = int(os.getenv("COURSE_INDEX_CACHE_SIZE", 256))
+COURSE_INDEX_TTL = int(os.getenv("COURSE_INDEX_TTL", 2 * 3600))
+
+# Stockage des cours côté serveur (texte + artefacts dérivés, par hash de contenu)
+COURSE_STORE_TTL = int(os.getenv("COURSE_STORE_TTL", 30 * 24 * 3600))
+COURSE_STORE_MEMORY_BYTES = int(os.getenv("COURSE_STORE_MEMORY_BYTES", 64 * 1024 * 1024))
+COURSE_STORE_DISK_BYTES = int(os.getenv("COURSE_STORE_DISK_BYTES", 1024 * 1024 * 1024))
+COURSE_MAX_CHARS = int(os.getenv("COURSE_MAX_CHARS", 2_000_000))
+
+# Upload binaire (multipart) des pages : fichiers temporaires "spooled" et limites de taille
+UPLOAD_MAX_PAGES = int(os.getenv("UPLOAD_MAX_PAGES", 40))
+UPLOAD_MAX_PAGE_BYTES = int(os.getenv("UPLOAD_MAX_PAGE_BYTES", 15 * 1024 * 1024))
+UPLOAD_MAX_TOTAL_BYTES = int(os.getenv("UPLOAD_MAX_TOTAL_BYTES", 200 * 1024 * 1024))
+UPLOAD_SPOOL_BYTES = int(os.getenv("UPLOAD_SPOOL_BYTES", 1024 * 1024))
+
+# OCR: pages extraites en parallèle par requête
+OCR_CONCURRENCY = int(os.getenv("OCR_CONCURRENCY", 6))
+
+# OCR groupé : plusieurs pages par appel vision (taille du lot adaptée au nombre de pages et aux tokens image)
+OCR_BATCH_ENABLED = os.getenv("OCR_BATCH_ENABLED", "1") == "1"
+OCR_BATCH_MAX_PAGES = int(os.getenv("OCR_BATCH_MAX_PAGES", 6))
+OCR_BATCH_MAX_IMAGE_TOKENS = int(os.getenv("OCR_BATCH_MAX_IMAGE_TOKENS", 2400))
+
+# OCR cache par empreinte d'image (sha256 + dHash perceptuel)
+OCR_CACHE_TTL = int(os.getenv("OCR_CACHE_TTL", 30 * 24 * 3600))
+# Réutilisation d'une extraction pour une page quasi identique (ré-encodage, léger redimensionnement) :
+# distance de Hamming très faible, mêmes proportions, et jamais pour une page presque blanche
+IMAGE_PHASH_MAX_DISTANCE = int(os.getenv("IMAGE_PHASH_MAX_DISTANCE", 2))  # bits sur 256
+IMAGE_PHASH_MAX_ASPECT_DELTA = float(os.getenv("IMAGE_PHASH_MAX_ASPECT_DELTA", 0.02))  # écart relatif largeur/hauteur
+IMAGE_PHASH_MIN_CONTRAST = float(os.getenv("IMAGE_PHASH_MIN_CONTRAST", 4))  # écart-type des gris (vignette 64x64)
+IMAGE_PHASH_INDEX_SIZE = int(os.getenv("IMAGE_PHASH_INDEX_SIZE", 5000))
+
+# Prétraitement des photos avant le modèle vision (pool de processus)
+IMAGE_PREPROCESS_ENABLED = os.getenv("IMAGE_PREPROCESS_ENABLED", "1") == "1"
+IMAGE_PREPROCESS_WORKERS = int(os.getenv("IMAGE_PREPROCESS_WORKERS", min(4, os.cpu_count() or 1)))
+IMAGE_TARGET_SHORT_SIDE = int(os.getenv("IMAGE_TARGET_SHORT_SIDE", 768))
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", 80))
+IMAGE_MIN_TEXT_PX = float(os.getenv("IMAGE_MIN_TEXT_PX", 14))  # hauteur de ligne minimale lisible après réduction
+
+# Validation locale des quiz : au-dessus de ce score, pas de validation LLM
+LOCAL_VALIDATION_THRESHOLD = int(os.getenv("LOCAL_VALIDATION_THRESHOLD", 90))
+
+# Banque de questions par cours et difficulté (quiz assemblés localement, complétée en arrière-plan)
+QUESTION_BANK_ENABLED = os.getenv("QUESTION_BANK_ENABLED", "1") == "1"
+QUESTION_BANK_SIZE = int(os.getenv("QUESTION_BANK_SIZE", 40))  # taille visée à la première construction
+QUESTION_BANK_MAX = int(os.getenv("QUESTION_BANK_MAX", 200))
+QUESTION_BANK_BATCH = int(os.getenv("QUESTION_BANK_BATCH", 5))  # questions par appel de génération
+QUESTION_BANK_LOW_WATER = int(os.getenv("QUESTION_BANK_LOW_WATER", 10))  # questions non vues restantes avant complément
+QUESTION_BANK_CONCURRENCY = int(os.getenv("QUESTION_BANK_CONCURRENCY", 2))
+# Poids du complément dans la file d'admission "generation" (1 = un utilisateur gratuit)
+QUESTION_BANK_WEIGHT = float(os.getenv("QUESTION_BANK_WEIGHT", 0.5))
+
+# Background jobs (pipelines longs)
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 8))
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", 500))
+JOB_RESULT_TTL = int(os.getenv("JOB_RESULT_TTL", 3600))
+JOBS_DURABLE = os.getenv("JOBS_DURABLE", "0") == "1"
+
+# Coalescence des générations identiques en cours (single-flight)
+COALESCE_ENABLED = os.getenv("COALESCE_ENABLED", "1") == "1"
+
+# Génération par lots (enseignants) : limite globale de générations simultanées
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", 8))
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", 100))
 
 # Server Configuration
 API_HOST = os.getenv("API_HOST", "0.0.0.0")
-API_PORT = int(os.getenv("API_PORT", 5000))
\ No newline at end of file
+API_PORT = int(os.getenv("API_PORT", 5000))
@@ -0,0 +1,147 @@
+"""
+Uploads - Streaming multipart parser for binary page uploads (spooled to temporary files)
+"""
+import asyncio
+import base64
+import tempfile
+from typing import Dict, List, Optional
+
+from fastapi import HTTPException, Request
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+from .settings import UPLOAD_MAX_PAGES, UPLOAD_MAX_PAGE_BYTES, UPLOAD_MAX_TOTAL_BYTES, UPLOAD_SPOOL_BYTES
+
+MAX_FIELD_BYTES = 64 * 1024
+
+
+class UploadError(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class UploadedPage:
+    """One uploaded file, kept in memory up to UPLOAD_SPOOL_BYTES then on disk."""
+
+    def __init__(self, name: str, filename: str, content_type: str):
+        self.name = name
+        self.filename = filename
+        self.content_type = content_type
+        self.size = 0
+        self.file = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_BYTES)
+
+    def read_base64(self) -> str:
+        """Base64 of the page, built only when its extraction actually runs."""
+        self.file.seek(0)
+        return base64.b64encode(self.file.read()).decode("ascii")
+
+    def close(self):
+        self.file.close()
+
+
+class UploadForm:
+    def __init__(self):
+        self.files: List[UploadedPage] = []
+        self.fields: Dict[str, str] = {}
+
+    def close(self):
+        for page in self.files:
+            page.close()
+
+
+async def parse_upload(
+        request: Request,
+        max_files: int = UPLOAD_MAX_PAGES,
+        max_file_bytes: int = UPLOAD_MAX_PAGE_BYTES,
+        max_total_bytes: int = UPLOAD_MAX_TOTAL_BYTES,
+) -> UploadForm:
+    """
+    Stream a multipart/form-data body into spooled temporary files.
+
+    The body is never held in memory as a whole: each chunk is parsed and
+    written as it arrives, and limits are enforced on the fly (413 as soon
+    as a page or the whole body is too large).
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise UploadError(415, "Expected multipart/form-data")
+
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > max_total_bytes:
+        raise UploadError(413, f"Upload too large (max {max_total_bytes} bytes)")
+
+    form = UploadForm()
+    state = {"headers": {}, "field": None, "name": "", "page": None, "total": 0, "header_field": b"", "header_value": b""}
+
+    def on_part_begin():
+        state.update(headers={}, field=None, page=None, header_field=b"", header_value=b"")
+
+    def on_header_field(data: bytes, start: int, end: int):
+        state["header_field"] += data[start:end]
+
+    def on_header_value(data: bytes, start: int, end: int):
+        state["header_value"] += data[start:end]
+
+    def on_header_end():
+        state["headers"][state["header_field"].lower()] = state["header_value"]
+        state["header_field"], state["header_value"] = b"", b""
+
+    def on_headers_finished():
+        _, disposition = parse_options_header(state["headers"].get(b"content-disposition", b""))
+        name = disposition.get(b"name", b"").decode("utf-8", "replace")
+        filename = disposition.get(b"filename")
+        state["name"] = name
+        if filename is None:
+            state["field"] = bytearray()
+            return
+        if len(form.files) >= max_files:
+            raise UploadError(413, f"Too many pages (max {max_files})")
+        page = UploadedPage(name, filename.decode("utf-8", "replace"),
+                            state["headers"].get(b"content-type", b"application/octet-stream").decode("latin-1"))
+        form.files.append(page)
+        state["page"] = page
+
+    def on_part_data(data: bytes, start: int, end: int):
+        size = end - start
+        state["total"] += size
+        if state["total"] > max_total_bytes:
+            raise UploadError(413, f"Upload too large (max {max_total_bytes} bytes)")
+        page: Optional[UploadedPage] = state["page"]
+        if page is not None:
+            page.size += size
+            if page.size > max_file_bytes:
+                raise UploadError(413, f"Page {page.filename or len(form.files)} too large (max {max_file_bytes} bytes)")
+            page.file.write(data[start:end])
+        elif state["field"] is not None:
+            state["field"] += data[start:end]
+            if len(state["field"]) > MAX_FIELD_BYTES:
+                raise UploadError(413, f"Field {state['name']} too large")
+
+    def on_part_end():
+        if state["field"] is not None:
+            form.fields[state["name"]] = state["field"].decode("utf-8", "replace")
+
+    parser = MultipartParser(params[b"boundary"], {
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+    })
+
+    try:
+        async for chunk in request.stream():
+            if chunk:
+                # Parsing + écriture (éventuellement sur disque) hors de la boucle d'événements
+                await asyncio.to_thread(parser.write, chunk)
+        parser.finalize()
+    except (UploadError, HTTPException):
+        form.close()
+        raise
+    except Exception as e:
+        form.close()
+        raise UploadError(400, f"Invalid multipart body: {e}")
+    return form
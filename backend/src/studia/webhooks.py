@@ -0,0 +1,260 @@
+"""
+Webhooks - Lemon Squeezy events: verified, deduplicated, acknowledged at once,
+then applied in the background (retries, per-user ordering, replay)
+"""
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Deque, Dict, List, Optional
+
+from fastapi import APIRouter, Header, HTTPException, Request
+
+from .admin import _require_admin
+from .database import db, update_user
+from .observability import log_event
+from .settings import (
+    STUDIA_DATA_DIR, LEMON_WEBHOOK_SECRET, WEBHOOK_CONCURRENCY, WEBHOOK_MAX_ATTEMPTS, WEBHOOK_RETENTION,
+)
+
+# Un handler reçoit (user_id, payload) ; une exception déclenche une nouvelle tentative
+Handler = Callable[[Optional[str], dict], Awaitable[None]]
+
+
+class WebhookQueue:
+    """
+    SQLite log of received events (the id is the sha256 of the signed body, so a
+    provider retry is recognised and skipped) feeding one lane per user: events
+    of a user are applied one after the other, in arrival order, while
+    different users proceed concurrently (at most `concurrency` at once).
+    """
+
+    def __init__(self, concurrency: int = WEBHOOK_CONCURRENCY, max_attempts: int = WEBHOOK_MAX_ATTEMPTS):
+        self.max_attempts = max_attempts
+        self._handlers: Dict[str, Handler] = {}
+        self._lanes: Dict[str, Deque[str]] = {}
+        self._lane_tasks: Dict[str, asyncio.Task] = {}
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._lock = threading.Lock()
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="webhooks-db")
+        os.makedirs(STUDIA_DATA_DIR, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(STUDIA_DATA_DIR, "webhooks.sqlite3"), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS lemon_events (id TEXT PRIMARY KEY, event_name TEXT, user_id TEXT, "
+            "payload TEXT NOT NULL, status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, error TEXT, "
+            "received_at REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_lemon_events_status ON lemon_events(status)")
+        self._db.commit()
+
+    def register(self, event_name: str, handler: Handler):
+        self._handlers[event_name] = handler
+
+    # --- PERSISTANCE (thread d'écriture unique) ---
+
+    async def _db_call(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._writer, fn, *args)
+
+    def _insert(self, event_id: str, event_name: str, user_id: Optional[str], payload: str) -> bool:
+        now = time.time()
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT OR IGNORE INTO lemon_events (id, event_name, user_id, payload, status, received_at, updated_at) "
+                "VALUES (?, ?, ?, ?, 'queued', ?, ?)",
+                (event_id, event_name, user_id, payload, now, now),
+            )
+            self._db.commit()
+            return cursor.rowcount == 1
+
+    def _update(self, event_id: str, status: str, attempts: int, error: Optional[str]):
+        with self._lock:
+            self._db.execute(
+                "UPDATE lemon_events SET status = ?, attempts = ?, error = ?, updated_at = ? WHERE id = ?",
+                (status, attempts, error, time.time(), event_id),
+            )
+            self._db.commit()
+
+    def _get(self, event_id: str) -> Optional[tuple]:
+        with self._lock:
+            return self._db.execute(
+                "SELECT event_name, user_id, payload, status FROM lemon_events WHERE id = ?", (event_id,)
+            ).fetchone()
+
+    def _requeue(self, event_id: Optional[str]) -> List[tuple]:
+        """Mark failed events (or one event) as queued again; returns (id, user_id) rows."""
+        with self._lock:
+            if event_id:
+                rows = self._db.execute(
+                    "SELECT id, user_id FROM lemon_events WHERE id = ? AND status IN ('failed', 'done')", (event_id,)
+                ).fetchall()
+            else:
+                rows = self._db.execute(
+                    "SELECT id, user_id FROM lemon_events WHERE status = 'failed' ORDER BY received_at"
+                ).fetchall()
+            self._db.executemany(
+                "UPDATE lemon_events SET status = 'queued', attempts = 0, error = NULL, updated_at = ? WHERE id = ?",
+                [(time.time(), row[0]) for row in rows],
+            )
+            self._db.commit()
+        return rows
+
+    def _list(self, status: Optional[str], limit: int) -> List[dict]:
+        sql = "SELECT id, event_name, user_id, status, attempts, error, received_at, updated_at FROM lemon_events"
+        args: list = []
+        if status:
+            sql += " WHERE status = ?"
+            args.append(status)
+        sql += " ORDER BY received_at DESC LIMIT ?"
+        args.append(limit)
+        with self._lock:
+            rows = self._db.execute(sql, args).fetchall()
+        keys = ("id", "event_name", "user_id", "status", "attempts", "error", "received_at", "updated_at")
+        return [dict(zip(keys, row)) for row in rows]
+
+    # --- FILES PAR UTILISATEUR ---
+
+    def _dispatch(self, event_id: str, user_id: Optional[str]):
+        lane = user_id or ""
+        self._lanes.setdefault(lane, deque()).append(event_id)
+        if lane not in self._lane_tasks:
+            self._lane_tasks[lane] = asyncio.create_task(self._drain(lane))
+
+    async def _drain(self, lane: str):
+        try:
+            while self._lanes.get(lane):
+                event_id = self._lanes[lane].popleft()
+                await self._process(event_id)
+        finally:
+            self._lanes.pop(lane, None)
+            self._lane_tasks.pop(lane, None)
+
+    async def _process(self, event_id: str):
+        row = await self._db_call(self._get, event_id)
+        if row is None or row[3] != "queued":
+            return
+        event_name, user_id, payload, _ = row
+        handler = self._handlers.get(event_name)
+        if handler is None:
+            await self._db_call(self._update, event_id, "ignored", 0, None)
+            return
+
+        for attempt in range(1, self.max_attempts + 1):
+            # Place prise par tentative : l'attente entre deux essais ne bloque pas les autres files
+            try:
+                async with self._semaphore:
+                    await handler(user_id, json.loads(payload))
+                await self._db_call(self._update, event_id, "done", attempt, None)
+                return
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+                log_event(
+                    "webhook_attempt_failed", logging.WARNING if attempt < self.max_attempts else logging.ERROR,
+                    event_name=event_name, event_id=event_id[:8], attempt=attempt, error=error,
+                )
+                if attempt == self.max_attempts:
+                    await self._db_call(self._update, event_id, "failed", attempt, error)
+                    return
+                await self._db_call(self._update, event_id, "queued", attempt, error)
+                await asyncio.sleep(min(30.0, 2 ** (attempt - 1)))
+
+    # --- API ---
+
+    async def enqueue(self, body: bytes, payload: dict) -> bool:
+        """Store and schedule an event; False if this exact event was already received."""
+        meta = payload.get("meta", {})
+        event_id = hashlib.sha256(body).hexdigest()
+        user_id = (meta.get("custom_data") or {}).get("user_id")
+        if not await self._db_call(self._insert, event_id, meta.get("event_name"), user_id, body.decode("utf-8")):
+            return False
+        self._dispatch(event_id, user_id)
+        return True
+
+    async def replay(self, event_id: Optional[str] = None) -> int:
+        rows = await self._db_call(self._requeue, event_id)
+        for row_id, user_id in rows:
+            self._dispatch(row_id, user_id)
+        return len(rows)
+
+    async def list(self, status: Optional[str] = None, limit: int = 50) -> List[dict]:
+        return await asyncio.to_thread(self._list, status, limit)
+
+    async def start(self):
+        def pending():
+            with self._lock:
+                self._db.execute(
+                    "DELETE FROM lemon_events WHERE status IN ('done', 'ignored') AND updated_at < ?",
+                    (time.time() - WEBHOOK_RETENTION,),
+                )
+                self._db.commit()
+                return self._db.execute(
+                    "SELECT id, user_id FROM lemon_events WHERE status = 'queued' ORDER BY received_at"
+                ).fetchall()
+
+        # Événements reçus mais pas encore appliqués avant un redémarrage
+        rows = await self._db_call(pending)
+        for event_id, user_id in rows:
+            self._dispatch(event_id, user_id)
+        if rows:
+            log_event("webhooks_requeued", events=len(rows))
+
+    async def stop(self):
+        tasks = list(self._lane_tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._writer.shutdown(wait=True)
+
+
+webhook_queue = WebhookQueue()
+
+
+async def _activate_premium(user_id: Optional[str], payload: dict):
+    if user_id and db:
+        await update_user(user_id, {"is_premium": True, "energy": 999})
+
+
+webhook_queue.register("order_created", _activate_premium)
+webhook_queue.register("subscription_created", _activate_premium)
+
+
+router = APIRouter()
+
+
+@router.post("/lemon")
+async def lemon_webhook(request: Request):
+    if not LEMON_WEBHOOK_SECRET: return {"error": "No secret"}
+    body = await request.body()
+    signature = request.headers.get("X-Signature") or ""
+    expected = hmac.new(LEMON_WEBHOOK_SECRET.encode(), body, hashlib.sha256).hexdigest()
+    if not hmac.compare_digest(signature, expected): raise HTTPException(401, "Invalid signature")
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        raise HTTPException(400, "Invalid JSON")
+    # Accusé de réception immédiat : l'événement est appliqué en arrière-plan
+    queued = await webhook_queue.enqueue(body, payload)
+    return {"received": True, "duplicate": not queued}
+
+
+@router.get("/lemon/events")
+async def list_lemon_events(status: Optional[str] = None, limit: int = 50, x_admin_password: Optional[str] = Header(None)):
+    _require_admin(x_admin_password)
+    return {"events": await webhook_queue.list(status, max(1, min(limit, 500)))}
+
+
+@router.post("/lemon/replay")
+async def replay_lemon_events(event_id: Optional[str] = None, x_admin_password: Optional[str] = Header(None)):
+    """Queue failed events again (all of them, or only `event_id`, which may also be a done event)."""
+    _require_admin(x_admin_password)
+    replayed = await webhook_queue.replay(event_id)
+    if event_id and not replayed:
+        raise HTTPException(status_code=404, detail="Event not found or still pending")
+    return {"replayed": replayed}
@@ -0,0 +1,13 @@
+"""
+Run from backend/: python -m pytest -q tests
+"""
+import os
+import sys
+import tempfile
+
+# Avant tout import de src.studia : les stores SQLite et le cache disque vont dans un dossier jetable
+os.environ.setdefault("STUDIA_DATA_DIR", tempfile.mkdtemp(prefix="studia-tests-"))
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,148 @@
+import asyncio
+import hashlib
+import hmac
+import time
+
+import pytest
+
+from src.studia import admission
+from src.studia.admission import AdmissionClass, Rejected, TokenBucket, client_ip, verify_user_token
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(admission.time, "monotonic", clock)
+    return clock
+
+
+def test_bucket_allows_a_burst_then_asks_to_wait(clock):
+    bucket = TokenBucket(rate=2, burst=3)
+    assert [bucket.take(1) for _ in range(3)] == [0, 0, 0]
+    assert bucket.take(1) == pytest.approx(0.5)
+    clock.now += 0.5
+    assert bucket.take(1) == 0
+    clock.now += 60
+    bucket._refill()
+    assert bucket.tokens == 3  # jamais au-delà du burst
+
+
+def test_bucket_charge_goes_into_debt(clock):
+    bucket = TokenBucket(rate=1, burst=4)
+    bucket.charge(6)
+    assert bucket.tokens == -2
+    assert bucket.take(1) == pytest.approx(3)
+    clock.now += 3
+    assert bucket.take(1) == 0
+
+
+def test_rate_limit_is_per_user(clock):
+    lane = AdmissionClass("t", in_flight=10, rate_per_min=60, burst=2)
+
+    async def run():
+        await lane.acquire("alice", 2, 1)
+        with pytest.raises(Rejected) as error:
+            await lane.acquire("alice", 1, 1)
+        await lane.acquire("bob", 1, 1)
+        return error.value
+
+    error = asyncio.run(run())
+    assert error.status_code == 429
+    assert error.retry_after == pytest.approx(1)
+
+
+def test_weighted_fair_queue_order():
+    lane = AdmissionClass("wfq", in_flight=1, rate_per_min=6000, burst=100, max_wait=60)
+    lane._service_time = 0.01
+    order = []
+
+    async def request(user, weight):
+        await lane.acquire(user, 1, weight)
+        order.append(user)
+
+    async def run():
+        await lane.acquire("holder", 1, 1)
+        tasks = []
+        # alice en rafale, puis bob, puis un premium (poids 4) arrivé en dernier
+        for user, weight in [("alice", 1), ("alice", 1), ("alice", 1), ("bob", 1), ("premium", 4)]:
+            tasks.append(asyncio.create_task(request(user, weight)))
+            await asyncio.sleep(0)
+        assert lane.stats()["queued"] == 5
+        for _ in tasks:
+            lane.release()
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+
+    asyncio.run(run())
+    assert order == ["premium", "alice", "bob", "alice", "alice"]
+    assert lane.in_flight == 1
+
+
+def test_overload_is_refused_at_once_and_tokens_are_refunded():
+    lane = AdmissionClass("busy", in_flight=1, rate_per_min=60, burst=5, max_wait=1)
+    lane._service_time = 5
+
+    async def run():
+        await lane.acquire("holder", 1, 1)
+        with pytest.raises(Rejected) as error:
+            await lane.acquire("alice", 2, 1)
+        return error.value
+
+    error = asyncio.run(run())
+    assert error.status_code == 503
+    assert lane._buckets["alice"].tokens == pytest.approx(5, abs=0.1)
+    assert lane.stats()["queued"] == 0
+
+
+def test_cancelled_waiter_does_not_take_the_slot():
+    lane = AdmissionClass("cancel", in_flight=1, rate_per_min=6000, burst=100, max_wait=60)
+    lane._service_time = 0.01
+
+    async def run():
+        await lane.acquire("holder", 1, 1)
+        gone = asyncio.create_task(lane.acquire("gone", 1, 1))
+        stays = asyncio.create_task(lane.acquire("stays", 1, 1))
+        await asyncio.sleep(0)
+        gone.cancel()
+        await asyncio.gather(gone, return_exceptions=True)
+        lane.release()
+        await asyncio.wait_for(stays, 1)
+
+    asyncio.run(run())
+    assert lane.in_flight == 1
+
+
+def test_client_ip_walks_past_trusted_proxies(monkeypatch):
+    monkeypatch.setattr(admission, "TRUSTED_PROXIES", ["10.0.0.0/8"])
+    assert client_ip("10.1.2.3", "6.6.6.6, 1.2.3.4, 10.9.9.9") == "1.2.3.4"
+    assert client_ip("10.1.2.3", "10.2.2.2") == "10.2.2.2"
+    # Pair non fiable : l'en-tête est écrit par le client, on l'ignore
+    assert client_ip("5.5.5.5", "1.2.3.4") == "5.5.5.5"
+    assert client_ip(None, "1.2.3.4") == "?"
+
+    monkeypatch.setattr(admission, "TRUSTED_PROXIES", ["*"])
+    assert client_ip("172.16.0.1", "6.6.6.6, 1.2.3.4") == "1.2.3.4"
+
+
+def test_user_token_signature_and_expiry(monkeypatch):
+    monkeypatch.setattr(admission, "ADMISSION_USER_SECRET", "s3cret")
+
+    def token(user_id, expires, secret="s3cret"):
+        signature = hmac.new(secret.encode(), f"{user_id}:{expires}".encode(), hashlib.sha256).hexdigest()
+        return f"{user_id}:{expires}:{signature}"
+
+    later = int(time.time()) + 60
+    assert verify_user_token(token("user_2abc", later)) == "user_2abc"
+    assert verify_user_token(token("user_2abc", later, secret="other")) is None
+    assert verify_user_token(token("user_2abc", int(time.time()) - 1)) is None
+    assert verify_user_token(token("user_2abc", later).replace("user_2abc", "user_evil")) is None
+    assert verify_user_token("garbage") is None
+    assert verify_user_token(None) is None
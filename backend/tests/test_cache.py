@@ -0,0 +1,99 @@
+import asyncio
+import time
+
+import pytest
+
+from src.studia import cache
+from src.studia.cache import TieredCache, make_key
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, "STUDIA_DATA_DIR", str(tmp_path))
+    return tmp_path
+
+
+def disk_totals(c):
+    return c._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+
+
+def test_make_key_is_stable_and_order_independent():
+    assert make_key("chat", {"a": 1, "b": [1, 2]}) == make_key("chat", {"b": [1, 2], "a": 1})
+    assert make_key("chat", "x") != make_key("chat", "y")
+
+
+def test_disk_size_tracking_matches_the_table(data_dir):
+    c = TieredCache("acct", memory_max_bytes=0, disk_max_bytes=1000)
+
+    async def run():
+        await c.set("a", "x" * 100)
+        await c.set("b", "é" * 100)       # 200 octets en UTF-8
+        await c.set("a", "y" * 50)        # réécriture : l'ancienne taille est retirée
+        await c.set("c", "z" * 10, ttl=-1)  # déjà expirée, purgée à l'écriture suivante
+        await c.set("d", "w" * 30)
+
+    asyncio.run(run())
+    stats = c.stats()
+    assert (stats["disk_entries"], stats["disk_bytes"]) == disk_totals(c) == (3, 280)
+
+
+def test_disk_tier_evicts_least_recently_accessed(data_dir):
+    c = TieredCache("lru", memory_max_bytes=0, disk_max_bytes=300)
+
+    async def run():
+        for key in "abc":
+            await c.set(key, key * 100)
+            time.sleep(0.002)
+        assert await c.get("a") == "a" * 100  # "a" redevient récent
+        time.sleep(0.002)
+        await c.set("d", "d" * 100)
+        return [await c.get(key) is not None for key in "abcd"]
+
+    assert asyncio.run(run()) == [True, False, True, True]
+    assert c.stats()["disk_bytes"] == disk_totals(c)[1] == 300
+
+
+def test_values_larger_than_a_tier_skip_it(data_dir):
+    c = TieredCache("big", memory_max_bytes=10, disk_max_bytes=50)
+    asyncio.run(c.set("k", "x" * 60))
+    assert c.stats()["memory_entries"] == c.stats()["disk_entries"] == 0
+
+
+def test_disk_totals_are_reloaded_after_restart(data_dir):
+    first = TieredCache("restart", memory_max_bytes=0, disk_max_bytes=10_000)
+    asyncio.run(first.set("k1", "v" * 40))
+    asyncio.run(first.set("k2", "v" * 60))
+    second = TieredCache("restart", memory_max_bytes=0, disk_max_bytes=10_000)
+    assert (second.stats()["disk_entries"], second.stats()["disk_bytes"]) == (2, 100)
+    assert asyncio.run(second.get("k2")) == "v" * 60
+    assert second.stats()["disk_hits"] == 1
+
+
+def test_memory_tier_is_lru_bounded_by_bytes(data_dir):
+    c = TieredCache("mem", memory_max_bytes=250, disk_max_bytes=0)
+
+    async def run():
+        await c.set("a", "a" * 100)
+        await c.set("b", "b" * 100)
+        await c.get("a")
+        await c.set("c", "c" * 100)
+        return [await c.get(key) for key in "abc"]
+
+    assert asyncio.run(run()) == ["a" * 100, None, "c" * 100]
+    assert c.stats()["memory_bytes"] == 200
+    assert c.stats()["memory_hits"] == 3 and c.stats()["misses"] == 1
+
+
+def test_expired_entries_are_misses_in_both_tiers(data_dir):
+    c = TieredCache("ttl", memory_max_bytes=1000, disk_max_bytes=1000)
+    asyncio.run(c.set("k", "v", ttl=-1))
+    assert asyncio.run(c.get("k")) is None
+    assert c.stats()["misses"] == 1
+    assert c.stats()["disk_entries"] == disk_totals(c)[0] == 0
+
+
+def test_disabled_cache_stores_nothing(data_dir):
+    c = TieredCache("off", enabled=False)
+    asyncio.run(c.set("k", "v"))
+    assert asyncio.run(c.get("k")) is None
+    assert not list(data_dir.iterdir())
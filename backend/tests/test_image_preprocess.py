@@ -0,0 +1,83 @@
+import base64
+import io
+
+import pytest
+from PIL import Image, ImageDraw
+
+from src.studia.image_preprocess import preprocess_image, vision_tokens
+
+
+def encode(img, fmt="PNG", **params):
+    buffer = io.BytesIO()
+    img.save(buffer, fmt, **params)
+    return base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+def page(width, height, line_height, margin, background=235):
+    """Grey page with dark 'words' (blocks) laid out in lines, inside blank margins."""
+    img = Image.new("L", (width, height), background)
+    draw = ImageDraw.Draw(img)
+    for y in range(margin, height - margin - line_height, line_height * 2):
+        for x in range(margin, width - margin - 60, 60):
+            draw.rectangle([x, y, x + 45, y + line_height], fill=20)
+    return img
+
+
+def decoded_size(result):
+    return Image.open(io.BytesIO(base64.b64decode(result["base64"]))).size
+
+
+def test_vision_token_estimate():
+    assert vision_tokens(512, 512) == 85 + 170
+    assert vision_tokens(1024, 1024) == 85 + 170 * 4  # ramené à 768x768 par le modèle
+    assert vision_tokens(4000, 1000) == 85 + 170 * 4  # 2048x512
+    assert vision_tokens(1024, 1024, "low") == vision_tokens(0, 0) == 85
+
+
+def test_large_text_uses_a_single_low_detail_view():
+    result = preprocess_image(encode(page(1600, 1200, line_height=60, margin=40)))
+    assert result["detail"] == "low"
+    assert max(decoded_size(result)) <= 512
+    assert result["tokens_after"] == 85 < result["tokens_before"]
+
+
+@pytest.mark.parametrize("width, height", [(2400, 3200), (3200, 2400), (900, 4000)])
+def test_small_text_stays_high_detail_without_extra_tiles(width, height):
+    result = preprocess_image(encode(page(width, height, line_height=10, margin=150)))
+    assert result["detail"] == "high"
+    assert result["cropped"]
+    assert result["tokens_after"] <= result["tokens_before"]
+    assert decoded_size(result) == (result["width"], result["height"])
+
+
+def test_margins_are_cropped():
+    img = Image.new("L", (2000, 2000), 240)
+    ImageDraw.Draw(img).rectangle([800, 800, 1200, 1200], fill=0)
+    result = preprocess_image(encode(img))
+    assert result["cropped"]
+    width, height = decoded_size(result)
+    assert abs(width - height) <= 2 and width <= 512
+
+
+def test_exif_orientation_is_applied():
+    exif = Image.Exif()
+    exif[0x0112] = 6  # rotation de 90°
+    result = preprocess_image(encode(page(1200, 800, line_height=40, margin=20).convert("RGB"), "JPEG", exif=exif))
+    assert result["rotated"]
+    width, height = decoded_size(result)
+    assert height > width
+
+
+def test_already_small_image_is_sent_as_is():
+    original = encode(Image.new("L", (40, 40), 255))
+    result = preprocess_image(original)
+    assert result["base64"] == original
+    assert result["mime_type"] == "image/png"
+    assert result["bytes_after"] == result["bytes_before"]
+
+
+@pytest.mark.parametrize("payload", ["not base64!!", base64.b64encode(b"hello").decode()])
+def test_unreadable_input_passes_through(payload):
+    result = preprocess_image(payload)
+    assert result["base64"] == payload
+    assert result["detail"] == "auto"
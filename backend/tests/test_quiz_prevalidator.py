@@ -0,0 +1,102 @@
+from src.studia.quiz_prevalidator import prevalidate_quiz
+
+COURSE = """
+# La photosynthèse
+La photosynthèse convertit l'énergie lumineuse en énergie chimique dans les chloroplastes.
+La chlorophylle absorbe la lumière rouge et bleue.
+La respiration cellulaire libère l'énergie du glucose dans les mitochondries.
+"""
+
+
+def question(text, answer_text, correct=0, explanation="La chlorophylle absorbe la lumière rouge et bleue."):
+    options = ["Le noyau", "Les ribosomes", "La paroi"]
+    options.insert(correct, answer_text)
+    return {"question": text, "options": options, "correctAnswer": correct, "explanation": explanation}
+
+
+def grounded_quiz():
+    return {"questions": [
+        question("Où a lieu la photosynthèse ?", "Dans les chloroplastes", 0),
+        question("Que convertit la photosynthèse ?", "L'énergie lumineuse en énergie chimique", 1),
+        question("Quelle lumière absorbe la chlorophylle ?", "La lumière rouge et bleue", 2),
+        question("Où la respiration libère-t-elle l'énergie ?", "Dans les mitochondries", 3),
+    ]}
+
+
+def issues_for(result, index):
+    return [issue["issue"] for issue in result["issues"] if issue["question_index"] == index]
+
+
+def test_grounded_quiz_passes():
+    result = prevalidate_quiz(COURSE, grounded_quiz(), num_questions=4)
+    assert result["is_valid"]
+    assert result["accuracy_score"] == 100
+    assert result["issues"] == []
+
+
+def test_structural_defects_are_high_severity():
+    quiz = grounded_quiz()
+    quiz["questions"][0]["options"] = ["a", "b", "c"]
+    quiz["questions"][1]["correctAnswer"] = 4
+    quiz["questions"][2]["question"] = "  "
+    quiz["questions"][3]["correctAnswer"] = True
+    result = prevalidate_quiz(COURSE, quiz)
+    assert not result["is_valid"]
+    assert result["accuracy_score"] == 0
+    assert all(issues_for(result, i) for i in range(4))
+    assert {issue["severity"] for issue in result["issues"]} == {"high"}
+
+
+def test_unhashable_correct_answer_is_reported_not_raised():
+    quiz = grounded_quiz()
+    quiz["questions"][0]["correctAnswer"] = [0]
+    quiz["questions"][1]["correctAnswer"] = {"index": 1}
+    result = prevalidate_quiz(COURSE, quiz)
+    assert issues_for(result, 0) == ["correctAnswer must be an index between 0 and 3"]
+    assert issues_for(result, 1) == ["correctAnswer must be an index between 0 and 3"]
+
+
+def test_duplicate_options_and_questions():
+    quiz = grounded_quiz()
+    quiz["questions"][0]["options"][1] = "dans les CHLOROPLASTES"
+    quiz["questions"][3] = dict(quiz["questions"][2])
+    result = prevalidate_quiz(COURSE, quiz)
+    assert "Duplicate options" in issues_for(result, 0)
+    assert "Duplicate of question 2" in issues_for(result, 3)
+    assert not result["is_valid"]
+
+
+def test_answer_not_grounded_in_course():
+    quiz = grounded_quiz()
+    quiz["questions"][0]["options"][0] = "Grâce aux photons quantiques interstellaires"
+    result = prevalidate_quiz(COURSE, quiz)
+    assert any("weakly grounded" in issue for issue in issues_for(result, 0))
+    assert result["accuracy_score"] == 75
+
+
+def test_missing_explanation_is_low_severity():
+    quiz = grounded_quiz()
+    quiz["questions"][0]["explanation"] = ""
+    result = prevalidate_quiz(COURSE, quiz)
+    assert result["is_valid"]
+    assert issues_for(result, 0) == ["Missing explanation"]
+    assert result["accuracy_score"] == 95
+
+
+def test_answer_position_spread_and_count():
+    quiz = grounded_quiz()
+    for q in quiz["questions"]:
+        answer = q["options"].pop(q["correctAnswer"])
+        q["options"].insert(0, answer)
+        q["correctAnswer"] = 0
+    result = prevalidate_quiz(COURSE, quiz, num_questions=5)
+    global_issues = issues_for(result, None)
+    assert "correctAnswer is 0 for 4/4 questions" in global_issues
+    assert "Expected 5 questions, got 4" in global_issues
+    assert result["accuracy_score"] == 85
+
+
+def test_empty_quiz():
+    result = prevalidate_quiz(COURSE, {"questions": []})
+    assert not result["is_valid"]
+    assert result["accuracy_score"] == 0
@@ -0,0 +1,121 @@
+import asyncio
+
+import pytest
+
+from src.studia import retrieval
+from src.studia.retrieval import BM25Index, build_index, chunk_markdown, estimate_tokens, select_context
+
+COURSE = """# Biologie
+
+Introduction générale.
+
+## La photosynthèse
+
+Les chloroplastes captent la lumière. La chlorophylle absorbe le rouge et le bleu.
+
+### Phase claire
+
+La phase claire produit de l'ATP dans les thylakoïdes.
+
+```python
+# pas un titre
+x = 1
+```
+
+## La respiration
+
+Les mitochondries oxydent le glucose et libèrent de l'énergie.
+"""
+
+
+def test_chunks_follow_header_path():
+    chunks = chunk_markdown(COURSE)
+    assert [c.heading for c in chunks] == [
+        "Biologie",
+        "Biologie > La photosynthèse",
+        "Biologie > La photosynthèse > Phase claire",
+        "Biologie > La respiration",
+    ]
+    assert [c.index for c in chunks] == list(range(4))
+    # Un "#" dans un bloc de code n'ouvre pas de section
+    assert "# pas un titre" in chunks[2].text
+    assert chunks[3].text.startswith("## La respiration")
+
+
+def test_header_only_sections_are_dropped():
+    chunks = chunk_markdown("# Titre\n## Sous-titre\n\nContenu.")
+    assert [(c.heading, c.text) for c in chunks] == [("Titre > Sous-titre", "## Sous-titre\n\nContenu.")]
+
+
+def test_long_sections_are_split_under_the_budget():
+    paragraphs = "\n\n".join(f"Paragraphe {i} " + "mot " * 60 for i in range(20))
+    chunks = chunk_markdown(f"# Long\n\n{paragraphs}", max_tokens=100)
+    assert len(chunks) > 1
+    assert all(c.tokens <= 100 for c in chunks)
+    assert all(c.heading == "Long" for c in chunks)
+    assert "".join(c.text for c in chunks).count("Paragraphe") == 20
+
+
+def test_unbroken_text_is_hard_cut():
+    chunks = chunk_markdown("# Bloc\n\n" + "x" * 5000, max_tokens=100)
+    assert all(len(c.text) <= 400 for c in chunks)
+
+
+def test_bm25_ranks_the_matching_section_first():
+    index = build_index(COURSE)
+    (best, score), *rest = index.search("Où sont oxydées les molécules de glucose ?")
+    assert best.heading == "Biologie > La respiration"
+    assert score > 0 and all(other < score for _, other in rest)
+
+
+def test_bm25_indexes_headings_and_folds_accents():
+    index = build_index(COURSE)
+    assert index.search("PHOTOSYNTHESE")[0][0].heading.startswith("Biologie > La photosynthèse")
+    assert index.search("zèbre quantique") == []
+    assert len(index.search("photosynthèse", k=1)) == 1
+
+
+def test_bm25_rare_terms_weigh_more():
+    chunks = chunk_markdown("# A\n\nchat chien\n\n# B\n\nchat\n\n# C\n\nchat")
+    index = BM25Index(chunks)
+    assert index.search("chat chien")[0][0].heading == "A"
+    assert index._idf["chien"] > index._idf["chat"]
+
+
+def test_select_context_returns_short_courses_untouched():
+    assert asyncio.run(select_context(COURSE, "glucose", max_tokens=10_000)) == COURSE
+
+
+def test_select_context_keeps_relevant_sections_in_document_order():
+    filler = "\n\n".join(f"## Chapitre {i}\n\n" + "remplissage " * 80 for i in range(10))
+    course = f"# Cours\n\n{filler}\n\n## Mitochondries\n\nLes mitochondries oxydent le glucose."
+    context = asyncio.run(select_context(course, "glucose mitochondries", max_tokens=300))
+    assert "Les mitochondries oxydent le glucose." in context
+    assert estimate_tokens(context) <= 300 + 10
+
+
+def test_get_index_builds_once_for_concurrent_callers(monkeypatch):
+    builds = []
+
+    def counting_build(text):
+        builds.append(text)
+        return build_index(text)
+
+    monkeypatch.setattr(retrieval, "build_index", counting_build)
+    retrieval._index_cache.clear()
+
+    async def run():
+        results = await asyncio.gather(*(retrieval.get_index(COURSE) for _ in range(5)))
+        again = await retrieval.get_index(key=results[0][0])
+        return results, again
+
+    results, again = asyncio.run(run())
+    assert len(builds) == 1
+    assert len({id(index) for _, index in results}) == 1
+    assert again[1] is results[0][1]
+
+
+def test_get_index_without_text_or_stored_course_fails():
+    retrieval._index_cache.clear()
+    with pytest.raises(LookupError):
+        asyncio.run(retrieval.get_index())
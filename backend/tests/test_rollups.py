@@ -0,0 +1,108 @@
+import asyncio
+from datetime import date
+
+import pytest
+
+from src.studia import rollups as rollups_module
+from src.studia.rollups import HyperLogLog, Rollups
+
+
+@pytest.mark.parametrize("n", [0, 1, 10, 1_000, 50_000])
+def test_hyperloglog_estimate_is_within_error(n):
+    sketch = HyperLogLog(p=14)
+    for i in range(n):
+        sketch.add(f"user-{i}")
+    # erreur type ~0.8 % à p=14 ; exact en petite cardinalité (comptage linéaire)
+    assert abs(sketch.count() - n) <= max(1, 0.03 * n)
+
+
+def test_hyperloglog_ignores_duplicates():
+    sketch = HyperLogLog(p=10)
+    for _ in range(5):
+        for i in range(300):
+            sketch.add(f"u{i}")
+    assert abs(sketch.count() - 300) <= 15
+
+
+def test_hyperloglog_merge_is_a_union():
+    a, b, both = HyperLogLog(p=12), HyperLogLog(p=12), HyperLogLog(p=12)
+    for i in range(3000):
+        a.add(f"u{i}")
+        both.add(f"u{i}")
+    for i in range(2000, 6000):
+        b.add(f"u{i}")
+        both.add(f"u{i}")
+    assert a.merge(b).registers == both.registers
+    assert abs(a.count() - 6000) <= 0.05 * 6000
+
+
+def test_hyperloglog_round_trips_through_bytes():
+    sketch = HyperLogLog(p=8)
+    for i in range(500):
+        sketch.add(str(i))
+    assert HyperLogLog(p=8, registers=bytes(sketch.registers)).count() == sketch.count()
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(rollups_module, "STUDIA_DATA_DIR", str(tmp_path))
+    store = Rollups(enabled=True)
+    yield store
+    asyncio.run(store.stop())
+
+
+def event(user, day, event_type="page_view", **data):
+    return {"user_id": user, "created_at": f"{day}T12:00:00Z", "event_type": event_type, "event_data": data}
+
+
+def test_summary_counts_users_features_sessions_and_retention(store):
+    asyncio.run(store.ingest([
+        event("a", "2026-10-01"), event("b", "2026-10-01"), event("c", "2026-10-01"),
+        event("a", "2026-10-02", "feature_use", feature="quiz"),
+        event("a", "2026-10-02", "feature_use", feature="quiz"),
+        event("b", "2026-10-03", "feature_use", feature="chat"),
+        event("c", "2026-10-02", "session_end", duration_seconds=120),
+        event("c", "2026-10-02", "session_end", duration_seconds="bad"),
+        event(None, "2026-10-02"),
+    ]))
+    summary = asyncio.run(store.summary(days=7, today=date(2026, 10, 4)))
+    assert summary["wau"] == 3
+    assert [d["active_users"] for d in summary["daily"][-4:]] == [3, 2, 1, 0]
+    assert summary["features"] == [{"feature": "quiz", "count": 2}, {"feature": "chat", "count": 1}]
+    assert summary["sessions"] == 1 and summary["avg_session_seconds"] == 120.0
+    # Cohorte du 1er : a et c reviennent le 2, b seulement le 3
+    assert summary["cohorts"] == [{"day": "2026-10-01", "new_users": 3, "returned_d1": 2}]
+    assert summary["retention_d1"] == round(2 / 3, 4)
+
+
+def test_backdated_event_moves_first_seen_earlier(store):
+    asyncio.run(store.ingest([event("a", "2026-10-05")]))
+    asyncio.run(store.ingest([event("a", "2026-10-04")]))
+    asyncio.run(store.ingest([event("b", "2026-10-05")]))
+    asyncio.run(store.ingest([event("b", "2026-10-02")]))
+    rows = dict(((user, (day, back)) for user, day, back in store._db.execute("SELECT * FROM first_seen")))
+    assert rows == {"a": ("2026-10-04", 1), "b": ("2026-10-02", 0)}
+
+
+def test_backfill_replays_existing_events_once(store, monkeypatch):
+    history = [
+        {"id": i + 1, "user_id": f"u{i % 4}", "created_at": f"2026-10-0{1 + i % 2}T08:00:00Z"} for i in range(10)
+    ]
+    pages = []
+
+    async def events_after(last_id, limit):
+        pages.append(last_id)
+        return [row for row in history if row["id"] > last_id][:limit]
+
+    monkeypatch.setattr(rollups_module, "events_after", events_after)
+    # Un événement live arrivé avant la fin du rattrapage ne fausse pas les cohortes
+    asyncio.run(store.ingest([event("u0", "2026-10-03")]))
+    asyncio.run(store.backfill(page_size=3))
+    asyncio.run(store.backfill(page_size=3))
+
+    assert pages == [0, 3, 6, 9]
+    summary = asyncio.run(store.summary(days=3, today=date(2026, 10, 3)))
+    assert summary["daily"][0]["active_users"] == 2  # u0 et u2 le 1er
+    assert summary["daily"][1]["active_users"] == 2  # u1 et u3 le 2
+    days = dict(store._db.execute("SELECT user_id, day FROM first_seen"))
+    assert days == {"u0": "2026-10-01", "u1": "2026-10-02", "u2": "2026-10-01", "u3": "2026-10-02"}
@@ -0,0 +1,90 @@
+import asyncio
+import json
+
+from src.studia import quiz_generator
+from src.studia.quiz_generator import QuestionStreamParser
+
+
+def question(text, answer=0):
+    return {"question": text, "options": ["a", "b", "c", "d"], "correctAnswer": answer, "explanation": "…"}
+
+
+def feed_all(parser, document, size):
+    found = []
+    for start in range(0, len(document), size):
+        found.extend(parser.feed(document[start:start + size]))
+    return found
+
+
+def test_questions_come_out_as_soon_as_they_close():
+    parser = QuestionStreamParser()
+    assert parser.feed('{"questions": [{"question": "Q1", ') == []
+    assert parser.feed('"options": []}, {"ques') == [{"question": "Q1", "options": []}]
+    assert parser.feed('tion": "Q2"}]}') == [{"question": "Q2"}]
+
+
+def test_any_chunking_gives_the_same_questions():
+    questions = [question("Q1"), question("Q2", 2), question("Q3", 3)]
+    document = json.dumps({"title": "t", "questions": questions}, ensure_ascii=False, indent=2)
+    for size in (1, 2, 7, 64, len(document)):
+        assert feed_all(QuestionStreamParser(), document, size) == questions
+
+
+def test_braces_quotes_and_brackets_inside_strings():
+    tricky = question('Que vaut {x} dans "f(x) = [x]" ? \\ }')
+    document = json.dumps({"questions": [tricky, question("Q2")]})
+    assert feed_all(QuestionStreamParser(), document, 3) == [tricky, question("Q2")]
+
+
+def test_nested_objects_stay_inside_their_question():
+    nested = {"question": "Q", "meta": {"source": {"page": 1}}, "options": [{"a": 1}]}
+    assert QuestionStreamParser().feed(json.dumps({"questions": [nested]})) == [nested]
+
+
+def test_text_before_the_array_and_after_it_is_ignored():
+    parser = QuestionStreamParser()
+    assert parser.feed('{"intro": {"question": "pas ici"}, ') == []
+    assert parser.feed('"questions": [{"question": "Q1"}], "extra": [{"question": "Q9"}]}') == [{"question": "Q1"}]
+    assert parser.feed('{"question": "Q10"}') == []
+
+
+def test_malformed_object_is_skipped():
+    document = '{"questions": [{"question": "Q1",}, {"question": "Q2"}]}'
+    assert QuestionStreamParser().feed(document) == [{"question": "Q2"}]
+
+
+def test_custom_key():
+    assert QuestionStreamParser("flashcards").feed('{"flashcards": [{"front": "f"}]}') == [{"front": "f"}]
+
+
+def test_stream_skips_malformed_questions_and_rejects_malformed_rewrites(monkeypatch):
+    good = [question("Q1"), question("Q2", 1), question("Q3", 2)]
+    document = json.dumps({"questions": [good[0], {"question": "sans options"}, good[1], good[2]]})
+
+    async def fake_stream(**kwargs):
+        for start in range(0, len(document), 5):
+            yield document[start:start + 5]
+
+    async def fake_validate(course_text, quiz_data, num_questions=None):
+        return {"is_valid": False, "accuracy_score": 40, "issues": [], "validation_path": "llm"}
+
+    async def fake_refine(course_text, quiz_data, validation_result):
+        rewrite = [question("R1"), {"question": "R2", "options": ["a"], "correctAnswer": 0}, question("R3"), question("R4")]
+        return {"questions": rewrite, "refined_indices": None, "failed": {}}
+
+    monkeypatch.setattr(quiz_generator, "stream_completion", fake_stream)
+    monkeypatch.setattr(quiz_generator, "validate_quiz", fake_validate)
+    monkeypatch.setattr(quiz_generator, "refine_quiz", fake_refine)
+
+    async def run():
+        return [event async for event in quiz_generator.stream_quiz_from_text("cours", 3, "medium", True, True)]
+
+    events = asyncio.run(run())
+    streamed = [e["data"]["question"]["question"] for e in events if e["event"] == "question"]
+    replaced = [(e["data"]["index"], e["data"]["question"]["question"]) for e in events if e["event"] == "replaced"]
+    done = events[-1]["data"]
+    assert streamed == ["Q1", "Q2", "Q3"]
+    assert done["metadata"]["quiz_quality"]["skipped_questions"] == 1
+    # R2 n'a que 1 option : Q2 est gardée et R4 est ajoutée à la suite
+    assert replaced == [(0, "R1"), (2, "R3"), (3, "R4")]
+    assert [q["question"] for q in done["questions"]] == ["R1", "Q2", "R3", "R4"]
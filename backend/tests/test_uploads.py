@@ -0,0 +1,103 @@
+import asyncio
+import base64
+
+import pytest
+from starlette.requests import Request
+
+from src.studia.uploads import MAX_FIELD_BYTES, UploadError, parse_upload
+
+BOUNDARY = "studia-boundary"
+
+
+def multipart(*parts):
+    body = b""
+    for name, value, filename in parts:
+        disposition = f'form-data; name="{name}"' + (f'; filename="{filename}"' if filename else "")
+        body += f"--{BOUNDARY}\r\nContent-Disposition: {disposition}\r\n".encode()
+        if filename:
+            body += b"Content-Type: image/png\r\n"
+        body += b"\r\n" + value + b"\r\n"
+    return body + f"--{BOUNDARY}--\r\n".encode()
+
+
+def request(body, chunk_size=1000, content_type=f"multipart/form-data; boundary={BOUNDARY}", content_length=True):
+    chunks = [body[i:i + chunk_size] for i in range(0, len(body), chunk_size)] or [b""]
+    messages = [{"type": "http.request", "body": c, "more_body": i < len(chunks) - 1} for i, c in enumerate(chunks)]
+
+    async def receive():
+        return messages.pop(0)
+
+    headers = [(b"content-type", content_type.encode())]
+    if content_length:
+        headers.append((b"content-length", str(len(body)).encode()))
+    return Request({"type": "http", "method": "POST", "path": "/", "headers": headers}, receive)
+
+
+def parse(body, **kwargs):
+    options = {k: kwargs.pop(k) for k in ("chunk_size", "content_type", "content_length") if k in kwargs}
+    return asyncio.run(parse_upload(request(body, **options), **kwargs))
+
+
+def test_files_and_fields_survive_any_chunking():
+    page1, page2 = bytes(range(256)) * 40, b"\x89PNG" + b"\r\n--x" * 500
+    body = multipart(("num_questions", b"7", None), ("pages", page1, "p1.png"), ("pages", page2, "p2.png"))
+    for chunk_size in (1, 13, 4096, len(body)):
+        form = parse(body, chunk_size=chunk_size)
+        try:
+            assert form.fields == {"num_questions": "7"}
+            assert [(p.name, p.filename, p.content_type, p.size) for p in form.files] == [
+                ("pages", "p1.png", "image/png", len(page1)), ("pages", "p2.png", "image/png", len(page2)),
+            ]
+            assert base64.b64decode(form.files[0].read_base64()) == page1
+            assert base64.b64decode(form.files[1].read_base64()) == page2
+        finally:
+            form.close()
+
+
+def test_rejects_other_content_types():
+    with pytest.raises(UploadError) as error:
+        parse(b"{}", content_type="application/json")
+    assert error.value.status_code == 415
+
+
+def test_declared_length_over_the_limit_is_refused_before_reading():
+    with pytest.raises(UploadError) as error:
+        parse(multipart(("pages", b"x" * 200, "p.png")), max_total_bytes=100)
+    assert error.value.status_code == 413
+
+
+def test_total_limit_is_enforced_while_streaming_without_content_length():
+    body = multipart(("pages", b"x" * 600, "a.png"), ("pages", b"y" * 600, "b.png"))
+    with pytest.raises(UploadError) as error:
+        parse(body, content_length=False, chunk_size=100, max_total_bytes=1000)
+    assert error.value.status_code == 413
+    assert "Upload too large" in error.value.detail
+
+
+def test_page_size_limit():
+    body = multipart(("pages", b"x" * 100, "small.png"), ("pages", b"y" * 300, "big.png"))
+    with pytest.raises(UploadError) as error:
+        parse(body, chunk_size=64, max_file_bytes=200)
+    assert error.value.status_code == 413
+    assert "big.png" in error.value.detail
+
+
+def test_page_count_limit():
+    body = multipart(*[("pages", b"x", f"{i}.png") for i in range(4)])
+    with pytest.raises(UploadError) as error:
+        parse(body, max_files=3)
+    assert error.value.status_code == 413
+    assert parse(body, max_files=4).files[3].filename == "3.png"
+
+
+def test_text_field_limit():
+    with pytest.raises(UploadError) as error:
+        parse(multipart(("course_text", b"a" * (MAX_FIELD_BYTES + 1), None)))
+    assert error.value.status_code == 413
+
+
+def test_truncated_body_is_a_bad_request():
+    body = multipart(("pages", b"x" * 10, "p.png"))
+    with pytest.raises(UploadError) as error:
+        parse(body.replace(f"--{BOUNDARY}\r\nContent".encode(), b"garbage\r\nContent", 1))
+    assert error.value.status_code == 400
@@ -0,0 +1,28 @@
+import { createHmac } from 'crypto';
+import { auth } from '@clerk/nextjs/server';
+import { NextResponse } from 'next/server';
+
+// Durée de vie du jeton X-User-Token (secondes)
+const TOKEN_TTL = 3600;
+
+/**
+ * Signed X-User-Token "<user_id>:<expires>:<hmac>" for the signed-in user.
+ * The API verifies it with the same ADMISSION_USER_SECRET (per-user rate
+ * limits, premium priority, questions already seen).
+ */
+export async function POST() {
+  const { userId } = await auth();
+  if (!userId) {
+    return NextResponse.json({ error: 'Not signed in' }, { status: 401 });
+  }
+
+  const secret = process.env.ADMISSION_USER_SECRET;
+  if (!secret) {
+    return NextResponse.json({ error: 'User tokens are not configured' }, { status: 503 });
+  }
+
+  const expires = Math.floor(Date.now() / 1000) + TOKEN_TTL;
+  const signature = createHmac('sha256', secret).update(`${userId}:${expires}`).digest('hex');
+
+  return NextResponse.json({ token: `${userId}:${expires}:${signature}`, expires_at: expires });
+}
@@ -11,6 +11,7 @@ import FlashcardViewer from '@/components/workspace/FlashcardViewer';
 import PracticeInterface from '@/components/workspace/PracticeInterface';
 import ReactMarkdown from 'react-markdown';
 import confetti from 'canvas-confetti';
+import { authHeaders } from '@/lib/api';
 
 export default function MasteryPage() {
   const params = useParams();
@@ -36,7 +37,7 @@ export default function MasteryPage() {
       setCourseText(course.extracted_text); // ✅ Stockage crucial
 
       const res = await fetch(`${API_URL}/api/path/generate`, {
-          method: 'POST', headers: { 'Content-Type': 'application/json' },
+          method: 'POST', headers: { 'Content-Type': 'application/json', ...(await authHeaders()) },
           body: JSON.stringify({ course_text: course.extracted_text, subject: course.subject })
       });
 
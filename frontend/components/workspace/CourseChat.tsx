@@ -3,6 +3,7 @@
 import { useState, useRef, useEffect } from 'react';
 import { Send, Bot, ArrowRight, User, Loader2 } from 'lucide-react';
 import ReactMarkdown from 'react-markdown';
+import { authHeaders } from '@/lib/api';
 
 interface Message {
   role: 'user' | 'assistant' | 'system';
@@ -21,8 +22,14 @@ export default function CourseChat({ courseText, courseTitle }: CourseChatProps)
   const [input, setInput] = useState('');
   const [isLoading, setIsLoading] = useState(false);
   const messagesEndRef = useRef<HTMLDivElement>(null);
+  // Le backend indexe le cours au premier message : ensuite on n'envoie plus que son hash
+  const courseHashRef = useRef<string | null>(null);
   const API_URL = process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8000';
 
+  useEffect(() => {
+    courseHashRef.current = null;
+  }, [courseText]);
+
   useEffect(() => {
     messagesEndRef.current?.scrollIntoView({ behavior: "smooth" });
   }, [messages, isLoading]);
@@ -38,16 +45,20 @@ export default function CourseChat({ courseText, courseTitle }: CourseChatProps)
     setIsLoading(true);
 
     try {
-      const res = await fetch(`${API_URL}/api/chat/tutor`, {
+      const ask = async (useHash: boolean) => fetch(`${API_URL}/api/chat/tutor`, {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: { 'Content-Type': 'application/json', ...(await authHeaders()) },
         body: JSON.stringify({
           message: userMsg,
           history: newHistory.filter(m => m.role !== 'system'),
-          course_context: courseText
+          ...(useHash ? { course_hash: courseHashRef.current } : { course_context: courseText })
         }),
       });
+      let res = await ask(!!courseHashRef.current);
+      if (res.status === 409) res = await ask(false); // index expiré côté serveur
+      if (!res.ok) throw new Error(`HTTP ${res.status}`);
       const data = await res.json();
+      courseHashRef.current = data.course_hash ?? null;
       setMessages(prev => [...prev, { role: 'assistant', content: data.reply }]);
     } catch {
       setMessages(prev => [...prev, { role: 'system', content: "Désolé, je n'arrive pas à répondre pour le moment. Vérifiez votre connexion." }]);
@@ -4,6 +4,7 @@ import { useState, useEffect } from 'react';
 import { ArrowRight, Loader2, Check, Trophy, Sparkles, RefreshCw } from 'lucide-react';
 import { addXp } from '@/lib/gamificationService';
 import { useUser } from '@clerk/nextjs';
+import { authHeaders } from '@/lib/api';
 
 export default function MotivatorWidget() {
   const { user } = useUser();
@@ -40,7 +41,7 @@ export default function MotivatorWidget() {
     setLoading(true);
     try {
         const res = await fetch(`${API_URL}/api/motivation/generate`, {
-            method: 'POST', headers: { 'Content-Type': 'application/json' },
+            method: 'POST', headers: { 'Content-Type': 'application/json', ...(await authHeaders()) },
             body: JSON.stringify({ goal, deadline, current_xp: 1200 }),
         });
         const data = await res.json();
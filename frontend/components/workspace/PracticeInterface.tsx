@@ -3,6 +3,7 @@
 import { useState } from 'react';
 import { Send, Bot, CheckCircle, XCircle, HelpCircle, ArrowRight, User , X } from 'lucide-react';
 import ReactMarkdown from 'react-markdown';
+import { authHeaders } from '@/lib/api';
 
 interface PracticeInterfaceProps {
   exercise: { instruction: string; context: string; difficulty: string };
@@ -30,7 +31,7 @@ export default function PracticeInterface({ exercise, courseText, onComplete }:
     try {
       const res = await fetch(`${API_URL}/api/path/evaluate`, {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: { 'Content-Type': 'application/json', ...(await authHeaders()) },
         body: JSON.stringify({
           instruction: exercise.instruction,
           student_answer: answer,
@@ -55,7 +56,7 @@ export default function PracticeInterface({ exercise, courseText, onComplete }:
 
     try {
         const res = await fetch(`${API_URL}/api/chat/tutor`, {
-            method: 'POST', headers: { 'Content-Type': 'application/json' },
+            method: 'POST', headers: { 'Content-Type': 'application/json', ...(await authHeaders()) },
             body: JSON.stringify({ message: newMsg.content, history: messages, course_context: courseText })
         });
         const data = await res.json();
@@ -6,6 +6,49 @@ import { useUser } from '@clerk/nextjs';
 
 const API_URL = process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8000';
 
+// Les événements sont regroupés et envoyés par lots (10 événements ou 5 s, ou à la fermeture de l'onglet)
+const FLUSH_EVENTS = 10;
+const FLUSH_DELAY_MS = 5000;
+
+interface AnalyticsEvent {
+  user_id: string;
+  event_type: string;
+  event_data: Record<string, unknown>;
+  created_at: string;
+}
+
+let pending: AnalyticsEvent[] = [];
+let flushTimer: ReturnType<typeof setTimeout> | null = null;
+
+function flush() {
+  if (flushTimer) {
+    clearTimeout(flushTimer);
+    flushTimer = null;
+  }
+  if (pending.length === 0) return;
+
+  const body = JSON.stringify({ events: pending });
+  pending = [];
+
+  // Envoi sans bloquer l'UI (et qui survit à la fermeture de la page)
+  if (navigator.sendBeacon) {
+    navigator.sendBeacon(`${API_URL}/api/analytics/track/batch`, new Blob([body], { type: 'application/json' }));
+  } else {
+    fetch(`${API_URL}/api/analytics/track/batch`, {
+      method: 'POST',
+      body,
+      keepalive: true,
+      headers: { 'Content-Type': 'application/json' }
+    }).catch(() => {});
+  }
+}
+
+function track(event: Omit<AnalyticsEvent, 'created_at'>, immediate = false) {
+  pending.push({ ...event, created_at: new Date().toISOString() });
+  if (immediate || pending.length >= FLUSH_EVENTS) flush();
+  else if (!flushTimer) flushTimer = setTimeout(flush, FLUSH_DELAY_MS);
+}
+
 export function useAnalytics() {
   const pathname = usePathname();
   const { user, isLoaded } = useUser();
@@ -15,61 +58,43 @@ export function useAnalytics() {
   useEffect(() => {
     if (!isLoaded || !user || !user.id) return;
 
-    const trackFeature = async () => {
-      let feature = null;
-      if (pathname.includes('/quiz')) feature = 'Quiz';
-      else if (pathname.includes('/flashcards')) feature = 'Flashcards';
-      else if (pathname.includes('/capture')) feature = 'Capture';
-      else if (pathname.includes('/mastery')) feature = 'Parcours';
-      else if (pathname === '/workspace') feature = 'Dashboard';
-
-      if (feature) {
-        const payload = {
-          user_id: user.id,
-          event_type: 'feature_use',
-          event_data: { feature, path: pathname }
-        };
-
-        // Envoi sécurisé sans bloquer l'UI
-        if (navigator.sendBeacon) {
-            const blob = new Blob([JSON.stringify(payload)], { type: 'application/json' });
-            navigator.sendBeacon(`${API_URL}/api/analytics/track`, blob);
-        } else {
-            // Mode "no-cors" pour éviter les erreurs bloquantes dans la console
-            // (Note: on ne verra pas la réponse, mais ça envoie la requête)
-            fetch(`${API_URL}/api/analytics/track`, {
-                method: 'POST',
-                body: JSON.stringify(payload),
-                mode: 'no-cors',
-                headers: {'Content-Type': 'text/plain'}
-            }).catch(() => {});
-        }
-      }
-    };
+    let feature = null;
+    if (pathname.includes('/quiz')) feature = 'Quiz';
+    else if (pathname.includes('/flashcards')) feature = 'Flashcards';
+    else if (pathname.includes('/capture')) feature = 'Capture';
+    else if (pathname.includes('/mastery')) feature = 'Parcours';
+    else if (pathname === '/workspace') feature = 'Dashboard';
 
-    trackFeature();
+    if (feature) {
+      track({
+        user_id: user.id,
+        event_type: 'feature_use',
+        event_data: { feature, path: pathname }
+      });
+    }
   }, [pathname, user, isLoaded]);
 
-  // 2. Tracker la durée
+  // 2. Tracker la durée (et vider la file quand l'onglet passe en arrière-plan)
   useEffect(() => {
     if (!isLoaded || !user || !user.id) return;
 
     const handleUnload = () => {
       const duration = Math.round((Date.now() - startTime.current) / 1000);
-
-      const payload = {
+      track({
         user_id: user.id,
         event_type: 'session_end',
         event_data: { duration_seconds: duration }
-      };
-
-      const blob = new Blob([JSON.stringify(payload)], { type: 'application/json' });
-      if (navigator.sendBeacon) {
-          navigator.sendBeacon(`${API_URL}/api/analytics/track`, blob);
-      }
+      }, true);
+    };
+    const handleHidden = () => {
+      if (document.visibilityState === 'hidden') flush();
     };
 
     window.addEventListener('beforeunload', handleUnload);
-    return () => window.removeEventListener('beforeunload', handleUnload);
+    document.addEventListener('visibilitychange', handleHidden);
+    return () => {
+      window.removeEventListener('beforeunload', handleUnload);
+      document.removeEventListener('visibilitychange', handleHidden);
+    };
   }, [user, isLoaded]);
-}
\ No newline at end of file
+}
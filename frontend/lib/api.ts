@@ -17,6 +17,7 @@ export interface Quiz {
   questions: QuizQuestion[];
   createdAt: string;
   extractedText: string;
+  courseId?: string;
 }
 
 export interface QuizQuestion {
@@ -44,6 +45,7 @@ export interface ExtractedPage {
   pageNumber: number;
   text: string;
   wordCount: number;
+  error?: string;
 }
 
 export interface ExtractTextResult {
@@ -51,6 +53,18 @@ export interface ExtractTextResult {
   pagesExtracted: number;
   extractedText: string;
   pages: ExtractedPage[];
+  failedPages?: number[];
+  courseId?: string;
+}
+
+export interface CourseInfo {
+  course_id: string;
+  title?: string;
+  chars: number;
+  tokens: number;
+  chunks: number;
+  headings: string[];
+  created_at: number;
 }
 
 // ============================================
@@ -96,6 +110,30 @@ async function handleApiResponse(response: Response): Promise<any> {
   return data;
 }
 
+// ============================================
+// Helper: User token
+// ============================================
+
+// Jeton X-User-Token signé par la route /api/user-token (utilisateur Clerk connecté) : débit par
+// utilisateur, priorité premium et questions déjà vues côté API. Gardé en mémoire, renouvelé avant expiration.
+let userToken: { token: string; expiresAt: number } | null = null;
+
+export async function authHeaders(): Promise<Record<string, string>> {
+  if (!userToken || userToken.expiresAt - 60 < Date.now() / 1000) {
+    try {
+      const response = await fetch('/api/user-token', { method: 'POST' });
+      if (!response.ok) return {};
+      const { token, expires_at } = await response.json();
+      userToken = { token, expiresAt: expires_at };
+    } catch (error) {
+      console.warn('⚠️ User token unavailable, continuing anonymously', error);
+      return {};
+    }
+  }
+
+  return { 'X-User-Token': userToken.token };
+}
+
 // ============================================
 // API Functions
 // ============================================
@@ -117,6 +155,7 @@ export async function extractTextFromMultipleImages(
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
+        ...(await authHeaders()),
       },
       body: JSON.stringify({
         images: images,
@@ -142,6 +181,36 @@ export async function extractTextFromMultipleImages(
   }
 }
 
+/**
+ * Extract text from image files sent as multipart (no base64 inflation)
+ */
+export async function extractTextFromFiles(files: Blob[]): Promise<ExtractTextResult> {
+  const form = new FormData();
+  files.forEach((file, i) => form.append('pages', file, file instanceof File ? file.name : `page-${i + 1}.jpg`));
+
+  const response = await fetch(`${API_BASE_URL}/api/extract-text/upload`, {
+    method: 'POST',
+    headers: await authHeaders(),
+    body: form,
+  });
+  return handleApiResponse(response);
+}
+
+/**
+ * Store a course server-side; later calls can send its course_id instead of the text
+ */
+export async function uploadCourse(text: string, title?: string): Promise<CourseInfo> {
+  const response = await fetch(`${API_BASE_URL}/api/courses`, {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json',
+      ...(await authHeaders()),
+    },
+    body: JSON.stringify({ text, title }),
+  });
+  return handleApiResponse(response);
+}
+
 /**
  * Generate quiz from text
  */
@@ -162,6 +231,7 @@ export async function generateQuizFromText(
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
+        ...(await authHeaders()),
       },
       body: JSON.stringify({
         course_text: courseText,
@@ -188,6 +258,94 @@ export async function generateQuizFromText(
   }
 }
 
+export interface QuizStreamHandlers {
+  onQuestion?: (index: number, question: QuizQuestion) => void;
+  onValidation?: (validation: { accuracy_score: number; is_valid: boolean; issues: any[]; final: boolean }) => void;
+  onReplaced?: (index: number, question: QuizQuestion) => void;
+}
+
+/**
+ * Read a Server-Sent Events response and dispatch each (event, data) pair
+ */
+async function readSseStream(
+  response: Response,
+  onEvent: (event: string, data: any) => void
+): Promise<void> {
+  if (!response.ok || !response.body) {
+    await handleApiResponse(response);
+    throw new Error(`Erreur HTTP ${response.status}`);
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    let separator;
+    while ((separator = buffer.indexOf('\n\n')) !== -1) {
+      const block = buffer.slice(0, separator);
+      buffer = buffer.slice(separator + 2);
+
+      let event = 'message';
+      let data = '';
+      for (const line of block.split('\n')) {
+        if (line.startsWith('event:')) event = line.slice(6).trim();
+        else if (line.startsWith('data:')) data += line.slice(5).trim();
+      }
+      if (data) onEvent(event, JSON.parse(data));
+    }
+  }
+}
+
+/**
+ * Generate quiz from text, streaming each question as soon as it is ready
+ */
+export async function generateQuizFromTextStream(
+  courseText: string,
+  numQuestions: number = 5,
+  difficulty: 'easy' | 'medium' | 'hard' = 'medium',
+  handlers: QuizStreamHandlers = {}
+): Promise<Quiz> {
+  console.log('🌐 API Call: Stream quiz from text', {
+    numQuestions,
+    difficulty,
+    textLength: courseText.length,
+    url: `${API_BASE_URL}/api/quiz/generate-from-text/stream`
+  });
+
+  const response = await fetch(`${API_BASE_URL}/api/quiz/generate-from-text/stream`, {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json',
+      ...(await authHeaders()),
+    },
+    body: JSON.stringify({
+      course_text: courseText,
+      num_questions: numQuestions,
+      difficulty: difficulty,
+    }),
+  });
+
+  let quiz: Quiz | null = null;
+
+  await readSseStream(response, (event, data) => {
+    if (event === 'question') handlers.onQuestion?.(data.index, data.question);
+    else if (event === 'validation') handlers.onValidation?.(data);
+    else if (event === 'replaced') handlers.onReplaced?.(data.index, data.question);
+    else if (event === 'done') quiz = data;
+    else if (event === 'error') throw new Error(data.detail || 'Erreur de génération');
+  });
+
+  if (!quiz) throw new Error('Flux interrompu avant la fin du quiz');
+
+  console.log('✅ API Response: Quiz streamed');
+  return quiz;
+}
+
 /**
  * Generate quiz from image
  */
@@ -208,6 +366,7 @@ export async function generateQuizFromImage(
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
+        ...(await authHeaders()),
       },
       body: JSON.stringify({
         image: image,
@@ -254,6 +413,7 @@ export async function generateFlashcards(
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
+        ...(await authHeaders()),
       },
       body: JSON.stringify({
         course_text: courseText,